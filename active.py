@@ -1,102 +1,75 @@
-import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
-import sqlite3
-from datetime import datetime
+import time
 
-# Database setup
-def setup_database():
-    conn = sqlite3.connect('stock_management.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS companies (
-            id INTEGER PRIMARY KEY,
-            name TEXT,
-            gst_number TEXT,
-            contact TEXT
-        )
-    ''')
-    # cursor.execute('DROP TABLE IF EXISTS purchases')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS customers (
-            id INTEGER PRIMARY KEY,
-            name TEXT,
-            address TEXT,
-            gst_number TEXT,
-            contact TEXT
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY,
-            company_id INTEGER,
-            brand TEXT,
-            product_name TEXT,
-            quantity INTEGER,
-            unit_price REAL,
-            cgst REAL,
-            sgst REAL,
-            cess REAL,
-            purchase_date TEXT,
-            FOREIGN KEY (company_id) REFERENCES companies (id)
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS gst_slabs (
-            id INTEGER PRIMARY KEY,
-            gst_rate REAL
-        )
-    ''')
+# Taken before the other imports so the start-up report includes them
+LAUNCHED = time.perf_counter()
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            year INTEGER PRIMARY KEY,
-            last_invoice_number INTEGER
-        )
-    ''')
-
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS purchases (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    transaction_id TEXT,
-    product_name TEXT,
-    quantity INTEGER,
-    unit_price REAL,
-    total_price REAL,
-    purchase_date DATETIME
-    );
-    ''')
-                   
-    # Create billing table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS billing (
-            bill_number INTEGER PRIMARY KEY,
-            customer_name TEXT,
-            total_amount REAL,
-            bill_date TEXT
-        )
-    ''')
-    # Initialize the settings table for the current year
-    current_year = datetime.now().year
-    cursor.execute("INSERT OR IGNORE INTO settings (year, last_invoice_number) VALUES (?, ?)", (current_year, 0))
-
-    conn.commit()
-    conn.close()
+import argparse
+import threading
+import tkinter as tk
+from dataclasses import replace
+from tkinter import ttk, filedialog, messagebox, simpledialog
+
+from bill_draft import BillDraft
+from database import Database, get_db
+from db_worker import DBWorker
+from diagnostics import StartupTimer, install as install_diagnostics
+from export import REGISTERS, export, parse_day
+from invoices import InvoiceAllocator
+from lots import parse_expiry
+from migrations import migrate
+from paged_view import Debounced, paged_tree
+from services import BillingService, InventoryService, PurchaseService, StockItem, line_total, split_gst
+from tax import from_paise
+
+# Statements slower than SLOW_QUERY_MS are appended here with their query plan
+SLOW_QUERY_LOG = 'slow_queries.log'
+
+# How often an open Diagnostics window refreshes, in ms
+DIAGNOSTICS_REFRESH_MS = 2000
+
+# Invoice numbers reserved per trip to the database. Raise this on busy
+# counters sharing one file; unused numbers are skipped when the app closes.
+INVOICE_BLOCK_SIZE = 1
+
+# Database setup: on an up-to-date file this is a single read of
+# PRAGMA user_version. The invoice allocator creates each financial year's
+# settings row when it first needs it, so start-up writes nothing.
+def setup_database():
+    migrate(get_db())
 
 # Main Application Class
 class StockManagementApp:
-    def __init__(self, root):
+    def __init__(self, root, remote=None, startup=None):
         self.root = root
+        # Start-up milestones, shown in the Diagnostics window
+        self.startup = startup or StartupTimer()
         self.root.title("Stock Management System")
         self.root.geometry("800x600")
 
-        # Initialize total CGST and SGST
-        self.total_cgst = 0.0
-        self.total_sgst = 0.0
-
-        # List to store added items
-        self.added_items = []
+        # All stock, purchase and billing logic lives in the services; the
+        # windows only read widgets and show results. With remote (a
+        # client.RemoteServices) they are a server's, see server.py.
+        if remote is None:
+            db = get_db()
+            self.monitor = install_diagnostics(db, log_path=SLOW_QUERY_LOG)
+            self.inventory = InventoryService(db)
+            self.purchases = PurchaseService(db, self.inventory)
+            self.billing = BillingService(db, self.inventory, InvoiceAllocator(db, block_size=INVOICE_BLOCK_SIZE))
+            interrupt = db.conn.interrupt
+        else:
+            self.root.title(f"Stock Management System - {remote.url}")
+            self.monitor = None
+            self.inventory, self.purchases, self.billing = remote.inventory, remote.purchases, remote.billing
+            interrupt = None
+
+        # Every service call runs on the database worker thread; results come
+        # back to the Tk thread, so slow disks never freeze the window
+        self.worker = DBWorker(root, interrupt=interrupt, on_busy=self.show_busy)
+        if remote is None:
+            self.worker.submit(self.check_schema)
+
+        # The bill being built in the Generate Bill window
+        self.bill_draft = BillDraft()
         
         self.company_window = None
         self.product_window = None
@@ -104,7 +77,14 @@ class StockManagementApp:
         self.temp_products = [] # Temporary list to store products
         self.setup_menu()  # Set up the menu
         self.setup_ui()
+
+        # Idle callbacks run in order, so this one follows the first drawing
+        self.root.after_idle(self.startup.mark, "first paint")
+
+    def check_schema(self):
+        # Runs on the worker ahead of every query the windows submit
         setup_database()
+        self.startup.mark("schema checked")
     
     def setup_menu(self):
         # Create a menu bar
@@ -115,6 +95,8 @@ class StockManagementApp:
         file_menu.add_command(label="Add GST Slab", command=self.add_gst_slab)
         file_menu.add_command(label="View Purchases", command=self.open_purchases_window)  # New method
         file_menu.add_command(label="View Bills", command=self.open_bills_window)  # New method
+        file_menu.add_command(label="Export Registers", command=self.open_export_window)
+        file_menu.add_command(label="Diagnostics", command=self.open_diagnostics_window)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.root.quit)
         menubar.add_cascade(label="☰", menu=file_menu)
@@ -128,10 +110,12 @@ class StockManagementApp:
         self.main_frame.pack(fill=tk.BOTH, expand=True)
 
         # Product List
-        self.product_list = ttk.Treeview(self.main_frame, columns=("Company", "Brand", "Product Name", "Quantity", "Unit Price", "CGST", "SGST", "CESS", "Purchase Date"), show='headings')
-        for col in self.product_list["columns"]:
-            self.product_list.heading(col, text=col)
-        self.product_list.pack(fill=tk.BOTH, expand=True)
+        product_frame, self.product_list, self.product_pager = paged_tree(
+            self.main_frame,
+            ("Company", "Brand", "Product Name", "Quantity", "Unit Price", "CGST", "SGST", "CESS", "Purchase Date"),
+            self.inventory.products_source(), noun="products", worker=self.worker)
+        product_frame.pack(fill=tk.BOTH, expand=True)
+        self.product_pager.follow(self.inventory.changes, "products")
 
         # Buttons
         button_frame = ttk.Frame(self.main_frame)
@@ -142,8 +126,22 @@ class StockManagementApp:
         ttk.Button(button_frame, text="Add Stock", command=self.add_product).pack(side=tk.LEFT, padx=5, pady=5)
         ttk.Button(button_frame, text="Generate Bill", command=self.generate_bill).pack(side=tk.LEFT, padx=5, pady=5)
 
-        # Load products on startup 
-        self.load_products()
+        # Busy indicator, shown while the database worker has work queued
+        self.busy_bar = ttk.Progressbar(button_frame, mode="indeterminate", length=120)
+        self.busy_label = ttk.Label(button_frame, text="Working...")
+
+        # The window shows right away; the first page of products follows
+        self.product_pager.reload(on_loaded=lambda: self.startup.mark("first data"))
+
+    def show_busy(self, pending):
+        if pending and not self.busy_bar.winfo_ismapped():
+            self.busy_bar.pack(side=tk.RIGHT, padx=5)
+            self.busy_label.pack(side=tk.RIGHT)
+            self.busy_bar.start(10)
+        elif not pending and self.busy_bar.winfo_ismapped():
+            self.busy_bar.stop()
+            self.busy_bar.pack_forget()
+            self.busy_label.pack_forget()
 
     def add_gst_slab(self):
         # Function to add GST Slab
@@ -152,82 +150,32 @@ class StockManagementApp:
         
         if slab and rate is not None:
             # Insert into the database
-            conn = sqlite3.connect('stock_management.db')
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO gst_slabs (gst_rate) VALUES (?)", (rate,))
-            conn.commit()
-            conn.close()
-            messagebox.showinfo("Success", f"GST Slab {slab} with rate {rate}% added successfully.")
+            self.worker.submit(self.inventory.add_gst_slab, rate, on_done=lambda _: messagebox.showinfo(
+                "Success", f"GST Slab {slab} with rate {rate}% added successfully."))
         else:
             messagebox.showwarning("Input Error", "Please enter valid slab and rate.")
 
     def load_products(self):
-        # Clear the current items in the Treeview
-        for item in self.product_list.get_children():
-            self.product_list.delete(item)
-
-        # Fetch products from the database
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT c.name, p.brand, p.product_name, p.quantity, p.unit_price, p.cgst, p.sgst, p.cess, p.purchase_date
-            FROM products p
-            JOIN companies c ON p.company_id = c.id
-        ''')
-        products = cursor.fetchall()
-        conn.close()
-
-        # Insert fetched products into the Treeview
-        for product in products:
-            self.product_list.insert("", "end", values=product)
-
-    def save_purchase(self, product_name, quantity, unit_price, total_price):
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO purchases (product_name, quantity, unit_price, total_price, purchase_date)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (product_name, quantity, unit_price, total_price, datetime.now()))
-        conn.commit()
-        conn.close()
-
-    def save_bill(self, customer_name, total_amount):
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO billing (customer_name, total_amount, bill_date)
-            VALUES (?, ?, ?)
-        ''', (customer_name, total_amount, datetime.now()))
-        conn.commit()
-        conn.close()
+        # Show the first page of products; more are fetched while scrolling
+        self.product_pager.reload()
 
     def open_purchases_window(self):
         purchases_window = tk.Toplevel(self.root)
         purchases_window.title("Purchases")
 
         # Create a Treeview for displaying purchases
-        self.purchases_tree = ttk.Treeview(purchases_window, columns=("Transaction ID", "Product Name", "Quantity", "Unit Price", "Total Price", "Purchase Date"), show='headings')
-        for col in self.purchases_tree["columns"]:
-            self.purchases_tree.heading(col, text=col)
-        self.purchases_tree.pack(fill=tk.BOTH, expand=True)
+        purchases_frame, self.purchases_tree, self.purchases_pager = paged_tree(
+            purchases_window,
+            ("Transaction ID", "Product Name", "Quantity", "Unit Price", "Total Price", "Purchase Date"),
+            self.purchases.purchases_source(), noun="purchases", worker=self.worker)
+        purchases_frame.pack(fill=tk.BOTH, expand=True)
+        self.purchases_pager.follow(self.purchases.changes, "purchases")
 
         # Load purchases into the Treeview
         self.load_purchases()
 
     def load_purchases(self):
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM purchases')
-        purchases = cursor.fetchall()
-        conn.close()
-
-        # Clear existing entries in the Treeview
-        for row in self.purchases_tree.get_children():
-            self.purchases_tree.delete(row)
-
-        # Insert new entries
-        for purchase in purchases:
-            self.purchases_tree.insert("", tk.END, values=(purchase[0], purchase[1], purchase[2], purchase[3], purchase[4], purchase[5]))
+        self.purchases_pager.reload()
 
     def add_company(self):
         if self.company_window is not None and self.company_window.winfo_exists():
@@ -264,14 +212,10 @@ class StockManagementApp:
         contact = self.contact_entry.get()
 
         # Insert the company data into the database
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO companies (name, gst_number, contact) VALUES (?, ?, ?)
-        ''', (company_name, gst_number, contact))
-        conn.commit()
-        conn.close()
+        self.worker.submit(self.inventory.add_company, company_name, gst_number, contact,
+                           on_done=self.company_saved)
 
+    def company_saved(self, company_id):
         # Clear the entry fields
         self.company_name_entry.delete(0, tk.END)
         self.gst_number_entry.delete(0, tk.END)
@@ -321,8 +265,8 @@ class StockManagementApp:
         self.customer_name_entry.pack(pady=5)
 
         tk.Label(scrollable_frame, text="GST Number (optional):").pack(pady=5)
-        self.gst_number_entry = tk.Entry(scrollable_frame)
-        self.gst_number_entry.pack(pady=5)
+        self.customer_gst_entry = tk.Entry(scrollable_frame)
+        self.customer_gst_entry.pack(pady=5)
 
         tk.Label(scrollable_frame, text="Contact Number:").pack(pady=5)
         self.contact_number_entry = tk.Entry(scrollable_frame)
@@ -339,28 +283,21 @@ class StockManagementApp:
         customer_name = self.customer_name_entry.get()
         contact_number = self.contact_number_entry.get()
         address = self.address_entry.get()
+        # Optional; customers with one are billed as B2B in the GST returns
+        gst_number = self.customer_gst_entry.get().strip()
 
-        # Validate inputs
-        if not customer_name or not contact_number or not address:
-            messagebox.showerror("Error", "Please fill in all required fields.")
-            return
-
-        # Connect to the database and insert the customer
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO customers (name, contact, address, gst_number) VALUES (?, ?, ?, ?)
-        ''', (customer_name, contact_number, address, ""))  # Assuming gst_number is optional
-        conn.commit()
-        conn.close()
+        # Validate and insert the customer
+        self.worker.submit(self.billing.add_customer, customer_name, contact_number, address, gst_number,
+                           on_done=self.customer_saved)
 
+    def customer_saved(self, customer_id):
         messagebox.showinfo("Success", "Customer added successfully!")
 
         # Clear the entry fields
         self.customer_name_entry.delete(0, tk.END)
         self.contact_number_entry.delete(0, tk.END)
         self.address_entry.delete(0, tk.END)
-        self.gst_number_entry.delete(0, tk.END)  # Clear GST number field
+        self.customer_gst_entry.delete(0, tk.END)  # Clear GST number field
 
         # Close the customer window
         if self.customer_window is not None:
@@ -445,6 +382,10 @@ class StockManagementApp:
         self.cess_entry = tk.Entry(scrollable_frame)
         self.cess_entry.grid(row=9, column=1, padx=5, pady=5)
 
+        tk.Label(scrollable_frame, text="Expiry Date (YYYY-MM-DD, optional):").grid(row=10, column=0, padx=5, pady=5, sticky="w")
+        self.expiry_entry = tk.Entry(scrollable_frame)
+        self.expiry_entry.grid(row=10, column=1, padx=5, pady=5)
+
         # Create a Treeview for displaying added products
         self.temp_products_tree = ttk.Treeview(scrollable_frame, columns=("Transaction ID", "Brand", "Product Name", "Quantity", "Unit Price"), show='headings')
         self.temp_products_tree.heading("Transaction ID", text="Transaction ID")
@@ -454,16 +395,16 @@ class StockManagementApp:
         self.temp_products_tree.heading("Unit Price", text="Unit Price")
 
         # Use sticky to make the Treeview expand in all directions
-        self.temp_products_tree.grid(row=10, column=0, columnspan=2, sticky="nsew", pady=10)
+        self.temp_products_tree.grid(row=11, column=0, columnspan=2, sticky="nsew", pady=10)
 
         # Configure grid weights to allow the Treeview to expand
-        scrollable_frame.grid_rowconfigure(10, weight=1)
+        scrollable_frame.grid_rowconfigure(11, weight=1)
         scrollable_frame.grid_columnconfigure(0, weight=1)
         scrollable_frame.grid_columnconfigure(1, weight=1)
 
         # Button frame for actions
         button_frame = ttk.Frame(scrollable_frame)
-        button_frame.grid(row=11, column=0, columnspan=2, pady=5)
+        button_frame.grid(row=12, column=0, columnspan=2, pady=5)
 
         # Button to add product to the temporary list
         ttk.Button(button_frame, text="Add Product", command=self.add_product_to_list).pack(side=tk.LEFT, padx=5)
@@ -485,6 +426,7 @@ class StockManagementApp:
         cgst = self.cgst_entry.get()  # Get CGST value
         sgst = self.sgst_entry.get()  # Get SGST value
         cess = self.cess_entry.get()  # Get CESS value
+        expiry_date = self.expiry_entry.get().strip()
 
         # Validate inputs
         if not transaction_id or not brand or not product_name or not quantity or not unit_price:
@@ -498,8 +440,14 @@ class StockManagementApp:
             messagebox.showerror("Error", "Please enter valid numbers for quantity and unit price.")
             return
 
-        # Add product details to the Treeview, including CGST, SGST, and CESS
-        self.temp_products_tree.insert("", "end", values=(transaction_id, brand, product_name, quantity, unit_price, cgst, sgst, cess))
+        try:
+            expiry_date = parse_expiry(expiry_date) or ""
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+
+        # Add product details to the Treeview, including CGST, SGST, CESS and expiry
+        self.temp_products_tree.insert("", "end", values=(transaction_id, brand, product_name, quantity, unit_price, cgst, sgst, cess, expiry_date))
 
         # Refresh the Treeview
         self.temp_products_tree.update_idletasks()
@@ -512,11 +460,7 @@ class StockManagementApp:
         self.cgst_entry.delete(0, tk.END)
         self.sgst_entry.delete(0, tk.END)
         self.cess_entry.delete(0, tk.END)
-
-        # Debugging: Print the current items in the Treeview
-        print("Current items in Treeview:")
-        for item in self.temp_products_tree.get_children():
-            print(self.temp_products_tree.item(item, "values"))
+        self.expiry_entry.delete(0, tk.END)
 
     def finalize_purchase(self):
         # Check if there are any products in the temporary Treeview
@@ -532,109 +476,54 @@ class StockManagementApp:
             messagebox.showerror("Error", "Transaction ID cannot be empty.")
             return
 
-        # Connect to the database
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
-
+        # Read every row first, so a bad row leaves nothing half-saved
+        items = []
         for item in self.temp_products_tree.get_children():
-            values = self.temp_products_tree.item(item, "values")
-
-            # Unpack all values from the Treeview
-            transaction_id, brand, product_name, quantity, unit_price, cgst, sgst, cess = values
-
-            # Convert quantity and unit_price to appropriate types
+            _, brand, product_name, quantity, unit_price, cgst, sgst, cess, expiry_date = self.temp_products_tree.item(item, "values")
             try:
-                quantity = int(quantity)
-                unit_price = float(unit_price)
-                cgst = float(cgst)
-                sgst = float(sgst)
-                cess = float(cess)
+                items.append(StockItem(brand, product_name, int(quantity), float(unit_price),
+                                       float(cgst or 0), float(sgst or 0), float(cess or 0), expiry_date or None))
             except ValueError:
                 messagebox.showerror("Error", "Quantity, Unit Price, and tax values must be valid numbers.")
                 return
 
-            # Format the current datetime as a string
-            purchase_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-            # Check if the product already exists in the products table based on name, brand, and company
-            cursor.execute('''
-                SELECT id, unit_price FROM products 
-                WHERE product_name = ? AND brand = ? AND company_id = ?
-            ''', (product_name, brand, self.company_combobox.get()))
-            product_data = cursor.fetchone()
-
-            if product_data:
-                # Product exists
-                product_id, existing_price = product_data
-
-                if existing_price != unit_price:
-                    # If the price has changed, insert a new product record
-                    cursor.execute('''
-                        INSERT INTO products (company_id, brand, product_name, quantity, unit_price, cgst, sgst, cess, purchase_date)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (self.company_combobox.get(), brand, product_name, quantity, unit_price, cgst, sgst, cess, purchase_date))
-                else:
-                    # If the price is the same, just update the quantity
-                    cursor.execute('''
-                        UPDATE products
-                        SET quantity = quantity + ?
-                        WHERE id = ?
-                    ''', (quantity, product_id))
-            else:
-                # Product does not exist, insert it as a new product
-                cursor.execute('''
-                    INSERT INTO products (company_id, brand, product_name, quantity, unit_price, cgst, sgst, cess, purchase_date)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (self.company_combobox.get(), brand, product_name, quantity, unit_price, cgst, sgst, cess, purchase_date))
-
-            # Save purchase to the database
-            cursor.execute('''
-                INSERT INTO purchases (transaction_id, product_name, quantity, unit_price, total_price, purchase_date)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (transaction_id, product_name, quantity, unit_price, quantity * unit_price, purchase_date))
-
-            # Update the main product list with relevant data
-            # Assuming you have a way to get the company name, e.g., from the combobox
-            selected_company = self.company_combobox.get()  # Get selected company
-            self.product_list.insert("", "end", values=(selected_company, brand, product_name, quantity, unit_price, cgst, sgst, cess, purchase_date))
-
-        conn.commit()
-        conn.close()
+        # Raise stock and record the purchase in one transaction; the product
+        # grids pick up the new and changed rows once it commits
+        self.worker.submit(self.purchases.receive_stock, self.company_combobox.get(), transaction_id, items,
+                           on_done=self.purchase_saved)
 
+    def purchase_saved(self, result):
         messagebox.showinfo("Success", "All products have been finalized and saved successfully!")
 
         # Clear the temporary Treeview after finalization
-        for item in self.temp_products_tree.get_children():
-            self.temp_products_tree.delete(item)
-    
+        if self.temp_products_tree.winfo_exists():
+            for item in self.temp_products_tree.get_children():
+                self.temp_products_tree.delete(item)
 
     def load_companies(self):
         # Load companies from the database into the combobox
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM companies")
-        companies = cursor.fetchall()
-        self.company_combobox['values'] = [company[0] for company in companies]
-        conn.close()
+        combobox = self.company_combobox
+        self.worker.submit(self.inventory.company_names, on_done=lambda names: self.fill_combobox(combobox, names))
 
     def load_gst_slabs(self):
         # Load GST slabs from the database into the combobox
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT gst_rate FROM gst_slabs")
-        gst_slabs = cursor.fetchall()
-        self.gst_slab_combobox['values'] = [gst[0] for gst in gst_slabs]
-        conn.close()
+        combobox = self.gst_slab_combobox
+        self.worker.submit(self.inventory.gst_rates, on_done=lambda rates: self.fill_combobox(combobox, rates))
+
+    def fill_combobox(self, combobox, values):
+        # The window may have been closed while the values were loading
+        if combobox.winfo_exists():
+            combobox['values'] = values
 
     def update_gst_values(self, event):
         # Get the selected GST slab and update CGST and SGST
         selected_gst = self.gst_slab_combobox.get()
         if selected_gst:
-            gst_rate = float(selected_gst)
+            cgst, sgst = split_gst(float(selected_gst))
             self.cgst_entry.delete(0, tk.END)
-            self.cgst_entry.insert(0, f"{gst_rate / 2:.2f}")
+            self.cgst_entry.insert(0, f"{cgst:.2f}")
             self.sgst_entry.delete(0, tk.END)
-            self.sgst_entry.insert(0, f"{gst_rate / 2:.2f}")
+            self.sgst_entry.insert(0, f"{sgst:.2f}")
 
     def calculate_total(self):
         # Calculate total price based on quantity, unit price, CGST, SGST, and CESS
@@ -644,19 +533,17 @@ class StockManagementApp:
             cgst = float(self.cgst_entry.get())
             sgst = float(self.sgst_entry.get())
             cess = float(self.cess_entry.get())
-            cgstrate = cgst/100
-            sgstrate = sgst/100
-            cessrate = cess/100
-            cgst_levied = unit_price*cgstrate
-            sgst_levied = unit_price*sgstrate
-            cess_levied = unit_price*cessrate
-            gst=cgst_levied+sgst_levied
-            total = (unit_price+cgst_levied+sgst_levied+cess_levied) * quantity
+            total = line_total(quantity, unit_price, cgst, sgst, cess)
             self.total_price_label.config(text=f"{total:.2f}")
         except ValueError:
             messagebox.showerror("Error", "Please enter valid numbers for quantity, unit price, and taxes.")
 
     def generate_bill(self):
+        # Start a fresh bill
+        self.bill_draft = BillDraft()
+        self.selected_product_id = None
+        self.selected_product_name = None
+
         # Create a new window for bill generation
         self.bill_window = tk.Toplevel(self.root)
         self.bill_window.title("Generate Bill")
@@ -665,25 +552,34 @@ class StockManagementApp:
 
         # Customer selection dropdown
         tk.Label(self.bill_window, text="Select Customer:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
-        self.customer_dropdown = ttk.Combobox(self.bill_window, values=self.fetch_customers())
+        self.customer_dropdown = ttk.Combobox(self.bill_window)
         self.customer_dropdown.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
+        combobox = self.customer_dropdown
+        self.worker.submit(self.fetch_customers, on_done=lambda names: self.fill_combobox(combobox, names))
 
         # Bind the customer selection event to update the address
         self.customer_dropdown.bind("<<ComboboxSelected>>", self.on_customer_select)
 
+        # Typing in the dropdown narrows it to matching customers
+        self.customer_dropdown.bind("<KeyRelease>", Debounced(self.customer_dropdown, self.search_customers))
+
         # Display customer address
         tk.Label(self.bill_window, text="Customer Address:").grid(row=1, column=0, padx=5, pady=5, sticky="w")
         self.customer_address_label = tk.Label(self.bill_window, text="")
         self.customer_address_label.grid(row=1, column=1, padx=5, pady=5, sticky="ew")
 
         # Product selection Treeview
-        tk.Label(self.bill_window, text="Available Products:").grid(row=2, column=0, padx=5, pady=5, sticky="w", columnspan=2)
-        self.product_treeview = ttk.Treeview(self.bill_window, columns=("Brand", "Product Name", "Quantity", "Unit Price"), show='headings')
-        self.product_treeview.heading("Brand", text="Brand")
-        self.product_treeview.heading("Product Name", text="Product Name")
-        self.product_treeview.heading("Quantity", text="Quantity")
-        self.product_treeview.heading("Unit Price", text="Unit Price")
-        self.product_treeview.grid(row=3, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+        tk.Label(self.bill_window, text="Available Products:").grid(row=2, column=0, padx=5, pady=5, sticky="w")
+        self.product_search_entry = ttk.Entry(self.bill_window)
+        self.product_search_entry.grid(row=2, column=1, padx=5, pady=5, sticky="ew")
+        search_products = Debounced(self.product_search_entry, self.search_products)
+        self.product_search_entry.bind("<KeyRelease>", search_products)
+        self.product_search_entry.bind("<Return>", search_products.flush)
+        product_frame, self.product_treeview, self.bill_product_pager = paged_tree(
+            self.bill_window, ("Brand", "Product Name", "Quantity", "Unit Price"),
+            self.inventory.stock_source(), noun="products", worker=self.worker)
+        product_frame.grid(row=3, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+        self.bill_product_pager.follow(self.inventory.changes, "products")
 
         # Configure grid weights for resizing
         self.bill_window.grid_rowconfigure(3, weight=1)  # Allow the Treeview to expand
@@ -708,104 +604,226 @@ class StockManagementApp:
         # Button to add item to bill
         ttk.Button(self.bill_window, text="Add Item", command=self.add_item_to_bill).grid(row=6, column=0, columnspan=2, padx=5, pady=10)
 
-        # Create a frame to hold the text area and scrollbars
+        # Lines on the bill, one per product (the item id is the product id)
         bill_frame = ttk.Frame(self.bill_window)
         bill_frame.grid(row=7, column=0, columnspan=2, padx=5, pady=10, sticky="nsew")
-        
-        # Create a vertical scrollbar
         self.bill_scrollbar = ttk.Scrollbar(bill_frame, orient="vertical")
         self.bill_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        # Create the text area
-        self.bill_text_area = tk.Text(bill_frame, height=10, width=50, yscrollcommand=self.bill_scrollbar.set)
-        self.bill_text_area.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        
-        # Configure the scrollbar
-        self.bill_scrollbar.config(command=self.bill_text_area.yview)
+        bill_columns = ("Product", "Quantity", "Price", "CGST", "SGST", "CESS", "Total")
+        self.bill_lines_tree = ttk.Treeview(bill_frame, columns=bill_columns, show='headings', height=8,
+                                            yscrollcommand=self.bill_scrollbar.set)
+        for col in bill_columns:
+            self.bill_lines_tree.heading(col, text=col)
+            self.bill_lines_tree.column(col, width=150 if col == "Product" else 70, anchor="w" if col == "Product" else "e")
+        self.bill_lines_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.bill_scrollbar.config(command=self.bill_lines_tree.yview)
+        self.bill_window.grid_rowconfigure(7, weight=1)
+
+        # Edit the selected line, and the bill's running totals
+        line_buttons = ttk.Frame(self.bill_window)
+        line_buttons.grid(row=8, column=0, columnspan=2, padx=5, sticky="ew")
+        ttk.Button(line_buttons, text="Change Quantity", command=self.change_bill_line_quantity).pack(side=tk.LEFT, padx=5)
+        ttk.Button(line_buttons, text="Remove Line", command=self.remove_bill_line).pack(side=tk.LEFT, padx=5)
+        self.bill_totals_label = ttk.Label(line_buttons, anchor="e")
+        self.bill_totals_label.pack(side=tk.RIGHT, padx=5)
+        self.show_bill_totals()
 
         # Button to generate the final bill
-        ttk.Button(self.bill_window, text="Generate Bill", command=self.finalize_bill).grid(row=8, column=0, columnspan=2, padx=5, pady=10)
-    
-    def save_bill(self, invoice_number, customer_name):
-        # Save the bill details to a file or database
-        with open(f"bill_{invoice_number}.txt", "w") as bill_file:
-            bill_file.write(self.bill_text_area.get("1.0", tk.END))
-        messagebox.showinfo("Success", f"Bill saved as bill_{invoice_number}.txt")
+        ttk.Button(self.bill_window, text="Generate Bill", command=self.finalize_bill).grid(row=9, column=0, columnspan=2, padx=5, pady=10)
     
+    def bill_saved(self, result):
+        text, paths = result
+        # The bill as printed, read-only; the draft tree is already empty
+        bill_view = tk.Toplevel(self.root)
+        bill_view.title("Saved Bill")
+        bill_text = tk.Text(bill_view, height=25, width=90)
+        bill_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        bill_text.insert(tk.END, text)
+        bill_text.config(state=tk.DISABLED)
+        messagebox.showinfo("Success", "Bill saved as " + ", ".join(paths), parent=bill_view)
+
     def open_bills_window(self):
         bills_window = tk.Toplevel(self.root)
         bills_window.title("Bills")
 
         # Create a Treeview for displaying bills
-        self.bills_tree = ttk.Treeview(bills_window, columns=("Bill Number", "Customer Name", "Total Amount", "Bill Date"), show='headings')
-        for col in self.bills_tree["columns"]:
-            self.bills_tree.heading(col, text=col)
-        self.bills_tree.pack(fill=tk.BOTH, expand=True)
+        bills_frame, self.bills_tree, self.bills_pager = paged_tree(
+            bills_window, ("Bill Number", "Customer Name", "Total Amount", "Bill Date"),
+            self.billing.bills_source(), noun="bills", worker=self.worker)
+        bills_frame.pack(fill=tk.BOTH, expand=True)
+        self.bills_pager.follow(self.billing.changes, "billing")
 
-        # Add a filter section
+        # Add a search section; results update while typing
         filter_frame = ttk.Frame(bills_window)
         filter_frame.pack(pady=10)
 
-        ttk.Label(filter_frame, text="Filter by Customer Name:").grid(row=0, column=0, padx=5)
+        ttk.Label(filter_frame, text="Search Customer or Invoice:").grid(row=0, column=0, padx=5)
         self.customer_filter_entry = ttk.Entry(filter_frame)
         self.customer_filter_entry.grid(row=0, column=1, padx=5)
 
-        ttk.Button(filter_frame, text="Apply Filter", command=self.filter_bills).grid(row=0, column=2, padx=5)
+        search_bills = Debounced(self.customer_filter_entry, self.filter_bills)
+        self.customer_filter_entry.bind("<KeyRelease>", search_bills)
+        self.customer_filter_entry.bind("<Return>", search_bills.flush)
+        ttk.Button(filter_frame, text="Search", command=search_bills.flush).grid(row=0, column=2, padx=5)
+        ttk.Button(filter_frame, text="Reprint Selected", command=self.reprint_selected_bills).grid(
+            row=0, column=3, padx=5)
 
         # Load bills into the Treeview
         self.load_bills()
 
-    def load_bills(self):
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM billing')
-        bills = cursor.fetchall()
-        conn.close()
-    
-        # Clear existing entries in the Treeview
-        for row in self.bills_tree.get_children():
-            self.bills_tree.delete(row)
-    
-        # Insert new entries
-        for bill in bills:
-            self.bills_tree.insert("", tk.END, values=(bill[0], bill[1], bill[2], bill[3]))
+    def reprint_selected_bills(self):
+        # Rows are keyed by bill number
+        bill_numbers = [int(iid) for iid in self.bills_tree.selection()]
+        if not bill_numbers:
+            messagebox.showwarning("Warning", "Please select the bills to reprint.")
+            return
+        self.worker.submit(self.billing.reprint_bills, bill_numbers, on_done=self.bills_reprinted)
 
-    def filter_bills(self):
-        customer_name = self.customer_filter_entry.get()
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
+    def bills_reprinted(self, paths):
+        if len(paths) == 1:
+            messagebox.showinfo("Success", f"Bill saved as {paths[0]}")
+        else:
+            messagebox.showinfo("Success", f"Saved {len(paths)} bill files.")
+
+    def open_export_window(self):
+        if self.monitor is None:
+            messagebox.showinfo("Export", "This counter works through the server; run export.py on the server instead.")
+            return
+        export_window = tk.Toplevel(self.root)
+        export_window.title("Export Registers")
+
+        ttk.Label(export_window, text="Register:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
+        register_combobox = ttk.Combobox(export_window, values=sorted(REGISTERS), state="readonly")
+        register_combobox.set("bills")
+        register_combobox.grid(row=0, column=1, padx=5, pady=5)
+        ttk.Label(export_window, text="From (YYYY-MM-DD):").grid(row=1, column=0, padx=5, pady=5, sticky="w")
+        start_entry = ttk.Entry(export_window)
+        start_entry.grid(row=1, column=1, padx=5, pady=5)
+        ttk.Label(export_window, text="To (YYYY-MM-DD):").grid(row=2, column=0, padx=5, pady=5, sticky="w")
+        end_entry = ttk.Entry(export_window)
+        end_entry.grid(row=2, column=1, padx=5, pady=5)
+
+        def start_export():
+            register = register_combobox.get()
+            try:
+                start_day, end_day = parse_day(start_entry.get()), parse_day(end_entry.get())
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            path = filedialog.asksaveasfilename(
+                parent=export_window, initialfile=f"{register}.csv", defaultextension=".csv",
+                filetypes=[("CSV", "*.csv"), ("Compressed CSV", "*.csv.gz"), ("Parquet", "*.parquet")])
+            if not path:
+                return
+            export_window.destroy()
+            self.export_register(register, path, start_day, end_day)
+
+        ttk.Button(export_window, text="Export", command=start_export).grid(row=3, column=1, padx=5, pady=10, sticky="e")
+
+    def export_register(self, register, path, start_day, end_day):
+        # Years of rows can take a while, so the export reads through its own
+        # connection on its own thread and the worker stays free for the
+        # windows
+        db_path = get_db().path
+
+        def run():
+            db = Database(db_path)
+            try:
+                count = export(db, register, path, start_day, end_day)
+            except Exception as e:
+                self.worker.call_soon(messagebox.showerror, "Error", f"Export failed: {e}")
+            else:
+                self.worker.call_soon(messagebox.showinfo, "Success", f"Exported {count} {register} rows to {path}")
+            finally:
+                db.close()
 
-        # Query to filter bills by customer name
-        cursor.execute('SELECT * FROM billing WHERE customer_name LIKE ?', ('%' + customer_name + '%',))
-        filtered_bills = cursor.fetchall()
-        conn.close()
+        threading.Thread(target=run, name="export", daemon=True).start()
 
-        # Clear existing entries in the Treeview
-        for row in self.bills_tree.get_children():
-            self.bills_tree.delete(row)
+    def open_diagnostics_window(self):
+        if self.monitor is None:
+            messagebox.showinfo("Diagnostics", "This counter runs its queries on the server, so there is nothing to record here.")
+            return
+        diagnostics_window = tk.Toplevel(self.root)
+        diagnostics_window.title("Diagnostics")
+        diagnostics_window.geometry("900x600")
+
+        # Latency per call site; select one to see its statements
+        site_columns = ("Call Site", "Calls", "Statements", "Rows", "Errors", "p50 ms", "p95 ms", "p99 ms", "Max ms")
+        sites_tree = ttk.Treeview(diagnostics_window, columns=site_columns, show='headings', height=10)
+        for col in site_columns:
+            sites_tree.heading(col, text=col)
+            sites_tree.column(col, width=260 if col == "Call Site" else 70, anchor="w" if col == "Call Site" else "e")
+        sites_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+        sql_columns = ("Statement", "Calls", "Rows", "p50 ms", "p95 ms", "p99 ms", "Max ms")
+        sql_tree = ttk.Treeview(diagnostics_window, columns=sql_columns, show='headings', height=6)
+        for col in sql_columns:
+            sql_tree.heading(col, text=col)
+            sql_tree.column(col, width=400 if col == "Statement" else 70, anchor="w" if col == "Statement" else "e")
+        sql_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+        # Slow-query log with plans, and reference-cache hit rates
+        ttk.Label(diagnostics_window, text=f"Slow queries (over {self.monitor.slow_ms} ms):").pack(anchor="w", padx=5)
+        slow_text = tk.Text(diagnostics_window, height=8)
+        slow_text.pack(fill=tk.BOTH, expand=True, padx=5)
+        cache_label = ttk.Label(diagnostics_window, anchor="w")
+        cache_label.pack(fill=tk.X, padx=5, pady=5)
+        ttk.Label(diagnostics_window, anchor="w", text=f"Start-up: {self.startup.report()}").pack(fill=tk.X, padx=5)
+
+        def show_statements(event=None):
+            sql_tree.delete(*sql_tree.get_children())
+            selected = sites_tree.selection()
+            if not selected:
+                return
+            for sql, calls, rows, p50, p95, p99, worst in self.monitor.statements(sites_tree.item(selected[0], "text")):
+                sql_tree.insert("", "end", values=(sql, calls, rows, f"{p50:.2f}", f"{p95:.2f}", f"{p99:.2f}", f"{worst:.2f}"))
+
+        def refresh():
+            selected = sites_tree.selection()
+            selected_site = sites_tree.item(selected[0], "text") if selected else None
+            sites_tree.delete(*sites_tree.get_children())
+            for site, calls, statements, rows, errors, p50, p95, p99, worst in self.monitor.summary():
+                item = sites_tree.insert("", "end", text=site, values=(
+                    site, calls, statements, rows, errors, f"{p50:.2f}", f"{p95:.2f}", f"{p99:.2f}", f"{worst:.2f}"))
+                if site == selected_site:
+                    sites_tree.selection_set(item)
+            show_statements()
+
+            slow_text.delete("1.0", tk.END)
+            for entry in reversed(self.monitor.slow):
+                slow_text.insert(tk.END, f"{entry['time']}  {entry['ms']} ms  {entry['site']}  rows={entry['rows']}\n")
+                slow_text.insert(tk.END, f"  {entry['sql']}\n")
+                for line in entry['plan'].splitlines():
+                    slow_text.insert(tk.END, f"    {line}\n")
+
+            cache_label.config(text="Cache hits/misses: " + ", ".join(
+                f"{name} {hits}/{misses}" for name, (hits, misses) in sorted(self.inventory.cache.stats().items())))
+
+        def tick():
+            if diagnostics_window.winfo_exists():
+                refresh()
+                diagnostics_window.after(DIAGNOSTICS_REFRESH_MS, tick)
+
+        def reset():
+            self.monitor.reset()
+            refresh()
+
+        sites_tree.bind("<<TreeviewSelect>>", show_statements)
+        ttk.Button(diagnostics_window, text="Reset", command=reset).pack(side=tk.RIGHT, padx=5, pady=5)
+        tick()
+
+    def load_bills(self):
+        self.bills_pager.set_source(self.billing.bills_source())
+
+    def filter_bills(self):
+        search_text = self.customer_filter_entry.get()
 
-        # Insert filtered entries
-        for bill in filtered_bills:
-            self.bills_tree.insert("", tk.END, values=(bill[0], bill[1], bill[2], bill[3]))
+        # Best matching bills first; fewer than three characters shows them all
+        self.bills_pager.set_source(self.billing.bills_source(search_text))
 
     def load_products_into_treeview(self):
-        # Clear the current items in the Treeview
-        for item in self.product_treeview.get_children():
-            self.product_treeview.delete(item)
-
-        # Fetch products from the database
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT p.brand, p.product_name, p.quantity, p.unit_price
-            FROM products p
-        ''')
-        products = cursor.fetchall()
-        conn.close()
-
-        # Insert fetched products into the Treeview
-        for product in products:
-            self.product_treeview.insert("", "end", values=product)
+        # Show the first page of products; more are fetched while scrolling
+        self.bill_product_pager.reload()
 
         # Set column widths
         self.product_treeview.column("Brand", width=100, anchor="center")
@@ -818,31 +836,12 @@ class StockManagementApp:
         style.configure("Treeview.Heading", font=("Arial", 10, "bold"), background="#f0f0f0")
         style.configure("Treeview", rowheight=25)  # Increase row height for better spacing
     
-    def sort_treeview_column(self, col, reverse):
-        # Get the data from the Treeview
-        data = [(self.product_treeview.item(item)["values"], item) for item in self.product_treeview.get_children()]
-
-        # Sort the data
-        data.sort(reverse=reverse, key=lambda x: x[0][col])
-
-        # Reinsert the sorted data into the Treeview
-        for index, (values, item) in enumerate(data):
-            self.product_treeview.item(item, values=values)
-
-        # Reverse the sort order for the next click
-        self.product_treeview.heading(col, command=lambda: self.sort_treeview_column(col, not reverse))
-
-        # Bind the sorting function to the column headers
-        self.product_treeview.heading("Brand", command=lambda: self.sort_treeview_column(0, False))
-        self.product_treeview.heading("Product Name", command=lambda: self.sort_treeview_column(1, False))
-        self.product_treeview.heading("Quantity", command=lambda: self.sort_treeview_column(2, False))
-        self.product_treeview.heading("Unit Price", command=lambda: self.sort_treeview_column(3, False))
-    
     def on_product_select(self, event):
         selected_item = self.product_treeview.selection()
         if selected_item:
             item_values = self.product_treeview.item(selected_item, "values")
             # Assuming item_values is in the format (Brand, Product Name, Quantity, Unit Price)
+            self.selected_product_id = int(selected_item[0])  # Item id is the product id
             self.selected_product_name = item_values[1]  # Product Name
             self.selected_product_price = float(item_values[3])  # Unit Price
             self.quantity_entry.delete(0, tk.END)  # Clear previous quantity
@@ -850,31 +849,24 @@ class StockManagementApp:
     def on_customer_select(self, event):
         selected_customer = self.customer_dropdown.get()
         if selected_customer:
-            conn = sqlite3.connect('stock_management.db')
-            cursor = conn.cursor()
-            cursor.execute("SELECT address FROM customers WHERE name=?", (selected_customer,))
-            address = cursor.fetchone()
-            conn.close()
-            if address:
-                self.customer_address_label.config(text=address[0])
-            else:
-                self.customer_address_label.config(text="")
+            label = self.customer_address_label
+            self.worker.submit(self.billing.customer_address, selected_customer, key="customer-address",
+                               on_done=lambda address: label.winfo_exists() and label.config(text=address))
+
+    def search_customers(self):
+        combobox = self.customer_dropdown
+        self.worker.submit(self.billing.customer_names, combobox.get(), key="customer-search",
+                           on_done=lambda names: self.fill_combobox(combobox, names))
+
+    def search_products(self):
+        # Best matching products by brand or name; clearing the box lists them all
+        self.bill_product_pager.set_source(self.inventory.stock_source(self.product_search_entry.get()))
 
     def fetch_customers(self):
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM customers")
-        customers = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return customers
+        return self.billing.customer_names()
 
     def fetch_products(self):
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT product_name FROM products")
-        products = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return products
+        return self.inventory.product_names()
     
     def add_item_to_bill(self):
         quantity = self.quantity_entry.get()
@@ -887,112 +879,105 @@ class StockManagementApp:
         quantity = int(quantity)
         selling_price = float(selling_price)
 
-        # Fetch available stock for the selected product
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT quantity, cgst, sgst FROM products WHERE product_name=?", (self.selected_product_name,))
-        product_data = cursor.fetchone()
-        conn.close()
-
-        if product_data is None:
-            messagebox.showerror("Error", "Product not found.")
+        # Check stock for everything of this product on the bill, then add
+        # just this scan; a product already on the bill merges into its line
+        draft = self.bill_draft
+        self.worker.submit(self.billing.quote_line, self.selected_product_id, self.selected_product_name,
+                           draft.quantity_of(self.selected_product_id) + quantity, selling_price,
+                           on_done=lambda line: self.add_line_to_bill(draft, replace(line, quantity=quantity)))
+
+    def add_line_to_bill(self, draft, line):
+        if draft is not self.bill_draft or not self.bill_window.winfo_exists():
+            return  # the bill was posted or closed meanwhile
+        self.show_bill_line(draft.add(line))
+
+    def show_bill_line(self, line):
+        values = (line.product_name, line.quantity, f"{line.selling_price:.2f}", f"{from_paise(line.cgst_paise):.2f}",
+                  f"{from_paise(line.sgst_paise):.2f}", f"{from_paise(line.cess_paise):.2f}",
+                  f"{from_paise(line.total_paise):.2f}")
+        iid = str(line.product_id)
+        if self.bill_lines_tree.exists(iid):
+            self.bill_lines_tree.item(iid, values=values)
+        else:
+            self.bill_lines_tree.insert("", "end", iid=iid, values=values)
+            self.bill_lines_tree.see(iid)
+        self.show_bill_totals()
+
+    def show_bill_totals(self):
+        draft = self.bill_draft
+        self.bill_totals_label.config(text=(
+            f"{len(draft)} lines   Taxable {from_paise(draft.taxable_paise):.2f}   "
+            f"CGST {from_paise(draft.cgst_paise):.2f}   SGST {from_paise(draft.sgst_paise):.2f}   "
+            f"CESS {from_paise(draft.cess_paise):.2f}   Total {from_paise(draft.total_paise):.2f}"))
+
+    def selected_bill_line(self):
+        selected = self.bill_lines_tree.selection()
+        if not selected:
+            messagebox.showwarning("No Line Selected", "Please select a line on the bill.", parent=self.bill_window)
+            return None
+        return self.bill_draft.get(int(selected[0]))
+
+    def change_bill_line_quantity(self):
+        line = self.selected_bill_line()
+        if line is None:
             return
-
-        available_stock = product_data[0]
-        cgst_rate = product_data[1]
-        sgst_rate = product_data[2]
-
-        # Check if requested quantity exceeds available stock
-        if quantity > available_stock:
-            messagebox.showerror("Error", f"Requested quantity exceeds available stock. Available: {available_stock}")
+        quantity = simpledialog.askinteger("Change Quantity", f"Quantity of {line.product_name}:",
+                                           initialvalue=line.quantity, minvalue=0, parent=self.bill_window)
+        if quantity is None or quantity == line.quantity:
             return
+        if quantity == 0:
+            self.remove_bill_line()
+            return
+        draft = self.bill_draft
 
-        # Calculate GST for the product
-        cgst_amount = (selling_price * cgst_rate) / 100
-        sgst_amount = (selling_price * sgst_rate) / 100
-        total_price = (selling_price + cgst_amount + sgst_amount) * quantity
-
-        # Update total CGST and SGST
-        self.total_cgst += cgst_amount * quantity
-        self.total_sgst += sgst_amount * quantity
+        def changed(quoted):
+            if draft is self.bill_draft and self.bill_window.winfo_exists() and quoted.product_id in draft:
+                self.show_bill_line(draft.put(quoted))
 
-        # Store the added item
-        self.added_items.append((self.selected_product_name, quantity, selling_price, cgst_amount, sgst_amount, total_price))
+        self.worker.submit(self.billing.quote_line, line.product_id, line.product_name, quantity, line.selling_price,
+                           on_done=changed)
 
-        # Display the item in the bill text area
-        self.bill_text_area.insert(tk.END, f"{self.selected_product_name:<25} {quantity:<10} {selling_price:<15.2f} {cgst_amount:<10.2f} {sgst_amount:<10.2f} {total_price:<10.2f}\n")
+    def remove_bill_line(self):
+        line = self.selected_bill_line()
+        if line is None:
+            return
+        self.bill_draft.remove(line.product_id)
+        self.bill_lines_tree.delete(str(line.product_id))
+        self.show_bill_totals()
 
     def finalize_bill(self):
-        # Generate bill number
-        bill_number = self.get_bill_number()
-
         # Fetch customer details
         customer_name = self.customer_dropdown.get()
 
-        # Clear the bill text area and add headings
-        self.bill_text_area.delete("1.0", tk.END)  # Clear previous bill
-        self.bill_text_area.insert(tk.END, "Bill Number: {}\n".format(bill_number))
-        self.bill_text_area.insert(tk.END, "Customer: {}\n".format(customer_name))
-        self.bill_text_area.insert(tk.END, "\nItems:\n")
-        self.bill_text_area.insert(tk.END, "--------------------------------------------------\n")
-
-        total_amount = 0  # Initialize total amount
-
-        # Display the added items
-        for item in self.added_items:
-            product_name, quantity, selling_price, item_total = item  # Unpack values
-            total_amount += item_total
+        # Post the bill, its lines and the stock decrements in one transaction
+        self.worker.submit(self.billing.post_bill, customer_name, self.bill_draft.bill_lines(),
+                           on_done=self.show_posted_bill)
 
-            # Save purchase to the database
-            self.save_purchase(product_name, quantity, selling_price, item_total)
+    def show_posted_bill(self, bill):
+        # The saved bill is rendered from what was posted, like any reprint
+        self.worker.submit(self.billing.save_bill, bill.bill_number, on_done=self.bill_saved)
 
-            self.bill_text_area.insert(tk.END, f"{product_name} {quantity} {selling_price:.2f} {item_total:.2f}\n")
-
-        # Final total
-        self.bill_text_area.insert(tk.END, "Total Amount: {:.2f}\n".format(total_amount))
-
-        # Save the bill to the database
-        self.save_bill(customer_name, total_amount)
-
-    def update_stock(self, product_name, quantity):
-        # Logic to update stock based on the product name and quantity sold
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
-
-        # Update the quantity in the products table
-        cursor.execute("UPDATE products SET quantity = quantity - ? WHERE product_name = ?", (quantity, product_name))
-
-        # Commit the changes and close the connection
-        conn.commit()
-        conn.close()
-
-    def get_invoice_number(self):
-        current_year = datetime.now().year
-        conn = sqlite3.connect('stock_management.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT last_invoice_number FROM settings WHERE year=?", (current_year,))
-        result = cursor.fetchone()
-
-        if result is None:
-            # If no record exists for the current year, initialize it
-            cursor.execute("INSERT INTO settings (year, last_invoice_number) VALUES (?, ?)", (current_year, 0))
-            conn.commit()
-            last_invoice_number = 0
-        else:
-            last_invoice_number = result[0]
-
-        new_invoice_number = last_invoice_number + 1
-
-        # Reset on April 1st
-        if datetime.now().month == 4 and datetime.now().day == 1:
-            new_invoice_number = 1
-
-        cursor.execute("UPDATE settings SET last_invoice_number=? WHERE year=?", (new_invoice_number, current_year))
-        conn.commit()
-        conn.close()
-        return new_invoice_number
+        # The next bill starts empty
+        self.bill_draft = BillDraft()
+        if self.bill_window.winfo_exists():
+            self.bill_lines_tree.delete(*self.bill_lines_tree.get_children())
+            self.show_bill_totals()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stock Management System")
+    parser.add_argument("--server", default=None, help="run as a counter of the server at this URL, "
+                                                       "e.g. http://127.0.0.1:8765 (see server.py)")
+    parser.add_argument("--startup-timing", action="store_true",
+                        help="print how long start-up takes, up to the first page of products")
+    args = parser.parse_args()
+    startup = StartupTimer(LAUNCHED, echo=args.startup_timing)
+    startup.mark("imported")
+
+    remote = None
+    if args.server:
+        from client import RemoteServices
+        remote = RemoteServices(args.server).start()
+
     root = tk.Tk()
-    app = StockManagementApp(root)
+    app = StockManagementApp(root, remote, startup)
     root.mainloop()
\ No newline at end of file
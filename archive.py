@@ -0,0 +1,271 @@
+import argparse
+import os
+import re
+import sys
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+
+from database import DB_PATH, configure
+from invoices import financial_year, financial_year_label
+
+# Closed financial years (April-March, the same years invoice numbers reset
+# on) can be moved out of the main database into one archive file per year:
+#
+#   python archive.py archive 2023            # moves 2023-24
+#   python archive.py list
+#   python archive.py bills --from 2023-06-01 --to 2024-05-31
+#
+# billing, bill_items, bill_item_lots and purchases rows of the year move;
+# everything else, including the reporting rollups, stays in the main file,
+# so day-to-day screens and reports never touch the archives. Queries over a
+# date range go through history(), which attaches only the archives that
+# range reaches.
+
+ARCHIVE_DIR = 'archive'
+
+# Tables moved to the archives, with the date column that decides the year
+# or the (column, parent table, parent column) they follow
+ARCHIVED_TABLES = [
+    ('billing', 'bill_date', None),
+    ('bill_items', None, ('bill_number', 'billing', 'bill_number')),
+    ('bill_item_lots', None, ('bill_item_id', 'bill_items', 'id')),
+    ('purchases', 'purchase_date', None),
+]
+
+
+def year_range(year):
+    # First day of the financial year and first day of the next one
+    return f"{year}-04-01", f"{year + 1}-04-01"
+
+
+def year_of_day(day):
+    return financial_year(datetime.strptime(day[:10], '%Y-%m-%d'))
+
+
+def archive_path(db, year):
+    # archive/<main file name>_2023-24.db next to the main database
+    directory = os.path.join(os.path.dirname(os.path.abspath(db.path)), ARCHIVE_DIR)
+    stem = os.path.splitext(os.path.basename(db.path))[0]
+    return os.path.join(directory, f"{stem}_{financial_year_label(year)}.db")
+
+
+def schema_name(year):
+    return f"fy{year}"
+
+
+def archived_years(db):
+    # [(year, path, bills, purchases, first bill, last bill, archived at)]
+    return db.fetchall('''
+        SELECT year, path, bills, purchases, first_bill, last_bill, archived_at FROM archives ORDER BY year
+    ''')
+
+
+def _resolve(db, path):
+    # Archive paths are stored relative to the main database's directory
+    return os.path.join(os.path.dirname(os.path.abspath(db.path)), path)
+
+
+def _add_missing_columns(db, schema, table):
+    # Give schema.table any columns a later migration gave main.table; rows
+    # already there get NULL in them
+    existing = {row[1] for row in db.fetchall(f"PRAGMA {schema}.table_info({table})")}
+    for _, column, column_type, *_ in db.fetchall(f"PRAGMA main.table_info({table})"):
+        if column not in existing:
+            db.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN {column} {column_type}")
+
+
+def _copy_schema(db, schema):
+    # Create the archived tables and their indexes in schema as they are in
+    # main, adding any columns a later migration gave the main tables
+    tables = [table for table, _, _ in ARCHIVED_TABLES]
+    placeholders = ", ".join("?" * len(tables))
+    for kind, name, table, sql in db.fetchall(f'''
+        SELECT type, name, tbl_name, sql FROM main.sqlite_master
+        WHERE tbl_name IN ({placeholders}) AND sql IS NOT NULL
+        ORDER BY type = 'index'
+    ''', tables):
+        if kind == 'table':
+            db.execute(re.sub(r'^CREATE TABLE (IF NOT EXISTS )?"?\w+"?', f"CREATE TABLE IF NOT EXISTS {schema}.{name}",
+                              sql))
+            _add_missing_columns(db, schema, name)
+        elif kind == 'index':
+            db.execute(re.sub(r'^CREATE (UNIQUE )?INDEX (IF NOT EXISTS )?"?\w+"?',
+                              lambda m: f"CREATE {m.group(1) or ''}INDEX IF NOT EXISTS {schema}.{name}", sql))
+
+
+def _selection(table, date_column, parent, schema='main'):
+    # WHERE clause picking the year's rows of table in schema; params are
+    # the year's (start, end) days
+    if date_column:
+        return f"{date_column} >= ? AND {date_column} < ?"
+    column, parent_table, parent_column = parent
+    for name, parent_date, grandparent in ARCHIVED_TABLES:
+        if name == parent_table:
+            inner = _selection(parent_table, parent_date, grandparent, schema)
+            return f"{column} IN (SELECT {parent_column} FROM {schema}.{parent_table} WHERE {inner})"
+    raise ValueError(f"unknown table {parent_table}")
+
+
+def archive_year(db, year, now=None):
+    # Move a closed financial year out of the main database. Returns
+    # (bills, purchases) moved.
+    #
+    # A transaction is atomic per file, not across an attached file in WAL
+    # mode, so this runs in two steps: copy into the archive and commit,
+    # then delete from main and commit. The copy replaces rows by primary
+    # key, so if the second step never happens running it again is safe.
+    if year >= financial_year(now):
+        raise ValueError(f"{financial_year_label(year)} is not closed yet.")
+    start, end = year_range(year)
+    path = archive_path(db, year)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    schema = schema_name(year)
+
+    with db.attached(path, schema):
+        with db.transaction():
+            _copy_schema(db, schema)
+            for table, date_column, parent in ARCHIVED_TABLES:
+                columns = ", ".join(row[1] for row in db.fetchall(f"PRAGMA main.table_info({table})"))
+                db.execute(f'''
+                    INSERT OR REPLACE INTO {schema}.{table} ({columns})
+                    SELECT {columns} FROM main.{table} WHERE {_selection(table, date_column, parent)}
+                ''', (start, end))
+
+        with db.transaction():
+            # Children first, while their parents still identify the year
+            moved_bills = [row[0] for row in db.fetchall(
+                "SELECT bill_number FROM main.billing WHERE bill_date >= ? AND bill_date < ?", (start, end))]
+            moved_purchases = [row[0] for row in db.fetchall(
+                "SELECT id FROM main.purchases WHERE purchase_date >= ? AND purchase_date < ?", (start, end))]
+            for table, date_column, parent in reversed(ARCHIVED_TABLES):
+                db.execute(f"DELETE FROM main.{table} WHERE {_selection(table, date_column, parent)}", (start, end))
+
+            bills, first_bill, last_bill = db.fetchone(
+                f"SELECT COUNT(*), MIN(bill_number), MAX(bill_number) FROM {schema}.billing")
+            purchases = db.fetchone(f"SELECT COUNT(*) FROM {schema}.purchases")[0]
+            db.execute('''
+                INSERT OR REPLACE INTO archives (year, path, bills, purchases, first_bill, last_bill, archived_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (year, os.path.relpath(path, os.path.dirname(os.path.abspath(db.path))), bills, purchases,
+                  first_bill, last_bill, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            db.notify("billing", deleted=moved_bills)
+            db.notify("purchases", deleted=moved_purchases)
+    return len(moved_bills), len(moved_purchases)
+
+
+def archives_between(db, start_day=None, end_day=None):
+    # [(year, path)] of the archives holding days between start_day and
+    # end_day (inclusive, either may be None for open-ended)
+    first = year_of_day(start_day) if start_day else None
+    last = year_of_day(end_day) if end_day else None
+    return [(year, _resolve(db, path)) for year, path in db.fetchall('''
+        SELECT year, path FROM archives
+        WHERE (? IS NULL OR year >= ?) AND (? IS NULL OR year <= ?)
+        ORDER BY year
+    ''', (first, first, last, last))]
+
+
+@contextmanager
+def attached_archive(db, year, path):
+    # An archive's schema for the duration of the block. Archives written
+    # before a migration added columns to the archived tables get those
+    # columns first, so queries can name them in main and archives alike.
+    with db.attached(path, schema_name(year)) as schema:
+        for table, _, _ in ARCHIVED_TABLES:
+            _add_missing_columns(db, schema, table)
+        yield schema
+
+
+@contextmanager
+def history(db, start_day=None, end_day=None):
+    # Schemas holding the rows of a date range: 'main' plus the archives the
+    # range reaches, attached for the duration of the block
+    with ExitStack() as stack:
+        schemas = ['main']
+        for year, path in archives_between(db, start_day, end_day):
+            schemas.append(stack.enter_context(attached_archive(db, year, path)))
+        yield schemas
+
+
+def fetch_history(db, sql, start_day=None, end_day=None, params=(), order_by=None):
+    # Run sql against main and every archive the range reaches, as one
+    # UNION ALL. sql names its tables as {schema}.table; params are repeated
+    # for every schema.
+    with history(db, start_day, end_day) as schemas:
+        union = " UNION ALL ".join(sql.format(schema=schema) for schema in schemas)
+        if order_by:
+            union = f"SELECT * FROM ({union}) ORDER BY {order_by}"
+        return db.fetchall(union, tuple(params) * len(schemas))
+
+
+def archive_holding_bill(db, bill_number):
+    # (year, path) of the archive a bill number was moved to, or None
+    row = db.fetchone('''
+        SELECT year, path FROM archives WHERE ? BETWEEN first_bill AND last_bill
+    ''', (bill_number,))
+    return (row[0], _resolve(db, row[1])) if row else None
+
+
+def archives_holding(db, bill_numbers):
+    # [(year, path, bill numbers)] of the archives the given bill numbers
+    # were moved to; numbers in no archive are left out
+    holding = []
+    for year, path, first_bill, last_bill in db.fetchall('''
+        SELECT year, path, first_bill, last_bill FROM archives WHERE first_bill IS NOT NULL ORDER BY year
+    '''):
+        numbers = [n for n in bill_numbers if first_bill <= n <= last_bill]
+        if numbers:
+            holding.append((year, _resolve(db, path), numbers))
+    return holding
+
+
+BILLS_SQL = '''
+    SELECT bill_number, COALESCE(invoice_number, bill_number), customer_name, total_amount, bill_date
+    FROM {schema}.billing
+    WHERE (? IS NULL OR bill_date >= ?) AND (? IS NULL OR bill_date < date(?, '+1 day'))
+'''
+
+
+def bills_between(db, start_day=None, end_day=None):
+    # (bill number, invoice number, customer, total, date) across main and
+    # the archives, oldest first
+    return fetch_history(db, BILLS_SQL, start_day, end_day, (start_day, start_day, end_day, end_day),
+                         order_by="bill_date, bill_number")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive closed financial years.")
+    parser.add_argument("--db", default=DB_PATH, help=f"database file (default: {DB_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    move = commands.add_parser("archive", help="move a closed financial year to its archive file")
+    move.add_argument("year", type=int, help="year the financial year starts in, e.g. 2023 for 2023-24")
+    move.add_argument("--vacuum", action="store_true", help="shrink the main file afterwards")
+    commands.add_parser("list", help="show the archived years")
+    bills = commands.add_parser("bills", help="list bills between two days, archives included")
+    bills.add_argument("--from", dest="start_day", default=None)
+    bills.add_argument("--to", dest="end_day", default=None)
+    args = parser.parse_args(argv)
+
+    from migrations import migrate
+    db = configure(args.db)
+    migrate(db)
+
+    if args.command == "archive":
+        bills_moved, purchases_moved = archive_year(db, args.year)
+        print(f"Moved {bills_moved} bills and {purchases_moved} purchases of "
+              f"{financial_year_label(args.year)} to {archive_path(db, args.year)}")
+        if args.vacuum:
+            db.execute("VACUUM")
+    elif args.command == "list":
+        for year, path, bill_count, purchase_count, _, _, archived_at in archived_years(db):
+            print(f"{financial_year_label(year)}  {bill_count:>9} bills  {purchase_count:>9} purchases  "
+                  f"{path}  (archived {archived_at})")
+    else:
+        for bill_number, invoice_number, customer_name, total_amount, bill_date in bills_between(
+                db, args.start_day, args.end_day):
+            print(f"{bill_number:>9} {invoice_number:>7} {bill_date}  {customer_name or '':<30} {total_amount or 0:>12.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
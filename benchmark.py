@@ -0,0 +1,411 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from database import configure
+from gst_returns import gstr1, year_months
+from invoices import InvoiceAllocator, financial_year
+from ledger import BACKFILL_STATEMENTS, stock_at, take_snapshot
+from migrations import SCHEMA_VERSION, migrate
+from rollups import monthly_gst, rebuild, top_products
+from services import BillingService, InventoryService, PurchaseService, StockItem
+from tax import price_lines
+
+# Headless timings of the app's hot paths against a generated database.
+#
+#   python benchmark.py --scale medium --out results.json
+#   python benchmark.py --scale medium --compare results.json
+#
+# The data is generated from a fixed seed, so every run at the same scale
+# sees the same database. It is written to its own file (benchmark.db by
+# default) and reused by later runs as long as the scale matches. Each run
+# times its writes (purchases, bills, invoice numbers) against a scratch
+# copy of that file, so the dataset stays as generated from run to run.
+
+BENCHMARK_DB = 'benchmark.db'
+
+# Appended to the dataset's file name for the copy a run writes into
+SCRATCH_SUFFIX = '.run'
+
+# Row counts per scale; any of them can be overridden on the command line
+SCALES = {
+    'small': dict(companies=20, products=1_000, customers=200, purchases=2_000, bills=1_000),
+    'medium': dict(companies=200, products=100_000, customers=10_000, purchases=200_000, bills=100_000),
+    'large': dict(companies=1_000, products=1_000_000, customers=100_000, purchases=5_000_000, bills=5_000_000),
+}
+
+SEED = 20240401
+GST_SLABS = (0.0, 5.0, 12.0, 18.0, 28.0)
+
+# Generated history ends here, so the data does not depend on today's date
+HISTORY_END = datetime(2026, 3, 31, 18, 0, 0)
+HISTORY_DAYS = 3 * 365
+
+# Rows written per transaction while generating
+GENERATE_BATCH = 10_000
+
+# A benchmark is a regression when its median is this much slower
+REGRESSION_THRESHOLD = 0.20
+
+FIRST_NAMES = ("Ravi", "Sita", "Anil", "Priya", "Mohan", "Kavya", "Arjun", "Lakshmi", "Suresh", "Meena")
+LAST_NAMES = ("Kumar", "Sharma", "Patel", "Reddy", "Nair", "Iyer", "Traders", "Stores", "Agencies")
+PRODUCT_WORDS = ("Rice", "Atta", "Sugar", "Oil", "Soap", "Tea", "Dal", "Salt", "Biscuit", "Shampoo", "Ghee")
+
+
+def _chunks(count, size=GENERATE_BATCH):
+    for start in range(0, count, size):
+        yield start, min(size, count - start)
+
+
+def _date(rng):
+    return (HISTORY_END - timedelta(minutes=rng.randrange(HISTORY_DAYS * 24 * 60))).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def generate(db, companies, products, customers, purchases, bills, seed=SEED, out=sys.stderr):
+    # Fill an empty, migrated database with a deterministic dataset
+    rng = random.Random(seed)
+    start = time.perf_counter()
+
+    with db.transaction():
+        db.executemany("INSERT INTO gst_slabs (gst_rate) VALUES (?)", [(rate,) for rate in GST_SLABS])
+        db.executemany("INSERT INTO companies (name, gst_number, contact) VALUES (?, ?, ?)",
+                       [(f"Company {i:05d}", f"29ABCDE{i:05d}Z", f"98{i:08d}") for i in range(companies)])
+        db.executemany("INSERT INTO customers (name, address, gst_number, contact) VALUES (?, ?, ?, ?)",
+                       [(f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}", f"{i} Main Road",
+                         f"33ABCDE{i:05d}Z" if i % 4 == 0 else "", f"90{i:08d}") for i in range(customers)])
+
+    # (name, unit price, cgst %, sgst %) per product id, for purchases and bills
+    catalogue = {}
+    for first, count in _chunks(products):
+        rows = []
+        for i in range(first, first + count):
+            rate = rng.choice(GST_SLABS)
+            price = round(rng.uniform(5, 5000), 2)
+            name = f"{rng.choice(PRODUCT_WORDS)} {i}"
+            catalogue[i + 1] = (name, price, rate / 2, rate / 2)
+            rows.append((i + 1, rng.randrange(companies) + 1, f"Brand {i % 500}", name, 1_000_000_000,
+                         price, rate / 2, rate / 2, 0.0, _date(rng)))
+        with db.transaction():
+            # Every generated product is its own item with one opening lot
+            db.executemany('''
+                INSERT INTO products (id, company_id, brand, product_name, quantity, unit_price, cgst, sgst, cess,
+                                      purchase_date, item_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [row + (row[0],) for row in rows])
+            db.executemany('''
+                INSERT INTO stock_items (id, company_id, brand, product_name, quantity) VALUES (?, ?, ?, ?, ?)
+            ''', [row[:5] for row in rows])
+            db.executemany('''
+                INSERT INTO stock_lots (item_id, product_id, received_date, quantity_received, quantity, transaction_id)
+                VALUES (?, ?, ?, ?, ?, 'opening')
+            ''', [(row[0], row[0], row[9], row[4], row[4]) for row in rows])
+        print(f"products: {first + count}/{products}", file=out)
+
+    for first, count in _chunks(purchases):
+        rows = []
+        for i in range(first, first + count):
+            product_id = rng.randrange(products) + 1
+            name, price, _, _ = catalogue[product_id]
+            quantity = rng.randint(1, 100)
+            paise = round(price * 100) * quantity
+            rows.append((f"TXN{i // 20:07d}", name, quantity, price, paise / 100, paise, _date(rng), product_id))
+        with db.transaction():
+            db.executemany('''
+                INSERT INTO purchases (transaction_id, product_name, quantity, unit_price, total_price, total_paise,
+                                       purchase_date, product_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+        print(f"purchases: {first + count}/{purchases}", file=out)
+
+    customers_gstin = db.fetchall("SELECT name, gst_number FROM customers ORDER BY id")
+    last_invoice = {}
+    bill_number = 0
+    for first, count in _chunks(bills):
+        dates = sorted(_date(rng) for _ in range(count))
+        headers, items = [], []
+        for bill_date in dates:
+            bill_number += 1
+            year = financial_year(datetime.strptime(bill_date, '%Y-%m-%d %H:%M:%S'))
+            last_invoice[year] = last_invoice.get(year, 0) + 1
+            lines = []
+            for _ in range(rng.randint(1, 5)):
+                product_id = rng.randrange(products) + 1
+                lines.append((product_id,) + catalogue[product_id] + (rng.randint(1, 5),))
+            taxed = price_lines([line[5] for line in lines], [line[2] for line in lines],
+                                [line[3] for line in lines], [line[4] for line in lines])
+            total_paise = taxed.sums()[4]
+            customer_name, customer_gstin = rng.choice(customers_gstin)
+            headers.append((bill_number, last_invoice[year], year, customer_name, customer_gstin,
+                            total_paise / 100, total_paise, bill_date))
+            for (product_id, name, price, cgst_rate, sgst_rate, quantity), (taxable, cgst, sgst, _, total) in zip(
+                    lines, taxed.rows()):
+                items.append((bill_number, product_id, name, quantity, price, cgst / 100 / quantity, sgst / 100 / quantity,
+                              total / 100, taxable, cgst, sgst, 0, total, cgst_rate, sgst_rate, 0.0))
+        with db.transaction():
+            db.executemany('''
+                INSERT INTO billing (bill_number, invoice_number, invoice_year, customer_name, customer_gstin,
+                                     total_amount, total_paise, bill_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', headers)
+            db.executemany('''
+                INSERT INTO bill_items (bill_number, product_id, product_name, quantity, selling_price, cgst_amount,
+                                        sgst_amount, total_price, taxable_paise, cgst_paise, sgst_paise, cess_paise,
+                                        total_paise, cgst_rate, sgst_rate, cess_rate)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', items)
+        print(f"bills: {first + count}/{bills}", file=out)
+
+    with db.transaction():
+        # Invoice numbering carries on from the generated history
+        db.executemany('''
+            INSERT INTO settings (year, last_invoice_number) VALUES (?, ?)
+            ON CONFLICT (year) DO UPDATE SET last_invoice_number = excluded.last_invoice_number
+        ''', list(last_invoice.items()))
+    print(f"rollups: rebuilt in {rebuild(db):.1f}s", file=out)
+
+    # The opening lots as ledger receipts, with a snapshot at every month end
+    with db.transaction():
+        for sql in BACKFILL_STATEMENTS:
+            db.execute(sql)
+    month = (HISTORY_END - timedelta(days=HISTORY_DAYS)).replace(day=1)
+    while month < HISTORY_END:
+        month = (month + timedelta(days=32)).replace(day=1)
+        take_snapshot(db, (month - timedelta(days=1)).strftime('%Y-%m-%d'))
+    print("ledger: backfilled with monthly snapshots", file=out)
+    db.execute("ANALYZE")
+    print(f"generated in {time.perf_counter() - start:.1f}s", file=out)
+
+
+def _remove_database(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def open_dataset(path, counts, regenerate=False, out=sys.stderr):
+    # The database at path holding exactly counts, generating it if needed
+    spec = json.dumps(dict(counts, seed=SEED, schema=SCHEMA_VERSION), sort_keys=True)
+    if os.path.exists(path) and not regenerate:
+        conn = sqlite3.connect(path)
+        try:
+            existing = conn.execute("SELECT spec FROM benchmark_dataset").fetchone()
+        except sqlite3.Error:
+            existing = None
+        finally:
+            conn.close()
+        if existing and existing[0] == spec:
+            db = configure(path)
+            migrate(db)
+            return db
+    _remove_database(path)
+
+    db = configure(path)
+    migrate(db)
+    generate(db, out=out, **counts)
+    db.execute("CREATE TABLE benchmark_dataset (spec TEXT)")
+    db.execute("INSERT INTO benchmark_dataset (spec) VALUES (?)", (spec,))
+    return db
+
+
+def scratch_copy(db, path):
+    # A fresh copy of db's dataset at path, opened as the shared database
+    # (which closes db)
+    _remove_database(path)
+    target = sqlite3.connect(path)
+    try:
+        db.conn.backup(target)
+    finally:
+        target.close()
+    return configure(path)
+
+
+def measure(fn, repeat, warmup=1):
+    # Timing summary of repeat calls to fn, in milliseconds
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    median = statistics.median(times)
+    return {
+        'repeat': repeat,
+        'min_ms': round(times[0], 3),
+        'median_ms': round(median, 3),
+        'p95_ms': round(times[min(len(times) - 1, int(len(times) * 0.95))], 3),
+        'ops_per_sec': round(1000 / median, 1) if median else None,
+    }
+
+
+def hot_paths(db, counts, repeat):
+    # name -> zero-argument callable, one per hot path in the app
+    rng = random.Random(SEED + 1)
+    inventory = InventoryService(db)
+    purchases = PurchaseService(db, inventory)
+    billing = BillingService(db, inventory, InvoiceAllocator(db))
+    allocator = InvoiceAllocator(db)
+    customers = billing.customer_names()
+    company = inventory.company_names()[0]
+    products = counts['products']
+
+    def load_products():
+        # Opening the main window: count plus the first page of the grid
+        source = inventory.products_source()
+        source.count()
+        source.page(None, 200)
+
+    def scroll_products():
+        # Paging ten screens down the product grid
+        source = inventory.products_source()
+        last = None
+        for _ in range(10):
+            rows = source.page(last, 200)
+            last = rows[-1][0] if rows else last
+
+    def filter_bills():
+        billing.bills_source(rng.choice(customers)[:6]).page(None, 200)
+
+    def search_products():
+        inventory.stock_source(f"{rng.choice(('Rice', 'Soap', 'Oil'))} {rng.randrange(1, 100)}").page(None, 200)
+
+    def finalize_purchase():
+        purchases.receive_stock(company, f"BENCH{rng.randrange(10 ** 9)}", [
+            StockItem(f"Brand {rng.randrange(500)}", f"Bench {rng.randrange(1000)}", 10, 99.5, 9.0, 9.0)
+            for _ in range(20)])
+
+    def finalize_bill():
+        lines = []
+        for _ in range(5):
+            product_id = rng.randrange(products) + 1
+            lines.append(billing.quote_line(product_id, f"Product {product_id}", 1, 100.0))
+        billing.post_bill(rng.choice(customers), lines)
+
+    def get_invoice_number():
+        allocator.next_number()
+
+    def customer_lookup():
+        billing.customer_names()
+        billing.customer_address(rng.choice(customers))
+
+    def sales_report():
+        # A month's GST summary and best sellers, read from the rollups
+        month = (HISTORY_END - timedelta(days=30 * rng.randrange(HISTORY_DAYS // 30))).strftime('%Y-%m')
+        monthly_gst(db, month)
+        top_products(db, f"{month}-01", f"{month}-31")
+
+    def stock_at_day():
+        # Stock and valuation at the end of a random day of the history
+        stock_at(db, (HISTORY_END - timedelta(days=rng.randrange(HISTORY_DAYS))).strftime('%Y-%m-%d'))
+
+    def gst_return_year():
+        # GSTR-1 for a whole financial year of the history, computed from
+        # the bills rather than the cache
+        gstr1(db, year_months(financial_year(HISTORY_END)), refresh=True)
+
+    return {
+        'load_products': (load_products, repeat),
+        'scroll_products': (scroll_products, max(1, repeat // 5)),
+        'filter_bills': (filter_bills, repeat),
+        'search_products': (search_products, repeat),
+        'finalize_purchase': (finalize_purchase, repeat),
+        'finalize_bill': (finalize_bill, repeat),
+        'get_invoice_number': (get_invoice_number, repeat * 10),
+        'customer_lookup': (customer_lookup, repeat * 10),
+        'sales_report': (sales_report, repeat),
+        'stock_at_day': (stock_at_day, repeat),
+        'gst_return_year': (gst_return_year, max(1, repeat // 5)),
+    }
+
+
+def run(db, counts, repeat, only=None, out=sys.stderr):
+    results = {}
+    for name, (fn, times) in hot_paths(db, counts, repeat).items():
+        if only and name not in only:
+            continue
+        results[name] = measure(fn, times)
+        print(f"{name:<20} median {results[name]['median_ms']:>9.3f} ms  p95 {results[name]['p95_ms']:>9.3f} ms",
+              file=out)
+    return results
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD, out=sys.stdout):
+    # Print median changes against a baseline run; returns the regressed names
+    regressions = []
+    print(f"{'benchmark':<20} {'before':>10} {'after':>10} {'change':>8}", file=out)
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f"{name:<20} {'-':>10} {result['median_ms']:>10.3f} {'new':>8}", file=out)
+            continue
+        change = (result['median_ms'] - before['median_ms']) / before['median_ms'] if before['median_ms'] else 0.0
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{name:<20} {before['median_ms']:>10.3f} {result['median_ms']:>10.3f} {change:>+8.1%}{flag}", file=out)
+        if change > threshold:
+            regressions.append(name)
+    if baseline.get('dataset') != current.get('dataset'):
+        print("warning: the runs used different datasets", file=out)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the app's hot paths on a generated database.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    for table in SCALES['small']:
+        parser.add_argument(f"--{table}", type=int, help=f"number of {table} (overrides --scale)")
+    parser.add_argument("--db", default=BENCHMARK_DB, help=f"database file to generate into (default: {BENCHMARK_DB})")
+    parser.add_argument("--regenerate", action="store_true", help="rebuild the dataset even if it matches")
+    parser.add_argument("--repeat", type=int, default=20, help="timed calls per benchmark")
+    parser.add_argument("--only", nargs="+", help="run only these benchmarks")
+    parser.add_argument("--out", help="write the JSON results to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="median slowdown that counts as a regression (default: 0.20)")
+    args = parser.parse_args(argv)
+
+    counts = dict(SCALES[args.scale])
+    for table in counts:
+        if getattr(args, table) is not None:
+            counts[table] = getattr(args, table)
+
+    scratch = args.db + SCRATCH_SUFFIX
+    db = scratch_copy(open_dataset(args.db, counts, regenerate=args.regenerate), scratch)
+    try:
+        results = run(db, counts, args.repeat, only=args.only)
+    finally:
+        db.close()
+        _remove_database(scratch)
+    report = {
+        'dataset': dict(counts, seed=SEED),
+        'scale': args.scale,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'results': results,
+    }
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
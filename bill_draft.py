@@ -0,0 +1,96 @@
+from dataclasses import replace
+
+from billing import BillLine, price_bill_lines
+
+
+class DraftLine:
+    # One product's line on a bill that is still being built. Amounts are in
+    # paise for the whole line, as priced by the tax engine.
+    __slots__ = ('product_id', 'product_name', 'quantity', 'selling_price', 'cgst_rate', 'sgst_rate', 'cess_rate',
+                 'taxable_paise', 'cgst_paise', 'sgst_paise', 'cess_paise', 'total_paise')
+
+    def __init__(self, line: BillLine):
+        self.product_id = line.product_id
+        self.product_name = line.product_name
+        self.quantity = line.quantity
+        self.selling_price = line.selling_price
+        self.cgst_rate = line.cgst_rate
+        self.sgst_rate = line.sgst_rate
+        self.cess_rate = line.cess_rate
+        self.taxable_paise = line.taxable_paise
+        self.cgst_paise = line.cgst_paise
+        self.sgst_paise = line.sgst_paise
+        self.cess_paise = line.cess_paise
+        self.total_paise = line.total_paise
+
+    def bill_line(self) -> BillLine:
+        # What post_bill takes; it prices the line again from these values
+        return BillLine(self.product_id, self.product_name, self.quantity, self.selling_price, 0.0, 0.0, 0.0,
+                        cgst_rate=self.cgst_rate, sgst_rate=self.sgst_rate, taxable_paise=self.taxable_paise,
+                        cgst_paise=self.cgst_paise, sgst_paise=self.sgst_paise, total_paise=self.total_paise,
+                        cess_rate=self.cess_rate, cess_paise=self.cess_paise)
+
+
+class BillDraft:
+    # The bill at the counter before it is posted: one line per product in
+    # the order first added, with the bill's totals kept up to date as lines
+    # change. Adding, editing or removing a line costs the same on a
+    # 500-line wholesale bill as on a 5-line one.
+    def __init__(self):
+        self.lines = {}   # product_id -> DraftLine
+        self.taxable_paise = 0
+        self.cgst_paise = 0
+        self.sgst_paise = 0
+        self.cess_paise = 0
+        self.total_paise = 0
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        return iter(self.lines.values())
+
+    def __contains__(self, product_id):
+        return product_id in self.lines
+
+    def get(self, product_id):
+        return self.lines.get(product_id)
+
+    def quantity_of(self, product_id):
+        line = self.lines.get(product_id)
+        return line.quantity if line is not None else 0
+
+    def add(self, line: BillLine) -> DraftLine:
+        # A scan of line's product. A product already on the bill gets the
+        # quantities merged into its one line, at the latest selling price;
+        # either way the line is priced here for the quantity it ends up with.
+        quantity = self.quantity_of(line.product_id) + line.quantity
+        return self.put(price_bill_lines([replace(line, quantity=quantity)])[0][0])
+
+    def put(self, line: BillLine) -> DraftLine:
+        # Set the product's line to a priced line, e.g. after a quantity edit
+        if line.quantity <= 0:
+            raise ValueError("Quantity must be positive.")
+        self._count(self.lines.get(line.product_id), -1)
+        draft = self.lines[line.product_id] = DraftLine(line)
+        self._count(draft, 1)
+        return draft
+
+    def remove(self, product_id) -> DraftLine:
+        line = self.lines.pop(product_id)
+        self._count(line, -1)
+        return line
+
+    def clear(self):
+        self.__init__()
+
+    def _count(self, line, sign):
+        if line is not None:
+            self.taxable_paise += sign * line.taxable_paise
+            self.cgst_paise += sign * line.cgst_paise
+            self.sgst_paise += sign * line.sgst_paise
+            self.cess_paise += sign * line.cess_paise
+            self.total_paise += sign * line.total_paise
+
+    def bill_lines(self):
+        return [line.bill_line() for line in self.lines.values()]
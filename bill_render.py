@@ -0,0 +1,379 @@
+import argparse
+import functools
+import html
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from string import Template
+from typing import List, Optional
+
+from archive import archives_holding, attached_archive, fetch_history
+from database import DB_PATH, Database, configure
+from invoices import financial_year_label
+
+# Bills are rendered from what was posted (billing + bill_items), never from
+# the screen, so a reprint years later matches the original.
+#
+#   python bill_render.py render 1234 --format text pdf
+#   python bill_render.py reprint --from 2025-04-01 --to 2026-03-31 --workers 8
+#
+# Files go under BILL_DIR/<financial year>/<shard>/, SHARD_SIZE invoices per
+# directory, so a year of invoices never piles up in one folder. Templates
+# are string.Template sources compiled once per process; a template
+# directory can override any of them by file name.
+
+BILL_DIR = 'bills'
+BILL_FORMATS = ('text',)
+SHARD_SIZE = 1000
+
+# Bills loaded per query, and per task in batch reprints
+LOAD_CHUNK = 500
+
+FORMAT_EXTENSIONS = {'text': 'txt', 'html': 'html', 'pdf': 'pdf'}
+
+RULE = "-" * 85
+COLUMNS = f"{'Item':<28} {'Qty':>5} {'Price':>10} {'Taxable':>10} {'CGST':>8} {'SGST':>8} {'Total':>10}"
+
+TEMPLATES = {
+    'bill.txt': f'''\
+TAX INVOICE
+Invoice: $invoice_label
+Date: $bill_date
+Customer: $customer_name
+Address: $customer_address
+GSTIN: $customer_gst
+{RULE}
+{COLUMNS}
+{RULE}
+$lines{RULE}
+Taxable: $taxable   CGST: $cgst   SGST: $sgst   CESS: $cess
+Total Amount: $total
+''',
+    'line.txt': "$name $quantity $price $taxable $cgst $sgst $total\n",
+    'bill.html': '''\
+<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Invoice $invoice_label</title>
+<style>body{font-family:sans-serif}table{border-collapse:collapse;width:100%}
+td,th{border:1px solid #999;padding:4px}td.n{text-align:right}</style></head>
+<body>
+<h1>Tax Invoice</h1>
+<p>Invoice: $invoice_label<br>Date: $bill_date</p>
+<p>Customer: $customer_name<br>Address: $customer_address<br>GSTIN: $customer_gst</p>
+<table>
+<tr><th>Item</th><th>Qty</th><th>Price</th><th>Taxable</th><th>CGST</th><th>SGST</th><th>Total</th></tr>
+$lines</table>
+<p>Taxable: $taxable &nbsp; CGST: $cgst &nbsp; SGST: $sgst &nbsp; CESS: $cess</p>
+<p><strong>Total Amount: $total</strong></p>
+</body></html>
+''',
+    'line.html': ('<tr><td>$name</td><td class="n">$quantity</td><td class="n">$price</td><td class="n">$taxable</td>'
+                  '<td class="n">$cgst</td><td class="n">$sgst</td><td class="n">$total</td></tr>\n'),
+}
+
+# PDF pages: A4 in points, Courier at this size fits a full text bill line
+PDF_PAGE = (595, 842)
+PDF_FONT_SIZE = 9
+PDF_LEADING = 11
+PDF_MARGIN = 40
+PDF_LINES_PER_PAGE = (PDF_PAGE[1] - 2 * PDF_MARGIN) // PDF_LEADING
+
+
+@dataclass
+class BillLineData:
+    product_name: str
+    quantity: int
+    selling_price: float
+    taxable_paise: int
+    cgst_paise: int
+    sgst_paise: int
+    total_paise: int
+    cess_paise: int = 0
+
+
+@dataclass
+class BillData:
+    bill_number: int
+    invoice_number: Optional[int]
+    invoice_year: Optional[int]
+    customer_name: str
+    customer_address: str
+    customer_gst: str
+    bill_date: str
+    total_paise: int
+    lines: List[BillLineData] = field(default_factory=list)
+
+    @property
+    def invoice_label(self):
+        # '2025-26/123', or the bill number for bills from before invoice numbers
+        if self.invoice_number is None:
+            return str(self.bill_number)
+        return f"{financial_year_label(self.invoice_year)}/{self.invoice_number}"
+
+
+def load_bills(db, bill_numbers, schema='main'):
+    # BillData for each bill number that exists, in the order given. Two
+    # queries per LOAD_CHUNK bills however many lines they have. schema
+    # names an attached archive to read from instead (see archive.py).
+    bill_numbers = list(bill_numbers)
+    bills = {}
+    for start in range(0, len(bill_numbers), LOAD_CHUNK):
+        chunk = bill_numbers[start:start + LOAD_CHUNK]
+        placeholders = ", ".join("?" * len(chunk))
+        for row in db.fetchall(f'''
+            SELECT b.bill_number, b.invoice_number, b.invoice_year, b.customer_name,
+                   COALESCE(c.address, ''), COALESCE(b.customer_gstin, c.gst_number, ''), b.bill_date,
+                   COALESCE(b.total_paise, CAST(ROUND(b.total_amount * 100) AS INTEGER), 0)
+            FROM {schema}.billing b
+            LEFT JOIN main.customers c ON c.id = (SELECT MIN(id) FROM customers WHERE name = b.customer_name)
+            WHERE b.bill_number IN ({placeholders})
+        ''', chunk):
+            bills[row[0]] = BillData(*row)
+        for bill_number, *line in db.fetchall(f'''
+            SELECT bill_number, product_name, quantity, selling_price,
+                   taxable_paise, cgst_paise, sgst_paise, total_paise, COALESCE(cess_paise, 0)
+            FROM {schema}.bill_items WHERE bill_number IN ({placeholders}) ORDER BY bill_number, id
+        ''', chunk):
+            bills[bill_number].lines.append(BillLineData(*line))
+    return [bills[n] for n in bill_numbers if n in bills]
+
+
+def load_bill(db, bill_number, schema='main'):
+    bills = load_bills(db, [bill_number], schema)
+    if not bills:
+        raise LookupError(f"Bill {bill_number} does not exist.")
+    return bills[0]
+
+
+def find_bills(db, bill_numbers):
+    # Same as load_bills(), reading the bills not in main from the archives
+    # they were moved to (see archive.py)
+    bill_numbers = list(bill_numbers)
+    bills = {bill.bill_number: bill for bill in load_bills(db, bill_numbers)}
+    missing = [n for n in bill_numbers if n not in bills]
+    if missing:
+        for year, path, numbers in archives_holding(db, missing):
+            with attached_archive(db, year, path) as schema:
+                bills.update((bill.bill_number, bill) for bill in load_bills(db, numbers, schema))
+    return [bills[n] for n in bill_numbers if n in bills]
+
+
+def find_bill(db, bill_number):
+    bills = find_bills(db, [bill_number])
+    if not bills:
+        raise LookupError(f"Bill {bill_number} does not exist.")
+    return bills[0]
+
+
+@functools.lru_cache(maxsize=None)
+def template(name, directory=None):
+    # Compiled template, from directory if it has a file of that name
+    if directory:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return Template(f.read())
+    return Template(TEMPLATES[name])
+
+
+def _rupees(paise):
+    return f"{(paise or 0) / 100:.2f}"
+
+
+def render_text(bill, template_dir=None):
+    line = template('line.txt', template_dir)
+    lines = "".join(line.substitute(
+        name=f"{(item.product_name or '')[:28]:<28}", quantity=f"{item.quantity:>5}",
+        price=f"{item.selling_price or 0:>10.2f}", taxable=f"{_rupees(item.taxable_paise):>10}",
+        cgst=f"{_rupees(item.cgst_paise):>8}", sgst=f"{_rupees(item.sgst_paise):>8}",
+        total=f"{_rupees(item.total_paise):>10}") for item in bill.lines)
+    return template('bill.txt', template_dir).substitute(_totals(bill), lines=lines, **_header(bill))
+
+
+def render_html(bill, template_dir=None):
+    line = template('line.html', template_dir)
+    lines = "".join(line.substitute(
+        name=html.escape(item.product_name or ''), quantity=item.quantity, price=f"{item.selling_price or 0:.2f}",
+        taxable=_rupees(item.taxable_paise), cgst=_rupees(item.cgst_paise), sgst=_rupees(item.sgst_paise),
+        total=_rupees(item.total_paise)) for item in bill.lines)
+    header = {key: html.escape(value) for key, value in _header(bill).items()}
+    return template('bill.html', template_dir).substitute(_totals(bill), lines=lines, **header)
+
+
+def render_pdf(bill, template_dir=None):
+    return pdf_document(render_text(bill, template_dir))
+
+
+def _header(bill):
+    return {
+        'invoice_label': bill.invoice_label,
+        'bill_date': bill.bill_date or '',
+        'customer_name': bill.customer_name or '',
+        'customer_address': bill.customer_address,
+        'customer_gst': bill.customer_gst,
+    }
+
+
+def _totals(bill):
+    return {
+        'taxable': _rupees(sum(item.taxable_paise or 0 for item in bill.lines)),
+        'cgst': _rupees(sum(item.cgst_paise or 0 for item in bill.lines)),
+        'sgst': _rupees(sum(item.sgst_paise or 0 for item in bill.lines)),
+        'cess': _rupees(sum(item.cess_paise or 0 for item in bill.lines)),
+        'total': _rupees(bill.total_paise),
+    }
+
+
+RENDERERS = {'text': render_text, 'html': render_html, 'pdf': render_pdf}
+
+
+def render(bill, fmt='text', template_dir=None):
+    # str for text and html, bytes for pdf
+    return RENDERERS[fmt](bill, template_dir)
+
+
+def pdf_document(text):
+    # A minimal PDF of text in Courier, as many pages as it needs. Characters
+    # outside Latin-1 come out as '?'.
+    width, height = PDF_PAGE
+    lines = text.splitlines() or [""]
+    pages = [lines[i:i + PDF_LINES_PER_PAGE] for i in range(0, len(lines), PDF_LINES_PER_PAGE)]
+
+    def escape(line):
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    # 1 catalog, 2 page tree, 3 font, then a page and its content per page
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(pages)} >>".encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>",
+    ]
+    for page_id, page in zip(page_ids, pages):
+        stream = "\n".join(
+            [f"BT /F1 {PDF_FONT_SIZE} Tf {PDF_LEADING} TL {PDF_MARGIN} {height - PDF_MARGIN} Td"]
+            + [f"({escape(line)}) Tj T*" for line in page] + ["ET"]).encode("latin-1", "replace")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>".encode())
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def output_path(bill, fmt, root=BILL_DIR):
+    # root/2025-26/000/invoice_2025-26_123.txt; bills without an invoice
+    # number go under root/unnumbered/ by bill number
+    if bill.invoice_number is None:
+        year, number, name = "unnumbered", bill.bill_number, f"bill_{bill.bill_number}"
+    else:
+        year = financial_year_label(bill.invoice_year)
+        number, name = bill.invoice_number, f"invoice_{year}_{bill.invoice_number}"
+    shard = f"{number // SHARD_SIZE:03d}"
+    return os.path.join(root, year, shard, f"{name}.{FORMAT_EXTENSIONS[fmt]}")
+
+
+def write_bill(bill, formats=BILL_FORMATS, root=BILL_DIR, template_dir=None):
+    # Render bill in each format and write the files; returns their paths.
+    # Files are replaced whole, so a reader never sees half a bill.
+    paths = []
+    for fmt in formats:
+        content = render(bill, fmt, template_dir)
+        path = output_path(bill, fmt, root)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.tmp"
+        if isinstance(content, bytes):
+            with open(temporary, "wb") as f:
+                f.write(content)
+        else:
+            with open(temporary, "w", encoding="utf-8") as f:
+                f.write(content)
+        os.replace(temporary, path)
+        paths.append(path)
+    return paths
+
+
+def select_bills(db, start_day=None, end_day=None):
+    # Bill numbers dated between two days (inclusive), oldest first,
+    # archived years included
+    return [row[0] for row in fetch_history(db, '''
+        SELECT bill_number FROM {schema}.billing
+        WHERE (? IS NULL OR bill_date >= ?) AND (? IS NULL OR bill_date < date(?, '+1 day'))
+    ''', start_day, end_day, (start_day, start_day, end_day, end_day), order_by="bill_number")]
+
+
+_worker_db = None
+
+
+def _open_worker_db(db_path):
+    # Process pool initializer: each worker process reads through its own
+    # connection, never one inherited from the parent
+    global _worker_db
+    _worker_db = Database(db_path)
+
+
+def _reprint_chunk(bill_numbers, formats, root, template_dir):
+    bills = find_bills(_worker_db, bill_numbers)
+    for bill in bills:
+        write_bill(bill, formats, root, template_dir)
+    return len(bills)
+
+
+def reprint(db_path, bill_numbers, formats=BILL_FORMATS, root=BILL_DIR, template_dir=None, workers=None,
+            out=sys.stderr):
+    # Re-render bill_numbers across a pool of processes, LOAD_CHUNK bills per
+    # task. Returns the number of bills written.
+    # Imported here: multiprocessing would add to the app's start-up
+    from concurrent.futures import ProcessPoolExecutor
+
+    chunks = [bill_numbers[i:i + LOAD_CHUNK] for i in range(0, len(bill_numbers), LOAD_CHUNK)]
+    written = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_open_worker_db, initargs=(db_path,)) as pool:
+        for count in pool.map(_reprint_chunk, chunks, [formats] * len(chunks), [root] * len(chunks),
+                              [template_dir] * len(chunks)):
+            written += count
+            print(f"reprinted {written}/{len(bill_numbers)}", file=out)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render bills from the database.")
+    parser.add_argument("--db", default=DB_PATH, help=f"database file (default: {DB_PATH})")
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument("--out", default=BILL_DIR, help=f"output directory (default: {BILL_DIR})")
+    output.add_argument("--format", nargs="+", choices=sorted(RENDERERS), default=list(BILL_FORMATS))
+    output.add_argument("--templates", default=None, help="directory with template overrides")
+    commands = parser.add_subparsers(dest="command", required=True)
+    one = commands.add_parser("render", parents=[output], help="render one bill by bill number")
+    one.add_argument("bill_number", type=int)
+    batch = commands.add_parser("reprint", parents=[output], help="re-render every bill in a date range")
+    batch.add_argument("--from", dest="start_day", default=None, help="first day, YYYY-MM-DD")
+    batch.add_argument("--to", dest="end_day", default=None, help="last day, YYYY-MM-DD")
+    batch.add_argument("--workers", type=int, default=None, help="processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    from migrations import migrate
+    db = configure(args.db)
+    migrate(db)
+
+    if args.command == "render":
+        for path in write_bill(find_bill(db, args.bill_number), args.format, args.out, args.templates):
+            print(path)
+    else:
+        bill_numbers = select_bills(db, args.start_day, args.end_day)
+        start = time.perf_counter()
+        written = reprint(args.db, bill_numbers, args.format, args.out, args.templates, args.workers)
+        print(f"Reprinted {written} bills in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from typing import Optional
+
+from invoices import InvoiceAllocator
+from lots import InsufficientStock, consume
+from rollups import record_bill
+from tax import from_paise, price_lines
+
+
+@dataclass
+class BillLine:
+    # cgst_amount and sgst_amount are per unit; the *_paise amounts are for
+    # the whole line and are what gets posted, along with the rates
+    product_id: int
+    product_name: str
+    quantity: int
+    selling_price: float
+    cgst_amount: float
+    sgst_amount: float
+    total_price: float
+    cgst_rate: Optional[float] = None
+    sgst_rate: Optional[float] = None
+    taxable_paise: int = 0
+    cgst_paise: int = 0
+    sgst_paise: int = 0
+    total_paise: int = 0
+    cess_rate: Optional[float] = None
+    cess_paise: int = 0
+
+
+@dataclass
+class PostedBill:
+    bill_number: int
+    invoice_number: int
+    customer_name: str
+    bill_date: str
+    total_amount: float
+    lines: list = field(default_factory=list)
+    total_paise: int = 0
+
+
+def line_rates(line):
+    # (CGST %, SGST %, CESS %) of a line; lines built without rates only
+    # carry the per-unit CGST and SGST amounts, so those rates are worked
+    # back from them (and no cess is charged)
+    cess_rate = line.cess_rate or 0.0
+    if line.cgst_rate is not None:
+        return line.cgst_rate, line.sgst_rate or 0.0, cess_rate
+    if not line.selling_price:
+        return 0.0, 0.0, cess_rate
+    return line.cgst_amount * 100 / line.selling_price, line.sgst_amount * 100 / line.selling_price, cess_rate
+
+
+def price_bill_lines(lines):
+    # Recompute every line's amounts in paise in one batch. Returns the
+    # priced lines and the batch's (taxable, cgst, sgst, cess, total) sums.
+    rates = [line_rates(line) for line in lines]
+    taxed = price_lines([line.quantity for line in lines], [line.selling_price for line in lines],
+                        [cgst for cgst, _, _ in rates], [sgst for _, sgst, _ in rates],
+                        [cess for _, _, cess in rates])
+    priced = []
+    for line, (cgst_rate, sgst_rate, cess_rate), (taxable, cgst, sgst, cess, total) in zip(
+            lines, rates, taxed.rows()):
+        priced.append(replace(
+            line, cgst_rate=cgst_rate, sgst_rate=sgst_rate, cess_rate=cess_rate,
+            cgst_amount=from_paise(cgst) / line.quantity if line.quantity else 0.0,
+            sgst_amount=from_paise(sgst) / line.quantity if line.quantity else 0.0,
+            total_price=from_paise(total),
+            taxable_paise=taxable, cgst_paise=cgst, sgst_paise=sgst, cess_paise=cess, total_paise=total))
+    return priced, taxed.sums()
+
+
+def post_bill(db, customer_name, lines, now=None, allocator=None, allocation=None):
+    # Write the bill header, its lines and the stock decrements in one
+    # transaction. Stock is taken from the items' lots in allocation order
+    # (see lots.py), whichever price row the line was picked from. Raises
+    # InsufficientStock (and writes nothing) if any item does not have
+    # enough quantity left.
+    if not lines:
+        raise ValueError("A bill needs at least one line.")
+    allocator = allocator or InvoiceAllocator(db)
+
+    now = now or datetime.now()
+    bill_date = now.strftime('%Y-%m-%d %H:%M:%S')
+
+    # Amounts are always recomputed here so the stored totals are exact
+    lines, (_, _, _, _, total_paise) = price_bill_lines(lines)
+    total_amount = from_paise(total_paise)
+
+    with db.transaction():
+        # One decrement per item even if it appears on several lines
+        product_ids = list(dict.fromkeys(line.product_id for line in lines))
+        placeholders = ", ".join("?" * len(product_ids))
+        item_of = dict(db.fetchall(f"SELECT id, item_id FROM products WHERE id IN ({placeholders})", product_ids))
+        sold = {}
+        for line in lines:
+            item_id = item_of.get(line.product_id)
+            if item_id is None:
+                raise InsufficientStock(f"{line.product_name} is not in stock.")
+            sold[item_id] = sold.get(item_id, 0) + line.quantity
+
+        invoice_year, invoice_number = allocator.next_number(now)
+        # The customer's GSTIN as it is today goes on the bill ('' for none):
+        # it decides whether the sale is B2B in the GST returns
+        cursor = db.execute('''
+            INSERT INTO billing (invoice_number, invoice_year, customer_name, customer_gstin, total_amount,
+                                 total_paise, bill_date)
+            VALUES (?, ?, ?, COALESCE((SELECT TRIM(gst_number) FROM customers WHERE name = ? ORDER BY id LIMIT 1), ''),
+                    ?, ?, ?)
+        ''', (invoice_number, invoice_year, customer_name, customer_name, total_amount, total_paise, bill_date))
+        bill_number = cursor.lastrowid
+
+        db.executemany('''
+            INSERT INTO bill_items (bill_number, product_id, product_name, quantity, selling_price,
+                                    cgst_amount, sgst_amount, total_price,
+                                    taxable_paise, cgst_paise, sgst_paise, cess_paise, total_paise,
+                                    cgst_rate, sgst_rate, cess_rate)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(bill_number, line.product_id, line.product_name, line.quantity, line.selling_price,
+               line.cgst_amount, line.sgst_amount, line.total_price,
+               line.taxable_paise, line.cgst_paise, line.sgst_paise, line.cess_paise, line.total_paise,
+               line.cgst_rate, line.sgst_rate, line.cess_rate) for line in lines])
+
+        allocations = consume(db, sold, allocation, moved_at=bill_date, reference=str(bill_number))
+
+        # Record which lots each line was filled from
+        bill_item_ids = db.fetchall("SELECT id FROM bill_items WHERE bill_number = ? ORDER BY id", (bill_number,))
+        remaining = {item_id: list(lots) for item_id, lots in allocations.items()}
+        line_lots = []
+        for (bill_item_id,), line in zip(bill_item_ids, lines):
+            lots = remaining[item_of[line.product_id]]
+            needed = line.quantity
+            while needed:
+                lot_id, product_id, quantity = lots[0]
+                take = min(quantity, needed)
+                line_lots.append((bill_item_id, lot_id, take))
+                needed -= take
+                if take == quantity:
+                    lots.pop(0)
+                else:
+                    lots[0] = (lot_id, product_id, quantity - take)
+        db.executemany("INSERT INTO bill_item_lots (bill_item_id, lot_id, quantity) VALUES (?, ?, ?)", line_lots)
+
+        record_bill(db, bill_date, customer_name, lines, item_of)
+
+        db.notify("billing", inserted=[bill_number])
+        db.notify("products", updated=list(dict.fromkeys(
+            product_id for lots in allocations.values() for _, product_id, _ in lots)))
+
+    return PostedBill(bill_number, invoice_number, customer_name, bill_date, total_amount, lines, total_paise)
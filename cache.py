@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Per-entity lookups (e.g. a customer's address) kept per cache
+DETAIL_CACHE_SIZE = 1024
+
+# Seconds between PRAGMA data_version checks for other connections' commits
+DATA_VERSION_INTERVAL = 5.0
+
+
+class LRUCache:
+    # Bounded map that drops the least recently used entry when full
+    def __init__(self, maxsize=DETAIL_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def get(self, key, loader):
+        # Cached value for key, or loader(key) stored for next time
+        with self._lock:
+            if key in self._data:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return self._data[key]
+            self.misses += 1
+            generation = self._generation
+        value = loader(key)
+        with self._lock:
+            if generation != self._generation:
+                return value  # cleared while loading
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ReferenceCache:
+    # In-process cache for reference data that windows keep asking for:
+    # customer, company and product names, GST slabs and per-entity details.
+    #
+    # Entries are dropped when a committed write to their table is published
+    # on the database's ChangeBus, so saving a company or customer, adding a
+    # slab or receiving stock invalidates exactly what they change. Commits
+    # from other connections to the same file (a second terminal) are noticed
+    # through PRAGMA data_version and clear everything. That check runs at
+    # most once per data_version_interval, so a warm cache answers a burst
+    # of lookups without touching the database.
+    def __init__(self, db, detail_size=DETAIL_CACHE_SIZE, data_version_interval=DATA_VERSION_INTERVAL):
+        self.db = db
+        self.detail_size = detail_size
+        self.data_version_interval = data_version_interval
+        self.hits = {}
+        self.misses = {}
+        self._values = {}       # name -> value
+        self._tables = {}       # name -> table the value is read from
+        self._details = {}      # name -> (table, LRUCache)
+        self._generation = {}   # table -> writes seen, to spot loads that raced one
+        self._data_version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self._subscribed = set()
+
+    def get(self, name, table, loader):
+        # Cached value called name, or loader() stored for next time
+        self._check_data_version()
+        self._follow(table)
+        with self._lock:
+            if name in self._values:
+                self.hits[name] = self.hits.get(name, 0) + 1
+                return self._values[name]
+            self.misses[name] = self.misses.get(name, 0) + 1
+            generation = self._generation.get(table, 0)
+        value = loader()
+        with self._lock:
+            # A write that committed while loading may not be in value
+            if self._generation.get(table, 0) == generation:
+                self._values[name] = value
+                self._tables[name] = table
+        return value
+
+    def detail(self, name, table, key, loader):
+        # Per-entity lookup through a bounded LRU, e.g. one customer's address
+        self._check_data_version()
+        self._follow(table)
+        with self._lock:
+            entry = self._details.get(name)
+            if entry is None:
+                entry = self._details[name] = (table, LRUCache(self.detail_size))
+        return entry[1].get(key, loader)
+
+    def invalidate(self, table=None):
+        # Drop everything read from table, or everything if table is None
+        with self._lock:
+            for name in [name for name, t in self._tables.items() if table is None or t == table]:
+                del self._values[name]
+                del self._tables[name]
+            for t, lru in self._details.values():
+                if table is None or t == table:
+                    lru.clear()
+            for t in ([table] if table is not None else self._subscribed):
+                self._generation[t] = self._generation.get(t, 0) + 1
+
+    def stats(self):
+        # {name: (hits, misses)} for every cached list and detail lookup
+        with self._lock:
+            stats = {name: (self.hits.get(name, 0), self.misses.get(name, 0))
+                     for name in set(self.hits) | set(self.misses)}
+            for name, (_, lru) in self._details.items():
+                stats[name] = (lru.hits, lru.misses)
+        return stats
+
+    def _follow(self, table):
+        if table in self._subscribed:
+            return
+        with self._lock:
+            if table in self._subscribed:
+                return
+            self._subscribed.add(table)
+        self.db.changes.subscribe(table, self.on_change)
+
+    def on_change(self, change):
+        # A committed write to change.table, from this database's ChangeBus
+        # or one published for another connection (see server.py)
+        if change.table == "products" and not change.inserted and not change.deleted:
+            # Stock and price updates; product names and ids are unchanged
+            return
+        self.invalidate(change.table)
+
+    def _check_data_version(self):
+        # data_version moves when another connection commits to the file
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.data_version_interval:
+            return
+        self._checked_at = now
+        version = self.db.fetchone("PRAGMA data_version")[0]
+        if version != self._data_version:
+            if self._data_version is not None:
+                self.invalidate()
+            self._data_version = version
@@ -0,0 +1,260 @@
+import http.client
+import json
+import threading
+import time
+import traceback
+from typing import List
+from urllib.parse import urlsplit
+
+from bill_render import BILL_DIR, BILL_FORMATS, render, write_bill
+from database import Change, ChangeBus
+from server import CHANGE_TABLES, METHODS, decode, decode_error, encode
+
+# The app's services, served by server.py. RemoteServices offers the same
+# inventory, purchases and billing objects as the local services, so
+# StockManagementApp runs unchanged against a server:
+#
+#   python active.py --server http://127.0.0.1:8765
+#
+# Committed changes come back through a long-poll of /changes and are
+# published on a local ChangeBus, so open grids patch themselves as other
+# counters post bills.
+
+# Seconds a request may take before the counter gives up on it
+CLIENT_TIMEOUT = 60
+
+# How long each /changes poll waits on the server, and the pause before
+# retrying after the server could not be reached
+CHANGES_WAIT = 25
+RETRY_DELAY = 2
+
+
+class RemoteClient:
+    # JSON over HTTP with one keep-alive connection per calling thread
+    def __init__(self, url, timeout=CLIENT_TIMEOUT):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self.host, self.port,
+                                                                              timeout=self.timeout)
+        return connection
+
+    def request(self, method, path, payload=None, retry=True):
+        # retry=False for writes: if the connection drops after the server
+        # has the request, sending it again would apply it twice
+        body = json.dumps(payload).encode() if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                data = json.loads(response.read() or b"{}")
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # The server closed an idle keep-alive connection; reconnect once
+                connection.close()
+                self._local.connection = None
+                if attempt or not retry:
+                    raise
+        if 'error' in data:
+            raise decode_error(data['error'])
+        return data
+
+    def call(self, name, *args, **kwargs):
+        return decode(self.request('POST', f"/call/{name}", {'args': encode(args), 'kwargs': encode(kwargs)},
+                                   retry=METHODS.get(name) == 'read')['result'])
+
+    def source(self, name, args, sort, op, *op_args):
+        return decode(self.request('POST', f"/source/{name}", {'args': encode(args), 'sort': sort, 'op': op,
+                                                               'op_args': encode(op_args)})['result'])
+
+
+class RemoteSource:
+    # A paged source (see PagedQuery) read through the server
+    def __init__(self, client, name, *args, sort=None):
+        self.client = client
+        self.name = name
+        self.args = args
+        self.sort = sort   # [column index, descending] or None
+
+    def sorted_by(self, column, descending=False):
+        return RemoteSource(self.client, self.name, *self.args, sort=[column, descending])
+
+    def cursor(self, row):
+        if self.sort is None:
+            return row[0]
+        return row[self.sort[0] + 1], row[0]
+
+    def page(self, after=None, limit=200):
+        return self.client.source(self.name, self.args, self.sort, 'page', after, limit)
+
+    def count(self):
+        return self.client.source(self.name, self.args, self.sort, 'count')
+
+    def rows_for_keys(self, keys):
+        return self.client.source(self.name, self.args, self.sort, 'rows_for_keys', list(keys))
+
+
+class RemoteInventory:
+    def __init__(self, client, changes):
+        self.client = client
+        self.changes = changes
+        self.cache = None   # the server keeps the reference data cache
+
+    def products_source(self, search_text=None):
+        return RemoteSource(self.client, 'inventory.products_source', search_text)
+
+    def stock_source(self, search_text=None):
+        return RemoteSource(self.client, 'inventory.stock_source', search_text)
+
+    def add_company(self, name, gst_number='', contact=''):
+        return self.client.call('inventory.add_company', name, gst_number, contact)
+
+    def company_names(self) -> List[str]:
+        return self.client.call('inventory.company_names')
+
+    def company_id(self, name):
+        return self.client.call('inventory.company_id', name)
+
+    def add_gst_slab(self, gst_rate):
+        return self.client.call('inventory.add_gst_slab', gst_rate)
+
+    def gst_rates(self) -> List[float]:
+        return self.client.call('inventory.gst_rates')
+
+    def product_names(self) -> List[str]:
+        return self.client.call('inventory.product_names')
+
+    def adjust_stock(self, product_id, quantity, reason):
+        return self.client.call('inventory.adjust_stock', product_id, quantity, reason)
+
+    def stock_at(self, at=None):
+        return [tuple(row) for row in self.client.call('inventory.stock_at', at)]
+
+    def stock_and_rates(self, product_id):
+        return tuple(self.client.call('inventory.stock_and_rates', product_id))
+
+
+class RemotePurchases:
+    def __init__(self, client, changes):
+        self.client = client
+        self.changes = changes
+
+    def purchases_source(self):
+        return RemoteSource(self.client, 'purchases.purchases_source')
+
+    def receive_stock(self, company_name, transaction_id, items):
+        return self.client.call('purchases.receive_stock', company_name, transaction_id, items)
+
+
+class RemoteBilling:
+    def __init__(self, client, changes):
+        self.client = client
+        self.changes = changes
+
+    def bills_source(self, search_text=None):
+        return RemoteSource(self.client, 'billing.bills_source', search_text)
+
+    def add_customer(self, name, contact, address, gst_number=''):
+        return self.client.call('billing.add_customer', name, contact, address, gst_number)
+
+    def customer_names(self, search_text=None) -> List[str]:
+        return self.client.call('billing.customer_names', search_text)
+
+    def customer_address(self, name) -> str:
+        return self.client.call('billing.customer_address', name)
+
+    def quote_line(self, product_id, product_name, quantity, selling_price):
+        return self.client.call('billing.quote_line', product_id, product_name, quantity, selling_price)
+
+    def post_bill(self, customer_name, lines):
+        return self.client.call('billing.post_bill', customer_name, lines)
+
+    def load_bill(self, bill_number):
+        return self.client.call('billing.load_bill', bill_number)
+
+    def load_bills(self, bill_numbers):
+        return self.client.call('billing.load_bills', list(bill_numbers))
+
+    def bills_between(self, start_day=None, end_day=None):
+        return self.client.call('billing.bills_between', start_day, end_day)
+
+    # Bill files are written on this counter, from the server's data
+    def save_bill(self, bill_number, formats=BILL_FORMATS, root=BILL_DIR):
+        bill = self.load_bill(bill_number)
+        return render(bill, 'text'), write_bill(bill, formats, root)
+
+    def reprint_bills(self, bill_numbers, formats=BILL_FORMATS, root=BILL_DIR) -> List[str]:
+        return [path for bill in self.load_bills(bill_numbers) for path in write_bill(bill, formats, root)]
+
+
+class RemoteServices:
+    # inventory, purchases and billing backed by the server at url. Call
+    # start() to begin following the server's changes.
+    def __init__(self, url, timeout=CLIENT_TIMEOUT):
+        self.url = url
+        self.client = RemoteClient(url, timeout)
+        self.changes = ChangeBus()
+        self.inventory = RemoteInventory(self.client, self.changes)
+        self.purchases = RemotePurchases(self.client, self.changes)
+        self.billing = RemoteBilling(self.client, self.changes)
+        self._stopped = threading.Event()
+        self._follower = None
+
+    def start(self):
+        self._follower = threading.Thread(target=self._follow, name="changes", daemon=True)
+        self._follower.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def _follow(self):
+        # Long-poll the server's change log and publish what it reports.
+        # The follower uses its own connection, so polls never hold up calls.
+        client = RemoteClient(self.url, CHANGES_WAIT + CLIENT_TIMEOUT)
+        seq = None
+        lost = False
+        while not self._stopped.is_set():
+            try:
+                if seq is None:
+                    seq = client.request('GET', "/health")['seq']
+                response = client.request('GET', f"/changes?since={seq}&wait={CHANGES_WAIT}")
+            except (OSError, http.client.HTTPException, ValueError):
+                # Changes made while the server was out of reach are unknown,
+                # and a restarted server counts from zero again
+                seq = None
+                lost = True
+                self._stopped.wait(RETRY_DELAY)
+                continue
+            try:
+                if response['reset'] or lost:
+                    lost = False
+                    for table in CHANGE_TABLES:
+                        self.changes.publish(Change(table, reset=True))
+                for change in response['changes']:
+                    self.changes.publish(Change(change['table'], change['inserted'], change['updated'],
+                                                change['deleted']))
+            except Exception:
+                traceback.print_exc()
+            seq = response['seq']
+
+
+def wait_for_server(url, timeout=10.0):
+    # True once the server at url answers /health
+    client = RemoteClient(url, timeout=timeout)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            client.request('GET', "/health")
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
@@ -0,0 +1,375 @@
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+DB_PATH = 'stock_management.db'
+
+# Pragmas applied to every connection we open. Callers can override any of
+# them through Database(pragmas={...}) or configure().
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,      # negative means KiB, so roughly 16 MB of page cache
+    'mmap_size': 268435456,    # 256 MB
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,      # ms to wait for another terminal's write lock
+}
+
+# Number of compiled statements sqlite3 keeps per connection. Every query in
+# the app is a constant string, so they all stay prepared after first use.
+STATEMENT_CACHE_SIZE = 256
+
+
+class Change:
+    # Row ids of one table that were inserted, updated or deleted together.
+    # reset means the table changed in ways that were not itemised (e.g. a
+    # client lost track of a server's changes); views should reload it.
+    def __init__(self, table, inserted=(), updated=(), deleted=(), reset=False):
+        self.table = table
+        self.inserted = list(dict.fromkeys(inserted))
+        self.updated = [i for i in dict.fromkeys(updated) if i not in self.inserted]
+        self.deleted = list(dict.fromkeys(deleted))
+        self.reset = reset
+
+    def merge(self, other):
+        # Fold a later change to the same table into this one
+        deleted = set(other.deleted)
+        inserted = [i for i in self.inserted if i not in deleted] + other.inserted
+        updated = [i for i in self.updated + other.updated if i not in deleted]
+        return Change(self.table, inserted, updated, self.deleted + other.deleted, self.reset or other.reset)
+
+    def __bool__(self):
+        return bool(self.inserted or self.updated or self.deleted or self.reset)
+
+    def __repr__(self):
+        return (f"Change({self.table!r}, inserted={self.inserted}, updated={self.updated}, deleted={self.deleted}"
+                f"{', reset=True' if self.reset else ''})")
+
+
+class ChangeBus:
+    # Delivers committed Changes to the callbacks subscribed to their table
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, table, callback):
+        # Returns a function that removes the subscription again
+        with self._lock:
+            self._subscribers.setdefault(table, []).append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                callbacks = self._subscribers.get(table, [])
+                if callback in callbacks:
+                    callbacks.remove(callback)
+        return unsubscribe
+
+    def publish(self, change):
+        with self._lock:
+            callbacks = list(self._subscribers.get(change.table, []))
+        for callback in callbacks:
+            try:
+                callback(change)
+            except Exception:
+                # A broken view must not undo or hide a committed write
+                traceback.print_exc()
+
+
+class Database:
+    # One long-lived connection shared by the whole app. The connection is in
+    # autocommit mode; multi-statement work goes through transaction().
+    def __init__(self, path=DB_PATH, pragmas=None, cached_statements=STATEMENT_CACHE_SIZE):
+        self.path = path
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        if pragmas:
+            self.pragmas.update(pragmas)
+
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._pending = {}
+        self._rollback_hooks = []
+        self._attached = {}   # schema name -> number of open attached() blocks
+        self.changes = ChangeBus()
+        # Optional QueryMonitor (see diagnostics.py) told about every statement
+        self.monitor = None
+        self.conn = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=cached_statements,
+        )
+        for name, value in self.pragmas.items():
+            self.conn.execute(f"PRAGMA {name} = {value}")
+
+    def _run(self, sql, params, call):
+        # call() does the work; with a monitor installed it is timed and
+        # recorded. Expects the lock to be held.
+        if self.monitor is None:
+            return call()
+        start = time.perf_counter()
+        result = error = None
+        try:
+            result = call()
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.monitor.record(sql, params, time.perf_counter() - start, result, error)
+
+    def execute(self, sql, params=()):
+        with self._lock:
+            return self._run(sql, params, lambda: self.conn.execute(sql, params))
+
+    def executemany(self, sql, rows):
+        if self.monitor is not None and not isinstance(rows, list):
+            rows = list(rows)  # so the slow-query log can explain the first row
+        with self._lock:
+            return self._run(sql, rows, lambda: self.conn.executemany(sql, rows))
+
+    def fetchone(self, sql, params=()):
+        with self._lock:
+            return self._run(sql, params, lambda: self.conn.execute(sql, params).fetchone())
+
+    def fetchall(self, sql, params=()):
+        with self._lock:
+            return self._run(sql, params, lambda: self.conn.execute(sql, params).fetchall())
+
+    def batches(self, sql, params=(), size=1000):
+        # The rows of sql as lists of up to size rows, read from the cursor
+        # as they are consumed, so a result of any length costs one batch of
+        # memory. The statement keeps its read snapshot until exhausted.
+        with self._lock:
+            cursor = self._run(sql, params, lambda: self.conn.execute(sql, params))
+        try:
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(size)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def transaction(self):
+        # Everything inside the block is committed together (one fsync) or
+        # rolled back together. Nested blocks join the outermost transaction.
+        with self._lock:
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield self
+                finally:
+                    self._depth -= 1
+                return
+
+            # Waiting here means another terminal holds the write lock
+            self._run("BEGIN IMMEDIATE", (), lambda: self.conn.execute("BEGIN IMMEDIATE"))
+            self._depth = 1
+            try:
+                yield self
+            except BaseException:
+                self._depth = 0
+                self._pending = {}
+                hooks, self._rollback_hooks = self._rollback_hooks, []
+                self._run("ROLLBACK", (), lambda: self.conn.execute("ROLLBACK"))
+                for hook in hooks:
+                    hook()
+                raise
+            self._depth = 0
+            self._run("COMMIT", (), lambda: self.conn.execute("COMMIT"))
+            pending, self._pending = self._pending, {}
+            self._rollback_hooks = []
+
+        # Tell subscribers only once the data is really there
+        for change in pending.values():
+            self.changes.publish(change)
+
+    def on_rollback(self, hook):
+        # Call hook if the current transaction is rolled back, e.g. to drop
+        # in-memory state that mirrors what it wrote
+        with self._lock:
+            if self._depth:
+                self._rollback_hooks.append(hook)
+
+    def notify(self, table, inserted=(), updated=(), deleted=()):
+        # Report changed row ids. Inside a transaction they are held back until
+        # COMMIT and dropped on ROLLBACK; otherwise they go out right away.
+        change = Change(table, inserted, updated, deleted)
+        if not change:
+            return
+        with self._lock:
+            if self._depth:
+                previous = self._pending.get(table)
+                self._pending[table] = previous.merge(change) if previous else change
+                return
+        self.changes.publish(change)
+
+    @contextmanager
+    def attached(self, path, schema):
+        # Make the database file at path readable as schema.table inside the
+        # block. Overlapping blocks for the same schema share one ATTACH; the
+        # last one out detaches. Not allowed inside a transaction.
+        with self._lock:
+            if not self._attached.get(schema):
+                self._run("ATTACH DATABASE", (path,),
+                          lambda: self.conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,)))
+            self._attached[schema] = self._attached.get(schema, 0) + 1
+        try:
+            yield schema
+        finally:
+            with self._lock:
+                self._attached[schema] -= 1
+                if not self._attached[schema]:
+                    del self._attached[schema]
+                    self._run("DETACH DATABASE", (), lambda: self.conn.execute(f"DETACH DATABASE {schema}"))
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+_db = None
+_db_lock = threading.Lock()
+
+
+def configure(path=DB_PATH, pragmas=None, cached_statements=STATEMENT_CACHE_SIZE):
+    # Replace the shared database, e.g. to point the app at another file
+    global _db
+    with _db_lock:
+        if _db is not None:
+            _db.close()
+        _db = Database(path, pragmas, cached_statements)
+        return _db
+
+
+def get_db():
+    # Shared Database instance, opened on first use
+    global _db
+    with _db_lock:
+        if _db is None:
+            _db = Database()
+        return _db
+
+
+def split_columns(columns):
+    # "a, COALESCE(b, c), d" -> ['a', 'COALESCE(b, c)', 'd']
+    parts, depth, current = [], 0, []
+    for char in columns:
+        if char == ',' and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+            continue
+        depth += (char == '(') - (char == ')')
+        current.append(char)
+    parts.append("".join(current).strip())
+    return parts
+
+
+class PagedQuery:
+    # A SELECT read one page at a time with keyset pagination: each page starts
+    # after the last key of the previous one, so page N costs the same as page 1.
+    # Rows come back with the key prepended as their first value.
+    #
+    # sorted_by() orders by one of the columns instead, with the key breaking
+    # ties. Pages then continue after (value, key) of the last row, so the
+    # database compares typed values (100 after 9) and an index on the column
+    # serves the ORDER BY. NULLs come first ascending and last descending.
+    # sort_keys maps a column index to an indexed expression it sorts by
+    # instead of its own text (e.g. an id for a name read through a join);
+    # the page's last key then looks that value up again.
+    def __init__(self, db, columns, from_clause, key, where='', params=(), order=None, sort_keys=None):
+        self.db = db
+        self.columns = columns
+        self.from_clause = from_clause
+        self.key = key
+        self.where = where
+        self.params = tuple(params)
+        self.order = order   # (column index, descending) or None
+        self.sort_keys = sort_keys or {}
+        self.sort_value_sql = None
+
+        condition = f"({where}) AND " if where else ""
+        select = f"SELECT {key}, {columns} FROM {from_clause} WHERE {condition}"
+        if order is None:
+            self.order_by = None
+            self.page_sql = f"{select}{key} > ? ORDER BY {key} LIMIT ?"
+        else:
+            column, descending = order
+            expression = self.sort_keys.get(column) or split_columns(columns)[column]
+            if column in self.sort_keys:
+                self.sort_value_sql = f"SELECT {expression} FROM {from_clause} WHERE {key} = ?"
+            direction = " DESC" if descending else ""
+            self.order_by = f"{expression}{direction}, {key}{direction}"
+            self.first_page_sql = f"{select}1 ORDER BY {self.order_by} LIMIT ?"
+            # The plain bound next to each row value lets SQLite seek the
+            # index; the NULL rows are a separate run read from their start
+            # (last when descending, first when ascending)
+            if descending:
+                after_value = f"{expression} <= ? AND ({expression}, {key}) < (?, ?)"
+                after_null = f"{expression} IS NULL AND {key} < ?"
+                other_run = f"{expression} IS NULL"
+            else:
+                after_value = f"{expression} >= ? AND ({expression}, {key}) > (?, ?)"
+                after_null = f"{expression} IS NULL AND {key} > ?"
+                other_run = f"{expression} IS NOT NULL"
+            self.after_value_sql = f"{select}{after_value} ORDER BY {self.order_by} LIMIT ?"
+            self.after_null_sql = f"{select}{after_null} ORDER BY {self.order_by} LIMIT ?"
+            self.other_run_sql = f"{select}{other_run} ORDER BY {self.order_by} LIMIT ?"
+        self.count_sql = f"SELECT COUNT(*) FROM {from_clause}" + (f" WHERE {where}" if where else "")
+
+    def filtered(self, where, params=()):
+        # Same query restricted by the given WHERE clause
+        return PagedQuery(self.db, self.columns, self.from_clause, self.key, where, params, self.order,
+                          self.sort_keys)
+
+    def sorted_by(self, column, descending=False):
+        # Same query ordered by columns[column]
+        return PagedQuery(self.db, self.columns, self.from_clause, self.key, self.where, self.params,
+                          (column, descending), self.sort_keys)
+
+    def cursor(self, row):
+        # Where the page after row starts; pass it to page() as after
+        if self.order is None:
+            return row[0]
+        return row[self.order[0] + 1], row[0]
+
+    def page(self, after=None, limit=200):
+        if self.order is None:
+            after = -1 if after is None else after
+            return self.db.fetchall(self.page_sql, self.params + (after, limit))
+        if after is None:
+            return self.db.fetchall(self.first_page_sql, self.params + (limit,))
+        value, key = after
+        if self.sort_value_sql is not None:
+            row = self.db.fetchone(self.sort_value_sql, (key,))
+            value = row[0] if row is not None else None
+        descending = self.order[1]
+        if value is None:
+            rows = self.db.fetchall(self.after_null_sql, self.params + (key, limit))
+            runs_on = not descending
+        else:
+            rows = self.db.fetchall(self.after_value_sql, self.params + (value, value, key, limit))
+            runs_on = descending
+        if runs_on and len(rows) < limit:
+            rows += self.db.fetchall(self.other_run_sql, self.params + (limit - len(rows),))
+        return rows
+
+    def count(self):
+        return self.db.fetchone(self.count_sql, self.params)[0]
+
+    def rows_for_keys(self, keys):
+        # Current rows for the given keys that still match the query
+        keys = list(keys)
+        if not keys:
+            return []
+        condition = f"({self.where}) AND " if self.where else ""
+        placeholders = ", ".join("?" * len(keys))
+        sql = (
+            f"SELECT {self.key}, {self.columns} FROM {self.from_clause} "
+            f"WHERE {condition}{self.key} IN ({placeholders}) ORDER BY {self.key}"
+        )
+        return self.db.fetchall(sql, self.params + tuple(keys))
@@ -0,0 +1,113 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import messagebox
+
+from diagnostics import call_site, caller
+
+# How often the Tk thread picks up finished work, in ms
+POLL_MS = 15
+
+
+class DBWorker:
+    # Runs database calls on a background thread so the Tk mainloop never
+    # waits on SQLite. Results come back through a queue that the Tk thread
+    # drains with root.after, so callbacks always run on the Tk thread.
+    #
+    # Work submitted with a key supersedes earlier work with the same key:
+    # queued calls are cancelled, a running one is interrupted, and stale
+    # results are dropped (e.g. rapid typing in a filter box).
+    def __init__(self, root, interrupt=None, on_busy=None):
+        self.root = root
+        self.interrupt = interrupt
+        self.on_busy = on_busy
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+        self._done = queue.Queue()
+        self._latest = {}     # key -> (generation, future)
+        self._generation = 0
+        self._busy = 0
+        # Generation of the call on the worker thread, guarded by _running_lock
+        # so an interrupt can only reach the call it was meant for
+        self._running = None
+        self._running_lock = threading.Lock()
+        self.root.after(POLL_MS, self._poll)
+
+    def submit(self, fn, *args, on_done=None, on_error=None, key=None):
+        self._generation += 1
+        generation = self._generation
+        if key is not None:
+            previous = self._latest.get(key)
+            if previous is not None:
+                self._supersede(*previous)
+            self._latest[key] = (generation, None)
+
+        self._set_busy(1)
+        future = self.executor.submit(self._call, generation, caller(), fn, args)
+        if key is not None:
+            self._latest[key] = (generation, future)
+        future.add_done_callback(
+            lambda f: self._done.put((self._finish, (f, key, generation, on_done, on_error))))
+        return future
+
+    def _call(self, generation, site, fn, args):
+        # Queries run on the worker are credited to the method that submitted them
+        with self._running_lock:
+            self._running = generation
+        try:
+            with call_site(site):
+                return fn(*args)
+        finally:
+            with self._running_lock:
+                self._running = None
+
+    def call_soon(self, fn, *args):
+        # Run fn on the Tk thread; safe to call from any thread
+        self._done.put((fn, args))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def _supersede(self, generation, future):
+        if future is None or future.cancel() or self.interrupt is None:
+            return
+        # Holding the lock keeps the next call from starting until the
+        # interrupt has gone to this one
+        with self._running_lock:
+            if self._running == generation:
+                self.interrupt()
+
+    def _finish(self, future, key, generation, on_done, on_error):
+        self._set_busy(-1)
+        if future.cancelled():
+            return
+        if key is not None:
+            if self._latest.get(key, (None,))[0] != generation:
+                return  # superseded
+            del self._latest[key]
+
+        # A superseded call's 'interrupted' error was dropped above with its
+        # result; any other call's error is reported
+        error = future.exception()
+        if error is None:
+            if on_done is not None:
+                on_done(future.result())
+        elif on_error is not None:
+            on_error(error)
+        else:
+            messagebox.showerror("Error", str(error))
+
+    def _set_busy(self, delta):
+        self._busy += delta
+        if self.on_busy is not None:
+            self.on_busy(self._busy)
+
+    def _poll(self):
+        try:
+            while True:
+                try:
+                    fn, args = self._done.get_nowait()
+                except queue.Empty:
+                    break
+                fn(*args)
+        finally:
+            self.root.after(POLL_MS, self._poll)
@@ -0,0 +1,254 @@
+import math
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# Statements slower than this go to the slow-query log, in ms
+SLOW_QUERY_MS = 100
+
+# Slow queries kept in memory for the Diagnostics window
+MAX_SLOW_QUERIES = 200
+
+# Histogram buckets per doubling of latency, i.e. ~19% wide
+BUCKETS_PER_DOUBLING = 4
+
+# Call sites are named after the innermost frame in this module when there
+# is one (the window method that asked), otherwise after the innermost frame
+# outside the plumbing below
+UI_MODULE = "active"
+PLUMBING_MODULES = {
+    __name__, "database", "db_worker", "search", "cache", "threading", "contextlib",
+    "concurrent.futures.thread", "concurrent.futures._base",
+}
+
+_local = threading.local()
+
+
+class LatencyHistogram:
+    # Log-bucketed latencies: constant memory however many samples come in,
+    # percentiles accurate to one bucket
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        micros = max(seconds * 1e6, 1.0)
+        index = int(math.log2(micros) * BUCKETS_PER_DOUBLING)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        # Upper edge of the bucket holding the p-th percentile, in ms
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                upper = 2 ** ((index + 1) / BUCKETS_PER_DOUBLING) / 1000
+                return min(upper, self.max * 1000)
+        return self.max * 1000
+
+    def mean(self):
+        return self.total / self.count * 1000 if self.count else 0.0
+
+
+class SiteStats:
+    # Everything recorded for one call site
+    def __init__(self, site):
+        self.site = site
+        self.latency = LatencyHistogram()
+        self.rows = 0
+        self.errors = 0
+        self.statements = 0          # as seen by SQLite, triggers included
+        self.by_sql = {}             # sql -> [LatencyHistogram, rows]
+
+
+@contextmanager
+def call_site(name):
+    # Attribute the queries run inside the block to name
+    previous = getattr(_local, "site", None)
+    _local.site = name
+    try:
+        yield
+    finally:
+        _local.site = previous
+
+
+def current_site():
+    # Explicit call_site() if there is one, else worked out from the stack
+    site = getattr(_local, "site", None)
+    return site if site is not None else caller()
+
+
+def caller():
+    # Name of the method that is asking for data, e.g.
+    # StockManagementApp.add_item_to_bill or InventoryService.company_names
+    frame = sys._getframe(1)
+    fallback = None
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module == UI_MODULE or (module == "__main__" and frame.f_code.co_filename.endswith(f"{UI_MODULE}.py")):
+            return frame.f_code.co_qualname
+        if fallback is None and module not in PLUMBING_MODULES and not frame.f_code.co_name.startswith("<"):
+            fallback = frame.f_code.co_qualname  # skipping lambdas and comprehensions
+        frame = frame.f_back
+    return fallback or "?"
+
+
+def _normalize(sql):
+    return " ".join(sql.split())
+
+
+def _row_count(result):
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple):
+        return 1
+    if isinstance(result, sqlite3.Cursor):
+        return max(result.rowcount, 0)
+    return 0
+
+
+class QueryMonitor:
+    # Records every statement the app sends through Database: latency per
+    # call site and per statement, rows, and a slow-query log with the
+    # query plan. Install with db.monitor = QueryMonitor(db) or install().
+    #
+    # Timing happens around execute/fetch in Database; SQLite's trace
+    # callback additionally counts the statements SQLite actually ran,
+    # including trigger bodies and work done on the raw connection.
+    def __init__(self, db, slow_ms=SLOW_QUERY_MS, log_path=None):
+        self.db = db
+        self.slow_ms = slow_ms
+        self.log_path = log_path
+        self.sites = {}
+        self.slow = deque(maxlen=MAX_SLOW_QUERIES)
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def _site_stats(self, site):
+        stats = self.sites.get(site)
+        if stats is None:
+            stats = self.sites[site] = SiteStats(site)
+        return stats
+
+    def record(self, sql, params, seconds, result, error=None):
+        # Called by Database with its lock held, right after the statement
+        site = current_site()
+        sql = _normalize(sql)
+        rows = _row_count(result)
+        with self._lock:
+            stats = self._site_stats(site)
+            stats.latency.add(seconds)
+            stats.rows += rows
+            if error is not None:
+                stats.errors += 1
+            per_sql = stats.by_sql.get(sql)
+            if per_sql is None:
+                per_sql = stats.by_sql[sql] = [LatencyHistogram(), 0]
+            per_sql[0].add(seconds)
+            per_sql[1] += rows
+
+        if seconds * 1000 >= self.slow_ms:
+            self._log_slow(site, sql, params, seconds, rows)
+
+    def trace(self, statement):
+        # sqlite3 trace callback: one call per statement SQLite runs
+        if getattr(_local, "explaining", False):
+            return
+        site = current_site()
+        with self._lock:
+            self._site_stats(site).statements += 1
+
+    def _log_slow(self, site, sql, params, seconds, rows):
+        if isinstance(params, list):
+            params = params[0] if params else ()   # executemany: plan of the first row
+        _local.explaining = True
+        try:
+            plan = "\n".join(row[3] for row in self.db.conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+        except sqlite3.Error:
+            plan = ""
+        finally:
+            _local.explaining = False
+        entry = {
+            "time": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "site": site,
+            "ms": round(seconds * 1000, 2),
+            "rows": rows,
+            "sql": sql,
+            "plan": plan,
+        }
+        self.slow.append(entry)
+        if self.log_path:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(f"{entry['time']} {entry['ms']} ms {site} rows={rows}\n  {sql}\n")
+                for line in plan.splitlines():
+                    f.write(f"    {line}\n")
+
+    def summary(self):
+        # One row per call site, slowest p95 first:
+        # (site, calls, statements, rows, errors, p50, p95, p99, max ms)
+        with self._lock:
+            rows = [(s.site, s.latency.count, s.statements, s.rows, s.errors,
+                     s.latency.percentile(50), s.latency.percentile(95), s.latency.percentile(99),
+                     s.latency.max * 1000) for s in self.sites.values()]
+        return sorted(rows, key=lambda row: row[6], reverse=True)
+
+    def statements(self, site):
+        # (sql, calls, rows, p50, p95, p99, max ms) for one call site
+        with self._lock:
+            stats = self.sites.get(site)
+            if stats is None:
+                return []
+            rows = [(sql, h.count, n, h.percentile(50), h.percentile(95), h.percentile(99), h.max * 1000)
+                    for sql, (h, n) in stats.by_sql.items()]
+        return sorted(rows, key=lambda row: row[4], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self.sites = {}
+            self.slow.clear()
+            self.started = time.time()
+
+
+class StartupTimer:
+    # Milestones of one launch (imports done, schema checked, first paint,
+    # first data), in seconds since started: a time.perf_counter() taken
+    # before the app's imports. With echo, each one is printed as it happens.
+    def __init__(self, started=None, echo=False):
+        self.started = time.perf_counter() if started is None else started
+        self.echo = echo
+        self.marks = []   # [(milestone, seconds)]
+
+    def mark(self, milestone):
+        # Safe to call from any thread
+        seconds = time.perf_counter() - self.started
+        self.marks.append((milestone, seconds))
+        if self.echo:
+            print(f"startup: {milestone} at {seconds * 1000:.0f} ms", file=sys.stderr)
+
+    def report(self):
+        return ", ".join(f"{milestone} {seconds * 1000:.0f} ms" for milestone, seconds in self.marks)
+
+
+def install(db, slow_ms=SLOW_QUERY_MS, log_path=None):
+    # Start recording every statement on db; returns the monitor
+    monitor = QueryMonitor(db, slow_ms=slow_ms, log_path=log_path)
+    db.monitor = monitor
+    db.conn.set_trace_callback(monitor.trace)
+    return monitor
+
+
+def uninstall(db):
+    db.monitor = None
+    db.conn.set_trace_callback(None)
@@ -0,0 +1,241 @@
+import argparse
+import csv
+import gzip
+import sys
+from contextlib import nullcontext
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Tuple
+
+from archive import history
+from database import configure, get_db
+
+# Bill, purchase and stock registers for the accountants, as CSV or Parquet:
+#
+#   python export.py bills --from 2025-04-01 --to 2026-03-31 --out bills-2025-26.csv
+#   python export.py purchases --out purchases.csv.gz
+#   python export.py stock --out stock.parquet
+#
+# Rows are read from one cursor EXPORT_BATCH at a time and written as they
+# arrive, archived years included, so memory use is the same for a week as
+# for ten years. The format follows the file name: .csv, .csv.gz or
+# .parquet (zstd-compressed columns; needs pyarrow).
+
+EXPORT_BATCH = 5000
+
+# Rows per Parquet row group; readers skip whole groups by their statistics
+ROW_GROUP_ROWS = 100_000
+
+FORMATS = ('csv', 'csv.gz', 'parquet')
+
+
+@dataclass(frozen=True)
+class Register:
+    # sql selects the columns in order from {schema} tables, filtered by
+    # {where}; date_column is what --from/--to filter on. Column kinds are
+    # 'int', 'number', 'text' and 'money' (paise, written as rupees).
+    sql: str
+    columns: Tuple[Tuple[str, str], ...]
+    date_column: str
+    order_by: str
+    archived: bool = True
+
+
+REGISTERS = {
+    'bills': Register(
+        sql='''
+            SELECT b.bill_number,
+                   CASE WHEN b.invoice_number IS NULL THEN CAST(b.bill_number AS TEXT)
+                        ELSE b.invoice_year || '-' || printf('%02d', (b.invoice_year + 1) % 100)
+                             || '/' || b.invoice_number END,
+                   b.bill_date, b.customer_name,
+                   COALESCE(b.customer_gstin, (SELECT c.gst_number FROM main.customers c
+                                               WHERE c.name = b.customer_name ORDER BY c.id LIMIT 1)),
+                   (SELECT SUM(i.taxable_paise) FROM {schema}.bill_items i WHERE i.bill_number = b.bill_number),
+                   (SELECT SUM(i.cgst_paise) FROM {schema}.bill_items i WHERE i.bill_number = b.bill_number),
+                   (SELECT SUM(i.sgst_paise) FROM {schema}.bill_items i WHERE i.bill_number = b.bill_number),
+                   (SELECT SUM(i.cess_paise) FROM {schema}.bill_items i WHERE i.bill_number = b.bill_number),
+                   COALESCE(b.total_paise, CAST(ROUND(b.total_amount * 100) AS INTEGER))
+            FROM {schema}.billing b
+            WHERE {where}
+        ''',
+        columns=(('bill_number', 'int'), ('invoice', 'text'), ('bill_date', 'text'), ('customer', 'text'),
+                 ('customer_gstin', 'text'), ('taxable', 'money'), ('cgst', 'money'), ('sgst', 'money'),
+                 ('cess', 'money'), ('total', 'money')),
+        date_column='b.bill_date',
+        order_by='bill_date, bill_number',
+    ),
+    'purchases': Register(
+        sql='''
+            SELECT p.id AS purchase_id, p.transaction_id, p.purchase_date, p.product_name, p.quantity,
+                   p.unit_price,
+                   COALESCE(p.total_paise, CAST(ROUND(p.total_price * 100) AS INTEGER))
+            FROM {schema}.purchases p
+            WHERE {where}
+        ''',
+        columns=(('purchase_id', 'int'), ('transaction_id', 'text'), ('purchase_date', 'text'),
+                 ('product', 'text'), ('quantity', 'int'), ('unit_price', 'number'), ('total', 'money')),
+        date_column='p.purchase_date',
+        order_by='purchase_date, purchase_id',
+    ),
+    # Price rows and what is on hand of them now; the dates pick rows by
+    # when they were purchased
+    'stock': Register(
+        sql='''
+            SELECT p.id AS product_id, c.name, p.brand, p.product_name, p.quantity, p.unit_price,
+                   p.cgst, p.sgst, p.cess,
+                   COALESCE(CAST(ROUND(p.quantity * p.unit_price * 100) AS INTEGER), 0), p.purchase_date
+            FROM {schema}.products p LEFT JOIN {schema}.companies c ON c.id = p.company_id
+            WHERE {where}
+        ''',
+        columns=(('product_id', 'int'), ('company', 'text'), ('brand', 'text'), ('product', 'text'),
+                 ('quantity', 'int'), ('unit_price', 'number'), ('cgst_rate', 'number'), ('sgst_rate', 'number'),
+                 ('cess_rate', 'number'), ('value', 'money'), ('purchase_date', 'text')),
+        date_column='p.purchase_date',
+        order_by='product_id',
+        archived=False,
+    ),
+}
+
+
+def format_of(path):
+    # 'csv', 'csv.gz' or 'parquet' from a file name
+    name = path.lower()
+    for fmt in sorted(FORMATS, key=len, reverse=True):
+        if name.endswith('.' + fmt):
+            return fmt
+    raise ValueError(f"cannot tell the export format of {path!r}; use a .csv, .csv.gz or .parquet file")
+
+
+def parse_day(text):
+    # '' or None for an open end; otherwise a YYYY-MM-DD day, or ValueError
+    text = (text or '').strip()
+    if not text:
+        return None
+    try:
+        return datetime.strptime(text, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f"invalid date {text!r}, expected YYYY-MM-DD")
+
+
+def _date_filter(date_column, start_day, end_day):
+    # WHERE clause and params for an inclusive day range. Only the bounds
+    # given are written out, so the date index can serve both the filter
+    # and the ordering.
+    conditions, params = [], []
+    if start_day:
+        conditions.append(f"{date_column} >= ?")
+        params.append(start_day)
+    if end_day:
+        conditions.append(f"{date_column} < date(?, '+1 day')")
+        params.append(end_day)
+    return " AND ".join(conditions) or "1", params
+
+
+def _money(paise):
+    return None if paise is None else Decimal(paise).scaleb(-2)
+
+
+def register_batches(db, register, start_day=None, end_day=None, size=EXPORT_BATCH):
+    # Lists of up to size rows of a register, oldest first, with money as
+    # Decimal rupees. Archives the range reaches stay attached until the
+    # generator is exhausted or closed.
+    spec = REGISTERS[register]
+    where, params = _date_filter(spec.date_column, start_day, end_day)
+    money = [index for index, (_, kind) in enumerate(spec.columns) if kind == 'money']
+    with history(db, start_day, end_day) if spec.archived else nullcontext(['main']) as schemas:
+        # Each schema's rows come out of its date index already in order, so
+        # SQLite merges the parts instead of sorting the whole range
+        union = " UNION ALL ".join(spec.sql.format(schema=schema, where=where) for schema in schemas)
+        for rows in db.batches(f"{union} ORDER BY {spec.order_by}", tuple(params) * len(schemas), size):
+            if money:
+                rows = [list(row) for row in rows]
+                for row in rows:
+                    for index in money:
+                        row[index] = _money(row[index])
+            yield rows
+
+
+def write_csv(path, columns, batches, compress=False):
+    # Header row, then every row of batches. Returns the number of rows.
+    count = 0
+    with (gzip.open(path, 'wt', newline='', encoding='utf-8') if compress
+          else open(path, 'w', newline='', encoding='utf-8')) as f:
+        writer = csv.writer(f)
+        writer.writerow([name for name, _ in columns])
+        for rows in batches:
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def write_parquet(path, columns, batches, row_group_rows=ROW_GROUP_ROWS):
+    # One zstd-compressed row group per row_group_rows rows. Returns the
+    # number of rows.
+    # Imported here: pyarrow is large and only this export needs it
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow); CSV export works without it.")
+
+    types = {'int': pa.int64(), 'number': pa.float64(), 'text': pa.string(), 'money': pa.decimal128(18, 2)}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    count = 0
+    pending = []
+
+    def flush():
+        table = pa.Table.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(zip(*pending), schema)], schema=schema)
+        writer.write_table(table, row_group_size=len(pending))
+        pending.clear()
+
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        for rows in batches:
+            pending.extend(rows)
+            count += len(rows)
+            if len(pending) >= row_group_rows:
+                flush()
+        if pending:
+            flush()
+    return count
+
+
+def export(db, register, path, start_day=None, end_day=None, fmt=None):
+    # Write a register to path in fmt (default: from the file name).
+    # Returns the number of rows written.
+    fmt = fmt or format_of(path)
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}")
+    columns = REGISTERS[register].columns
+    batches = register_batches(db, register, start_day, end_day)
+    try:
+        if fmt == 'parquet':
+            return write_parquet(path, columns, batches)
+        return write_csv(path, columns, batches, compress=fmt == 'csv.gz')
+    finally:
+        batches.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export bill, purchase and stock registers.")
+    parser.add_argument("--db", default=None, help="database file (default: stock_management.db)")
+    parser.add_argument("register", choices=sorted(REGISTERS))
+    parser.add_argument("--out", required=True, help="file to write: .csv, .csv.gz or .parquet")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="overrides the file name's format")
+    parser.add_argument("--from", dest="start_day", type=parse_day, default=None, help="first day, YYYY-MM-DD")
+    parser.add_argument("--to", dest="end_day", type=parse_day, default=None, help="last day, YYYY-MM-DD")
+    args = parser.parse_args(argv)
+
+    from migrations import migrate
+    db = configure(args.db) if args.db else get_db()
+    migrate(db)
+
+    count = export(db, args.register, args.out, args.start_day, args.end_day, args.format)
+    print(f"Wrote {count} {args.register} rows to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+import argparse
+import sys
+from datetime import datetime
+
+from archive import history
+from database import configure, get_db
+from invoices import financial_year_label
+from tax import from_paise
+
+# Outward supplies for the monthly GST returns, GSTR-1 and GSTR-3B style:
+#
+#   python gst_returns.py gstr1 --month 2026-03
+#   python gst_returns.py gstr3b --year 2025      # April 2025 - March 2026
+#
+# A month's figures come from one grouped pass over its bill lines (archived
+# years included): per supply type, customer GSTIN and GST rate, the
+# invoices, taxable value and CGST, SGST and CESS. A bill is B2B when the
+# customer had a GSTIN when it was posted, B2C otherwise. Every sale here is
+# intra-state (CGST + SGST), so all B2C supplies are B2CS.
+#
+# Once a month is over its figures cannot change, so they are computed once
+# and kept in gst_return_lines; a year's return is twelve cached months.
+# --refresh computes them again.
+
+B2B, B2C = 'b2b', 'b2c'
+
+# Bills posted before customer_gstin was recorded (NULL, only in archives
+# written before then) fall back to the customer's GSTIN today
+LINES_SQL = '''
+    SELECT COALESCE(b.customer_gstin, (
+               SELECT TRIM(c.gst_number) FROM main.customers c WHERE c.name = b.customer_name
+               ORDER BY c.id LIMIT 1), '') AS gstin,
+           ROUND(COALESCE(i.cgst_rate, 0) + COALESCE(i.sgst_rate, 0), 4) AS gst_rate,
+           b.bill_number, i.taxable_paise, i.cgst_paise, i.sgst_paise, i.cess_paise
+    FROM {schema}.billing b JOIN {schema}.bill_items i ON i.bill_number = b.bill_number
+    WHERE b.bill_date >= ? AND b.bill_date < ?
+'''
+
+RETURN_SQL = '''
+    SELECT CASE WHEN gstin != '' THEN 'b2b' ELSE 'b2c' END, gstin, gst_rate, COUNT(DISTINCT bill_number),
+           COALESCE(SUM(taxable_paise), 0), COALESCE(SUM(cgst_paise), 0), COALESCE(SUM(sgst_paise), 0),
+           COALESCE(SUM(cess_paise), 0), COUNT(*)
+    FROM ({lines})
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+'''
+
+
+def month_range(month):
+    # First day of a 'YYYY-MM' month and first day of the next one
+    try:
+        first = datetime.strptime(month, '%Y-%m')
+    except ValueError:
+        raise ValueError(f"invalid month {month!r}, expected YYYY-MM")
+    following = datetime(first.year + first.month // 12, first.month % 12 + 1, 1)
+    return first.strftime('%Y-%m-%d'), following.strftime('%Y-%m-%d')
+
+
+def year_months(year):
+    # 'YYYY-MM' months of the financial year starting in April of year
+    return [f"{year + (month < 4)}-{month:02d}" for month in (*range(4, 13), *range(1, 4))]
+
+
+def is_closed(month, today=None):
+    return month < (today or datetime.now()).strftime('%Y-%m')
+
+
+def compute(db, month):
+    # [(supply, gstin, GST rate, invoices, taxable, CGST, SGST, CESS,
+    # lines)] of a month's bills, amounts in paise, read from the bills
+    start, end = month_range(month)
+    with history(db, start, end) as schemas:
+        lines = " UNION ALL ".join(LINES_SQL.format(schema=schema) for schema in schemas)
+        return db.fetchall(RETURN_SQL.format(lines=lines), (start, end) * len(schemas))
+
+
+def return_lines(db, month, refresh=False, today=None):
+    # Same as compute(), from the cache for a closed month that has been
+    # computed before
+    closed = is_closed(month, today)
+    if closed and not refresh and db.fetchone("SELECT 1 FROM gst_return_periods WHERE month = ?", (month,)):
+        return db.fetchall('''
+            SELECT supply, gstin, gst_rate, invoices, taxable_paise, cgst_paise, sgst_paise, cess_paise, lines
+            FROM gst_return_lines WHERE month = ? ORDER BY supply, gstin, gst_rate
+        ''', (month,))
+    rows = compute(db, month)
+    if closed:
+        with db.transaction():
+            db.execute("DELETE FROM gst_return_lines WHERE month = ?", (month,))
+            db.executemany('''
+                INSERT INTO gst_return_lines (month, supply, gstin, gst_rate, invoices, taxable_paise, cgst_paise,
+                                              sgst_paise, cess_paise, lines)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(month, *row) for row in rows])
+            db.execute("INSERT OR REPLACE INTO gst_return_periods (month, computed_at) VALUES (?, ?)",
+                       (month, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    return rows
+
+
+def period_lines(db, months, refresh=False, today=None):
+    # return_lines() of several months added up per (supply, gstin, rate)
+    totals = {}
+    for month in months:
+        for supply, gstin, rate, *sums in return_lines(db, month, refresh, today):
+            key = (supply, gstin, rate)
+            previous = totals.get(key)
+            totals[key] = [a + b for a, b in zip(previous, sums)] if previous else sums
+    return [(*key, *sums) for key, sums in sorted(totals.items())]
+
+
+def gstr1(db, months, refresh=False, today=None):
+    # B2B supplies [(GSTIN, rate, invoices, taxable, CGST, SGST, CESS)] and
+    # B2CS supplies [(rate, taxable, CGST, SGST, CESS)], amounts in paise
+    b2b, b2cs = [], []
+    for supply, gstin, rate, invoices, taxable, cgst, sgst, cess, _ in period_lines(db, months, refresh, today):
+        if supply == B2B:
+            b2b.append((gstin, rate, invoices, taxable, cgst, sgst, cess))
+        else:
+            b2cs.append((rate, taxable, cgst, sgst, cess))
+    return b2b, b2cs
+
+
+def gstr3b(db, months, refresh=False, today=None):
+    # Table 3.1 in paise: outward taxable supplies (taxable, CGST, SGST,
+    # CESS) and the taxable value of nil-rated supplies. Cess is reported
+    # whatever the GST rate, so cess on a nil-rated line counts too.
+    taxed = [0, 0, 0, 0]
+    nil_rated = 0
+    for _, _, rate, _, taxable, cgst, sgst, cess, _ in period_lines(db, months, refresh, today):
+        if rate:
+            taxed = [a + b for a, b in zip(taxed, (taxable, cgst, sgst, cess))]
+        else:
+            nil_rated += taxable
+            taxed[3] += cess
+    return tuple(taxed), nil_rated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GST return figures from the posted bills.")
+    parser.add_argument("--db", default=None, help="database file (default: stock_management.db)")
+    period = argparse.ArgumentParser(add_help=False)
+    which = period.add_mutually_exclusive_group(required=True)
+    which.add_argument("--month", help="YYYY-MM")
+    which.add_argument("--year", type=int, help="financial year by its first year, e.g. 2025 for 2025-26")
+    period.add_argument("--refresh", action="store_true", help="recompute closed months instead of the cache")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("gstr1", parents=[period], help="B2B and B2CS outward supplies per rate")
+    commands.add_parser("gstr3b", parents=[period], help="outward taxable and nil-rated supplies")
+    args = parser.parse_args(argv)
+
+    from migrations import migrate
+    db = configure(args.db) if args.db else get_db()
+    migrate(db)
+
+    months = [args.month] if args.month else year_months(args.year)
+    label = args.month or financial_year_label(args.year)
+    if args.command == "gstr1":
+        b2b, b2cs = gstr1(db, months, args.refresh)
+        print(f"B2B supplies, {label}")
+        for gstin, rate, invoices, taxable, cgst, sgst, cess in b2b:
+            print(f"{gstin:<15} {rate:>6}% {invoices:>6} invoices  taxable {from_paise(taxable):>14.2f}  "
+                  f"CGST {from_paise(cgst):>12.2f}  SGST {from_paise(sgst):>12.2f}  CESS {from_paise(cess):>10.2f}")
+        print(f"B2CS supplies, {label}")
+        for rate, taxable, cgst, sgst, cess in b2cs:
+            print(f"{rate:>6}%  taxable {from_paise(taxable):>14.2f}  CGST {from_paise(cgst):>12.2f}  "
+                  f"SGST {from_paise(sgst):>12.2f}  CESS {from_paise(cess):>10.2f}")
+    else:
+        (taxable, cgst, sgst, cess), nil_rated = gstr3b(db, months, args.refresh)
+        print(f"Outward taxable supplies, {label}: taxable {from_paise(taxable):.2f}  CGST {from_paise(cgst):.2f}  "
+              f"SGST {from_paise(sgst):.2f}  CESS {from_paise(cess):.2f}")
+        print(f"Nil-rated supplies, {label}: taxable {from_paise(nil_rated):.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+import threading
+from datetime import datetime
+
+
+def financial_year(when=None):
+    # Indian financial year (April-March), named by the year it starts in
+    when = when or datetime.now()
+    return when.year if when.month >= 4 else when.year - 1
+
+
+def financial_year_label(year):
+    return f"{year}-{(year + 1) % 100:02d}"
+
+
+class InvoiceAllocator:
+    # Hands out invoice numbers per financial year from settings.
+    #
+    # Each reservation is one UPDATE under BEGIN IMMEDIATE, so two terminals on
+    # the same file never get the same number. With block_size > 1 a terminal
+    # reserves that many numbers at once and serves them from memory; numbers
+    # left in a block when the app exits are skipped.
+    def __init__(self, db, block_size=1):
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1")
+        self.db = db
+        self.block_size = block_size
+        self._lock = threading.RLock()
+        self._blocks = {}   # year -> [next number, last number]
+
+    def reserve(self, year, count):
+        # Reserve count consecutive numbers for year and return the first one.
+        # Joins the caller's transaction if there is one.
+        with self.db.transaction():
+            cursor = self.db.execute(
+                "UPDATE settings SET last_invoice_number = last_invoice_number + ? WHERE year = ?",
+                (count, year))
+            if cursor.rowcount == 0:
+                self.db.execute("INSERT INTO settings (year, last_invoice_number) VALUES (?, ?)", (year, count))
+                last = count
+            else:
+                last = self.db.fetchone("SELECT last_invoice_number FROM settings WHERE year = ?", (year,))[0]
+            # If an outer transaction rolls back, so does the reservation
+            self.db.on_rollback(lambda: self._forget(year))
+        return last - count + 1
+
+    def next_number(self, when=None):
+        # Returns (financial year, invoice number)
+        year = financial_year(when)
+        with self._lock:
+            block = self._blocks.get(year)
+            if block is None or block[0] > block[1]:
+                first = self.reserve(year, self.block_size)
+                block = self._blocks[year] = [first, first + self.block_size - 1]
+            number = block[0]
+            block[0] += 1
+        return year, number
+
+    def _forget(self, year):
+        with self._lock:
+            self._blocks.pop(year, None)
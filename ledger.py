@@ -0,0 +1,232 @@
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+from database import configure, get_db
+from tax import from_paise
+
+# Every change to stock on hand is appended to stock_movements and never
+# updated: receipts, sales and adjustments, one row per lot touched, signed
+# (+ in, - out) and valued at the cost of the lot's price row. Rows are
+# written by lots.py in the same transaction as the stock change itself.
+#
+# Snapshots hold each item's quantity and value at the end of a day, so stock
+# at any point in time is the nearest snapshot before it plus the movements
+# after it, never a replay of all history:
+#
+#   python ledger.py stock --at 2026-03-31
+#   python ledger.py snapshot --day 2026-03-31
+#
+# A snapshot is taken automatically once SNAPSHOT_EVERY movements have been
+# recorded since the last one. Movements dated on or before a snapshot's day
+# (back-dated entries) drop that snapshot and the later ones.
+
+MOVEMENT_KINDS = ('receipt', 'sale', 'adjustment')
+
+# Movements recorded before the next snapshot is taken
+SNAPSHOT_EVERY = 10_000
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Cost of {quantity} units of the price row p, in paise
+VALUE_SQL = "COALESCE(CAST(ROUND({quantity} * p.unit_price * 100) AS INTEGER), 0)"
+
+# The existing stock as movements, for the migration that adds the ledger:
+# every lot's receipt, the sales recorded against lots, and one adjustment
+# per lot for whatever those do not explain (sales in archived years or made
+# before lots existed), dated when the ledger was added
+BACKFILL_STATEMENTS = [
+    f'''
+    INSERT INTO stock_movements (moved_at, item_id, product_id, lot_id, kind, quantity, value_paise, reference)
+    SELECT moved_at, item_id, product_id, lot_id, kind, quantity, value_paise, reference FROM (
+        SELECT COALESCE(l.received_date, '') AS moved_at, l.item_id, l.product_id, l.id AS lot_id,
+               'receipt' AS kind, COALESCE(l.quantity_received, l.quantity) AS quantity,
+               {VALUE_SQL.format(quantity="COALESCE(l.quantity_received, l.quantity)")} AS value_paise,
+               l.transaction_id AS reference
+        FROM stock_lots l LEFT JOIN products p ON p.id = l.product_id
+        UNION ALL
+        SELECT COALESCE(b.bill_date, ''), l.item_id, l.product_id, l.id, 'sale', -u.quantity,
+               -{VALUE_SQL.format(quantity="u.quantity")}, CAST(b.bill_number AS TEXT)
+        FROM bill_item_lots u
+        JOIN bill_items i ON i.id = u.bill_item_id
+        JOIN billing b ON b.bill_number = i.bill_number
+        JOIN stock_lots l ON l.id = u.lot_id
+        LEFT JOIN products p ON p.id = l.product_id
+    ) ORDER BY moved_at, lot_id
+    ''',
+    f'''
+    INSERT INTO stock_movements (moved_at, item_id, product_id, lot_id, kind, quantity, value_paise, reference)
+    SELECT datetime('now', 'localtime'), l.item_id, l.product_id, l.id, 'adjustment', l.quantity - m.quantity,
+           {VALUE_SQL.format(quantity="(l.quantity - m.quantity)")}, 'ledger backfill'
+    FROM stock_lots l
+    JOIN (SELECT lot_id, SUM(quantity) AS quantity FROM stock_movements GROUP BY lot_id) m ON m.lot_id = l.id
+    LEFT JOIN products p ON p.id = l.product_id
+    WHERE l.quantity != m.quantity
+    ''',
+]
+
+
+def end_of(at=None):
+    # Inclusive upper bound for moved_at: a 'YYYY-MM-DD' day means the end
+    # of that day, a timestamp itself, None now
+    if at is None:
+        return datetime.now().strftime(TIMESTAMP_FORMAT)
+    return f"{at} 23:59:59" if len(at) == 10 else at
+
+
+def record(db, kind, moved_at, movements):
+    # Append movements of one kind: (item_id, product_id, lot_id, signed
+    # quantity, reference), valued at the product's unit price. Call inside
+    # the transaction that changes the stock.
+    if kind not in MOVEMENT_KINDS:
+        raise ValueError(f"unknown movement kind {kind!r}")
+    if not movements:
+        return
+    with db.transaction():
+        db.executemany(f'''
+            INSERT INTO stock_movements (moved_at, item_id, product_id, lot_id, kind, quantity, value_paise,
+                                         reference)
+            SELECT ?, ?, ?, ?, ?, ?, {VALUE_SQL.format(quantity="?")}, ?
+            FROM (SELECT 1) LEFT JOIN products p ON p.id = ?
+        ''', [(moved_at, item_id, product_id, lot_id, kind, quantity, quantity, reference, product_id)
+              for item_id, product_id, lot_id, quantity, reference in movements])
+
+        day = moved_at[:10]
+        if db.fetchone("SELECT 1 FROM stock_snapshots WHERE day >= ? LIMIT 1", (day,)):
+            # Back-dated: snapshots from that day on no longer add up
+            db.execute("DELETE FROM stock_snapshot_items WHERE day >= ?", (day,))
+            db.execute("DELETE FROM stock_snapshots WHERE day >= ?", (day,))
+        _snapshot_if_due(db, day)
+
+
+def _snapshot_if_due(db, today):
+    latest = db.fetchone("SELECT day, last_movement_id FROM stock_snapshots ORDER BY day DESC LIMIT 1")
+    last_day, last_movement = latest or ('', 0)
+    newest = db.fetchone("SELECT COALESCE(MAX(id), 0) FROM stock_movements")[0]
+    yesterday = (datetime.strptime(today, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+    if newest - last_movement >= SNAPSHOT_EVERY and last_day < yesterday:
+        take_snapshot(db, yesterday)
+
+
+def _after(day):
+    # SQL and params keeping movements after the end of day, or all of them
+    # when day is None
+    return ("moved_at > ? AND ", (end_of(day),)) if day else ("", ())
+
+
+def _snapshot_before(db, end):
+    # Latest snapshot day ending at or before the timestamp end, or None
+    row = db.fetchone('''
+        SELECT day FROM stock_snapshots WHERE day || ' 23:59:59' <= ? ORDER BY day DESC LIMIT 1
+    ''', (end,))
+    return row[0] if row else None
+
+
+def take_snapshot(db, day=None):
+    # Record every item's quantity and value at the end of day (default
+    # yesterday), built from the previous snapshot and the movements since.
+    # Returns the number of items in it.
+    day = day or (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+    end = end_of(day)
+    with db.transaction():
+        previous = _snapshot_before(db, end)
+        if previous == day:
+            return db.fetchone("SELECT COUNT(*) FROM stock_snapshot_items WHERE day = ?", (day,))[0]
+        db.execute('''
+            INSERT INTO stock_snapshots (day, last_movement_id, taken_at)
+            VALUES (?, (SELECT COALESCE(MAX(id), 0) FROM stock_movements), ?)
+        ''', (day, datetime.now().strftime(TIMESTAMP_FORMAT)))
+        after, after_params = _after(previous)
+        cursor = db.execute(f'''
+            INSERT INTO stock_snapshot_items (day, item_id, quantity, value_paise)
+            SELECT ?, item_id, SUM(quantity), SUM(value_paise) FROM (
+                SELECT item_id, quantity, value_paise FROM stock_snapshot_items WHERE day = ?
+                UNION ALL
+                SELECT item_id, quantity, value_paise FROM stock_movements WHERE {after}moved_at <= ?
+            )
+            GROUP BY item_id HAVING SUM(quantity) != 0 OR SUM(value_paise) != 0
+        ''', (day, previous, *after_params, end))
+    return cursor.rowcount
+
+
+def stock_at(db, at=None, item_id=None):
+    # [(item_id, quantity, value in paise)] on hand at a day's end or a
+    # timestamp (default now): the nearest earlier snapshot plus the
+    # movements after it. Items with nothing on hand are left out.
+    end = end_of(at)
+    snapshot = _snapshot_before(db, end)
+    after, after_params = _after(snapshot)
+    item_filter = "AND item_id = ?" if item_id is not None else ""
+    item_params = (item_id,) if item_id is not None else ()
+    return db.fetchall(f'''
+        SELECT item_id, SUM(quantity), SUM(value_paise) FROM (
+            SELECT item_id, quantity, value_paise FROM stock_snapshot_items WHERE day = ? {item_filter}
+            UNION ALL
+            SELECT item_id, quantity, value_paise FROM stock_movements
+            WHERE {after}moved_at <= ? {item_filter}
+        )
+        GROUP BY item_id HAVING SUM(quantity) != 0 OR SUM(value_paise) != 0
+        ORDER BY item_id
+    ''', (snapshot, *item_params, *after_params, end, *item_params))
+
+
+def valuation(db, at=None):
+    # [(product name, brand, quantity, value in paise)] on hand at a point
+    # in time, most valuable first, and the total value
+    rows = stock_at(db, at)
+    names = {}
+    ids = [item_id for item_id, _, _ in rows]
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        placeholders = ", ".join("?" * len(chunk))
+        names.update((item_id, (name, brand)) for item_id, name, brand in db.fetchall(
+            f"SELECT id, product_name, brand FROM stock_items WHERE id IN ({placeholders})", chunk))
+    items = sorted(((*names.get(item_id, ('?', '')), quantity, value) for item_id, quantity, value in rows),
+                   key=lambda row: row[3], reverse=True)
+    return items, sum(value for _, _, _, value in items)
+
+
+def movements(db, item_id, start=None, end=None):
+    # [(moved_at, kind, quantity, value in paise, reference)] of one item
+    after, after_params = _after(start)
+    return db.fetchall(f'''
+        SELECT moved_at, kind, quantity, value_paise, reference FROM stock_movements
+        WHERE item_id = ? AND {after}moved_at <= ?
+        ORDER BY moved_at, id
+    ''', (item_id, *after_params, end_of(end)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stock movements and point-in-time stock.")
+    parser.add_argument("--db", default=None, help="database file (default: stock_management.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    stock = commands.add_parser("stock", help="stock on hand and its value at a point in time")
+    stock.add_argument("--at", default=None, help="YYYY-MM-DD (end of day) or 'YYYY-MM-DD HH:MM:SS'; default now")
+    stock.add_argument("--limit", type=int, default=50, help="items listed (default: 50)")
+    snapshot = commands.add_parser("snapshot", help="record stock at the end of a day")
+    snapshot.add_argument("--day", default=None, help="YYYY-MM-DD (default: yesterday)")
+    history = commands.add_parser("movements", help="movements of one item")
+    history.add_argument("item_id", type=int)
+    history.add_argument("--from", dest="start", default=None)
+    history.add_argument("--to", dest="end", default=None)
+    args = parser.parse_args(argv)
+
+    from migrations import migrate
+    db = configure(args.db) if args.db else get_db()
+    migrate(db)
+
+    if args.command == "stock":
+        items, total = valuation(db, args.at)
+        for name, brand, quantity, value in items[:args.limit]:
+            print(f"{name or '':<30} {brand or '':<20} {quantity:>9} {from_paise(value):>14.2f}")
+        print(f"{len(items)} items on hand at {end_of(args.at)}, valued at {from_paise(total):.2f}")
+    elif args.command == "snapshot":
+        print(f"Snapshot of {take_snapshot(db, args.day)} items")
+    else:
+        for moved_at, kind, quantity, value, reference in movements(db, args.item_id, args.start, args.end):
+            print(f"{moved_at:<19}  {kind:<10} {quantity:>9} {from_paise(value):>14.2f}  {reference or ''}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+from datetime import datetime
+
+from ledger import TIMESTAMP_FORMAT, record
+
+# Stock is held in lots: every receipt of an item is a lot with its own
+# received date, optional expiry date, price row (products.id) and quantity
+# on hand. stock_items keeps the item's total on hand, so checking stock is
+# one row read however many lots there are.
+#
+# Every receipt, sale and adjustment is also appended to the movement ledger
+# (see ledger.py), which answers what was on hand at any point in time.
+#
+# Sales take stock from the item's lots in allocation order:
+#   fifo - oldest receipt first
+#   fefo - earliest expiry first (lots without one last), then oldest
+ALLOCATION = 'fifo'
+
+ALLOCATION_ORDER = {
+    'fifo': "received_date, id",
+    'fefo': "COALESCE(expiry_date, '9999-12-31'), received_date, id",
+}
+
+EXPIRY_FORMAT = '%Y-%m-%d'
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+def parse_expiry(text):
+    # '' or None for no expiry; otherwise a YYYY-MM-DD date, or ValueError
+    text = (text or '').strip()
+    if not text:
+        return None
+    try:
+        return datetime.strptime(text, EXPIRY_FORMAT).strftime(EXPIRY_FORMAT)
+    except ValueError:
+        raise ValueError(f"invalid expiry date {text!r}, expected YYYY-MM-DD")
+
+
+def item_ids(db, keys):
+    # stock_items.id for each (product_name, brand, company_id), adding the
+    # items that do not exist yet. Joins the caller's transaction.
+    keys = list(dict.fromkeys(keys))
+    ids = {}
+    with db.transaction():
+        for key in keys:
+            row = db.fetchone('''
+                SELECT id FROM stock_items WHERE product_name = ? AND brand = ? AND company_id = ?
+            ''', key)
+            if row is None:
+                cursor = db.execute(
+                    "INSERT INTO stock_items (product_name, brand, company_id, quantity) VALUES (?, ?, ?, 0)", key)
+                ids[key] = cursor.lastrowid
+            else:
+                ids[key] = row[0]
+    return ids
+
+
+def receive_lots(db, lots, received_date, kind='receipt'):
+    # Add one lot per (item_id, product_id, quantity, expiry_date,
+    # transaction_id) and raise the items' totals. Joins the caller's
+    # transaction.
+    totals = {}
+    for item_id, _, quantity, _, _ in lots:
+        totals[item_id] = totals.get(item_id, 0) + quantity
+    received_date = received_date or datetime.now().strftime(TIMESTAMP_FORMAT)
+    with db.transaction():
+        # We hold the write lock, so every lot id above the current maximum is ours
+        last_lot = db.fetchone("SELECT COALESCE(MAX(id), 0) FROM stock_lots")[0]
+        db.executemany('''
+            INSERT INTO stock_lots (item_id, product_id, received_date, expiry_date, quantity_received, quantity,
+                                    transaction_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(item_id, product_id, received_date, expiry_date, quantity, quantity, transaction_id)
+              for item_id, product_id, quantity, expiry_date, transaction_id in lots])
+        db.executemany("UPDATE stock_items SET quantity = quantity + ? WHERE id = ?",
+                       [(quantity, item_id) for item_id, quantity in totals.items()])
+        record(db, kind, received_date, db.fetchall('''
+            SELECT item_id, product_id, id, quantity, transaction_id FROM stock_lots WHERE id > ?
+        ''', (last_lot,)))
+
+
+def allocate(db, item_id, quantity, allocation=None):
+    # [(lot id, product id, quantity taken)] covering quantity from the
+    # item's lots in allocation order. Reads only as many lots as it needs.
+    order = ALLOCATION_ORDER[allocation or ALLOCATION]
+    taken = []
+    remaining = quantity
+    cursor = db.execute(f'''
+        SELECT id, product_id, quantity FROM stock_lots
+        WHERE item_id = ? AND quantity > 0
+        ORDER BY {order}
+    ''', (item_id,))
+    for lot_id, product_id, on_hand in cursor:
+        take = min(on_hand, remaining)
+        taken.append((lot_id, product_id, take))
+        remaining -= take
+        if not remaining:
+            break
+    cursor.close()
+    if remaining:
+        raise InsufficientStock("Not enough stock left for one or more items on the bill.")
+    return taken
+
+
+def consume(db, sold, allocation=None, moved_at=None, reference=None, kind='sale'):
+    # Take {item_id: quantity} out of stock. The items' totals are checked
+    # and lowered first (one guarded UPDATE per item), then the lots are
+    # drawn down in allocation order along with their products rows, and
+    # the ledger gets one movement per lot, dated moved_at (default now).
+    # Returns {item_id: [(lot id, product id, quantity)]}. Raises
+    # InsufficientStock, writing nothing if the caller rolls back.
+    moved_at = moved_at or datetime.now().strftime(TIMESTAMP_FORMAT)
+    with db.transaction():
+        cursor = db.executemany('''
+            UPDATE stock_items SET quantity = quantity - ?
+            WHERE id = ? AND quantity >= ?
+        ''', [(quantity, item_id, quantity) for item_id, quantity in sold.items()])
+        if cursor.rowcount != len(sold):
+            raise InsufficientStock("Not enough stock left for one or more items on the bill.")
+
+        allocations = {item_id: allocate(db, item_id, quantity, allocation) for item_id, quantity in sold.items()}
+        taken = [lot for lots in allocations.values() for lot in lots]
+        db.executemany("UPDATE stock_lots SET quantity = quantity - ? WHERE id = ?",
+                       [(quantity, lot_id) for lot_id, _, quantity in taken])
+        per_product = {}
+        for _, product_id, quantity in taken:
+            per_product[product_id] = per_product.get(product_id, 0) + quantity
+        db.executemany("UPDATE products SET quantity = quantity - ? WHERE id = ?",
+                       [(quantity, product_id) for product_id, quantity in per_product.items()])
+        record(db, kind, moved_at, [(item_id, product_id, lot_id, -quantity, reference)
+                                    for item_id, lots in allocations.items()
+                                    for lot_id, product_id, quantity in lots])
+    return allocations
+
+
+def adjust_stock(db, product_id, quantity, reason, now=None):
+    # Correct the stock of a price row by quantity units (a count found
+    # more, or breakage and shrinkage when negative). Extra stock becomes a
+    # new lot of the product; missing stock is taken from the item's lots
+    # like a sale. Returns the product ids whose quantity changed.
+    if not quantity:
+        raise ValueError("Adjustment quantity cannot be zero.")
+    if not reason:
+        raise ValueError("Please give a reason for the adjustment.")
+    moved_at = (now or datetime.now()).strftime(TIMESTAMP_FORMAT)
+    with db.transaction():
+        row = db.fetchone("SELECT item_id FROM products WHERE id = ?", (product_id,))
+        if row is None or row[0] is None:
+            raise LookupError("Product not found.")
+        item_id = row[0]
+        if quantity > 0:
+            db.execute("UPDATE products SET quantity = quantity + ? WHERE id = ?", (quantity, product_id))
+            receive_lots(db, [(item_id, product_id, quantity, None, reason)], moved_at, kind='adjustment')
+            changed = [product_id]
+        else:
+            allocations = consume(db, {item_id: -quantity}, moved_at=moved_at, reference=reason,
+                                  kind='adjustment')
+            changed = list(dict.fromkeys(product_id for _, product_id, _ in allocations[item_id]))
+        db.notify("products", updated=changed)
+    return changed
@@ -0,0 +1,602 @@
+import re
+
+from database import get_db
+from ledger import BACKFILL_STATEMENTS
+from rollups import REBUILD_STATEMENTS
+
+# Schema migrations. Each entry upgrades the database by one version and runs
+# in its own transaction together with the PRAGMA user_version bump, so an
+# interrupted upgrade leaves the file at the previous version.
+
+
+def create_base_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS companies (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            gst_number TEXT,
+            contact TEXT
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS customers (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            address TEXT,
+            gst_number TEXT,
+            contact TEXT
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY,
+            company_id INTEGER,
+            brand TEXT,
+            product_name TEXT,
+            quantity INTEGER,
+            unit_price REAL,
+            cgst REAL,
+            sgst REAL,
+            cess REAL,
+            purchase_date TEXT,
+            FOREIGN KEY (company_id) REFERENCES companies (id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS gst_slabs (
+            id INTEGER PRIMARY KEY,
+            gst_rate REAL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            year INTEGER PRIMARY KEY,
+            last_invoice_number INTEGER
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS purchases (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transaction_id TEXT,
+            product_name TEXT,
+            quantity INTEGER,
+            unit_price REAL,
+            total_price REAL,
+            purchase_date DATETIME
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS billing (
+            bill_number INTEGER PRIMARY KEY,
+            customer_name TEXT,
+            total_amount REAL,
+            bill_date TEXT
+        )
+    ''')
+
+
+def add_lookup_indexes(cursor):
+    # Older versions stored the company *name* in products.company_id. Point
+    # those rows at the real company id so the JOIN and the identity index work.
+    cursor.execute('''
+        UPDATE products
+        SET company_id = (SELECT MIN(c.id) FROM companies c WHERE c.name = products.company_id)
+        WHERE typeof(company_id) = 'text'
+          AND company_id IN (SELECT name FROM companies)
+    ''')
+
+    # A product is identified by name, brand, company and price. Fold any
+    # duplicate rows into the oldest one before enforcing that.
+    cursor.execute('''
+        UPDATE products
+        SET quantity = (
+            SELECT SUM(d.quantity) FROM products d
+            WHERE d.product_name IS products.product_name AND d.brand IS products.brand
+              AND d.company_id IS products.company_id AND d.unit_price IS products.unit_price
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM products
+            GROUP BY product_name, brand, company_id, unit_price
+            HAVING COUNT(*) > 1
+        )
+    ''')
+    cursor.execute('''
+        DELETE FROM products
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM products
+            GROUP BY product_name, brand, company_id, unit_price
+        )
+    ''')
+
+    # Customer and company names are used as lookup keys. Keep the oldest row
+    # under its name and rename later duplicates instead of dropping them.
+    for table in ("customers", "companies"):
+        cursor.execute(f'''
+            UPDATE {table}
+            SET name = name || ' (' || id || ')'
+            WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY name)
+        ''')
+
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_products_identity
+        ON products (product_name, brand, company_id, unit_price)
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_customers_name ON customers (name)')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_companies_name ON companies (name)')
+    # Covers SELECT * FROM billing filtered by customer
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_billing_customer
+        ON billing (customer_name, bill_date, total_amount)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_purchases_product
+        ON purchases (product_name, purchase_date)
+    ''')
+
+
+def add_bill_items(cursor):
+    # Bills get their own invoice number per year; bill_number stays the row id
+    cursor.execute('ALTER TABLE billing ADD COLUMN invoice_number INTEGER')
+    cursor.execute('ALTER TABLE billing ADD COLUMN invoice_year INTEGER')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_billing_invoice
+        ON billing (invoice_year, invoice_number)
+        WHERE invoice_number IS NOT NULL
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bill_items (
+            id INTEGER PRIMARY KEY,
+            bill_number INTEGER NOT NULL,
+            product_id INTEGER,
+            product_name TEXT,
+            quantity INTEGER,
+            selling_price REAL,
+            cgst_amount REAL,
+            sgst_amount REAL,
+            total_price REAL,
+            FOREIGN KEY (bill_number) REFERENCES billing (bill_number),
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bill_items_bill ON bill_items (bill_number)')
+
+
+# Full-text indexes: (FTS table, content table, rowid column, indexed columns).
+# The trigram tokenizer matches any substring of three or more characters,
+# like the LIKE '%text%' filters it replaces, but through an index.
+SEARCH_INDEXES = [
+    ('billing_fts', 'billing', 'bill_number', ('customer_name', 'invoice_number')),
+    ('customers_fts', 'customers', 'id', ('name', 'contact', 'address')),
+    ('products_fts', 'products', 'id', ('brand', 'product_name')),
+]
+
+
+def add_search_index(cursor):
+    for fts, table, rowid, columns in SEARCH_INDEXES:
+        column_list = ", ".join(columns)
+        new_values = ", ".join(f"new.{column}" for column in columns)
+        old_values = ", ".join(f"old.{column}" for column in columns)
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {column_list}, content='{table}', content_rowid='{rowid}', tokenize='trigram'
+            )
+        ''')
+
+        # External-content tables are kept in sync by triggers. Updates only
+        # fire for the indexed columns, so stock changes never touch the index.
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts} (rowid, {column_list}) VALUES (new.{rowid}, {new_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', old.{rowid}, {old_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column_list} ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', old.{rowid}, {old_values});
+                INSERT INTO {fts} (rowid, {column_list}) VALUES (new.{rowid}, {new_values});
+            END
+        ''')
+
+        # Index the rows that are already there
+        cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+def add_paise_amounts(cursor):
+    # Exact integer amounts next to the REAL ones; tax.py has the rounding
+    # rules. Bill lines get the line's taxable value and tax, not per unit.
+    cursor.execute('ALTER TABLE billing ADD COLUMN total_paise INTEGER')
+    cursor.execute('ALTER TABLE purchases ADD COLUMN total_paise INTEGER')
+    for column in ('taxable_paise', 'cgst_paise', 'sgst_paise', 'total_paise'):
+        cursor.execute(f'ALTER TABLE bill_items ADD COLUMN {column} INTEGER')
+
+    # Existing rows only have the REAL amounts to go on
+    cursor.execute('UPDATE billing SET total_paise = CAST(ROUND(total_amount * 100) AS INTEGER)')
+    cursor.execute('UPDATE purchases SET total_paise = CAST(ROUND(total_price * 100) AS INTEGER)')
+    cursor.execute('''
+        UPDATE bill_items SET
+            taxable_paise = CAST(ROUND(selling_price * quantity * 100) AS INTEGER),
+            cgst_paise = CAST(ROUND(cgst_amount * quantity * 100) AS INTEGER),
+            sgst_paise = CAST(ROUND(sgst_amount * quantity * 100) AS INTEGER),
+            total_paise = CAST(ROUND(total_price * 100) AS INTEGER)
+    ''')
+
+
+def add_stock_lots(cursor):
+    # Items (a product regardless of price) with their total on hand, and the
+    # lots each receipt adds; see lots.py
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_items (
+            id INTEGER PRIMARY KEY,
+            company_id INTEGER,
+            brand TEXT,
+            product_name TEXT,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (company_id) REFERENCES companies (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_stock_items_identity
+        ON stock_items (product_name, brand, company_id)
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_lots (
+            id INTEGER PRIMARY KEY,
+            item_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            received_date TEXT,
+            expiry_date TEXT,
+            quantity_received INTEGER,
+            quantity INTEGER NOT NULL,
+            transaction_id TEXT,
+            FOREIGN KEY (item_id) REFERENCES stock_items (id),
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        )
+    ''')
+    # Allocation reads an item's open lots in FIFO or FEFO order straight
+    # off these indexes; emptied lots drop out of them
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_stock_lots_fifo
+        ON stock_lots (item_id, received_date, id) WHERE quantity > 0
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_stock_lots_fefo
+        ON stock_lots (item_id, COALESCE(expiry_date, '9999-12-31'), received_date, id) WHERE quantity > 0
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bill_item_lots (
+            bill_item_id INTEGER NOT NULL,
+            lot_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            FOREIGN KEY (bill_item_id) REFERENCES bill_items (id),
+            FOREIGN KEY (lot_id) REFERENCES stock_lots (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_bill_item_lots_item ON bill_item_lots (bill_item_id)')
+
+    # Every existing price row becomes an opening lot of its item
+    cursor.execute('ALTER TABLE products ADD COLUMN item_id INTEGER')
+    cursor.execute('''
+        INSERT INTO stock_items (company_id, brand, product_name, quantity)
+        SELECT company_id, brand, product_name, SUM(MAX(COALESCE(quantity, 0), 0))
+        FROM products GROUP BY product_name, brand, company_id
+    ''')
+    cursor.execute('''
+        UPDATE products SET item_id = (
+            SELECT s.id FROM stock_items s
+            WHERE s.product_name IS products.product_name AND s.brand IS products.brand
+              AND s.company_id IS products.company_id
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_item ON products (item_id)')
+    cursor.execute('''
+        INSERT INTO stock_lots (item_id, product_id, received_date, quantity_received, quantity, transaction_id)
+        SELECT item_id, id, purchase_date, quantity, quantity, 'opening'
+        FROM products WHERE quantity > 0 ORDER BY purchase_date, id
+    ''')
+    # Stock that was oversold before lots existed cannot be on hand
+    cursor.execute('UPDATE products SET quantity = 0 WHERE quantity < 0')
+
+
+def add_rollups(cursor):
+    # Reporting aggregates maintained by post_bill and apply_purchase_lines;
+    # see rollups.py. Bill lines keep the rates they were taxed at and
+    # purchases the price row they were received into, so the rollups can be
+    # rebuilt exactly from the raw rows.
+    cursor.execute('ALTER TABLE bill_items ADD COLUMN cgst_rate REAL')
+    cursor.execute('ALTER TABLE bill_items ADD COLUMN sgst_rate REAL')
+    cursor.execute('''
+        UPDATE bill_items SET
+            cgst_rate = (SELECT p.cgst FROM products p WHERE p.id = bill_items.product_id),
+            sgst_rate = (SELECT p.sgst FROM products p WHERE p.id = bill_items.product_id)
+    ''')
+    cursor.execute('ALTER TABLE purchases ADD COLUMN product_id INTEGER')
+    cursor.execute('''
+        UPDATE purchases SET product_id = (
+            SELECT p.id FROM products p
+            WHERE p.product_name = purchases.product_name AND p.unit_price = purchases.unit_price
+            ORDER BY p.id LIMIT 1
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sales_daily_product (
+            day TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            taxable_paise INTEGER NOT NULL DEFAULT 0,
+            tax_paise INTEGER NOT NULL DEFAULT 0,
+            total_paise INTEGER NOT NULL DEFAULT 0,
+            lines INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, item_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sales_daily_customer (
+            day TEXT NOT NULL,
+            customer_name TEXT NOT NULL,
+            bills INTEGER NOT NULL DEFAULT 0,
+            taxable_paise INTEGER NOT NULL DEFAULT 0,
+            tax_paise INTEGER NOT NULL DEFAULT 0,
+            total_paise INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, customer_name)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sales_monthly_gst (
+            month TEXT NOT NULL,
+            gst_rate REAL NOT NULL,
+            taxable_paise INTEGER NOT NULL DEFAULT 0,
+            cgst_paise INTEGER NOT NULL DEFAULT 0,
+            sgst_paise INTEGER NOT NULL DEFAULT 0,
+            total_paise INTEGER NOT NULL DEFAULT 0,
+            lines INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, gst_rate)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS purchases_daily_item (
+            day TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            value_paise INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, item_id)
+        ) WITHOUT ROWID
+    ''')
+    # Filled by add_rollup_cess, once bill lines have every column the
+    # rebuild reads
+
+
+def add_archives(cursor):
+    # Financial years moved to their own files by archive.py
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archives (
+            year INTEGER PRIMARY KEY,
+            path TEXT NOT NULL,
+            bills INTEGER NOT NULL DEFAULT 0,
+            purchases INTEGER NOT NULL DEFAULT 0,
+            first_bill INTEGER,
+            last_bill INTEGER,
+            archived_at TEXT
+        )
+    ''')
+
+
+# Indexes behind the sortable grid columns: (index, table, expression). The
+# expression must match what the grid sorts the column by for SQLite to use
+# it. Columns an earlier index already leads with (product and customer
+# names) use that one.
+SORT_INDEXES = [
+    ('idx_products_sort_brand', 'products', 'brand'),
+    ('idx_products_sort_quantity', 'products', 'quantity'),
+    ('idx_products_sort_price', 'products', 'unit_price'),
+    ('idx_products_sort_date', 'products', 'purchase_date'),
+    ('idx_products_sort_company', 'products', 'company_id'),
+    ('idx_products_sort_cgst', 'products', 'cgst'),
+    ('idx_products_sort_sgst', 'products', 'sgst'),
+    ('idx_products_sort_cess', 'products', 'cess'),
+    ('idx_billing_sort_invoice', 'billing', 'COALESCE(invoice_number, bill_number)'),
+    ('idx_billing_sort_total', 'billing', 'total_amount'),
+    ('idx_billing_sort_date', 'billing', 'bill_date'),
+    ('idx_purchases_sort_transaction', 'purchases', 'transaction_id'),
+    ('idx_purchases_sort_quantity', 'purchases', 'quantity'),
+    ('idx_purchases_sort_price', 'purchases', 'unit_price'),
+    ('idx_purchases_sort_total', 'purchases', 'total_price'),
+    ('idx_purchases_sort_date', 'purchases', 'purchase_date'),
+]
+
+
+def add_sort_indexes(cursor):
+    for name, table, expression in SORT_INDEXES:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({expression})')
+
+
+def add_stock_ledger(cursor):
+    # Append-only stock movements and end-of-day snapshots; see ledger.py
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_movements (
+            id INTEGER PRIMARY KEY,
+            moved_at TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            product_id INTEGER,
+            lot_id INTEGER,
+            kind TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            value_paise INTEGER NOT NULL,
+            reference TEXT,
+            FOREIGN KEY (item_id) REFERENCES stock_items (id),
+            FOREIGN KEY (lot_id) REFERENCES stock_lots (id)
+        )
+    ''')
+    # Point-in-time reads take the movements after a snapshot by date, for
+    # all items or for one
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_stock_movements_date ON stock_movements (moved_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_stock_movements_item ON stock_movements (item_id, moved_at)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_snapshots (
+            day TEXT PRIMARY KEY,
+            last_movement_id INTEGER NOT NULL,
+            taken_at TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_snapshot_items (
+            day TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            value_paise INTEGER NOT NULL,
+            PRIMARY KEY (day, item_id)
+        ) WITHOUT ROWID
+    ''')
+    for sql in BACKFILL_STATEMENTS:
+        cursor.execute(sql)
+
+
+def add_gst_returns(cursor):
+    # Bill lines keep their cess like the other taxes, and bills the
+    # customer's GSTIN when posted ('' for none), for the GST returns; see
+    # gst_returns.py. Bills posted before this charged no cess.
+    cursor.execute('ALTER TABLE bill_items ADD COLUMN cess_rate REAL')
+    cursor.execute('ALTER TABLE bill_items ADD COLUMN cess_paise INTEGER')
+    cursor.execute('UPDATE bill_items SET cess_rate = 0, cess_paise = 0')
+    cursor.execute('ALTER TABLE billing ADD COLUMN customer_gstin TEXT')
+    cursor.execute('''
+        UPDATE billing SET customer_gstin = COALESCE((
+            SELECT TRIM(c.gst_number) FROM customers c WHERE c.name = billing.customer_name ORDER BY c.id LIMIT 1
+        ), '')
+    ''')
+    # A month's return reads its bills by date and everything it sums from
+    # this index, never the bill_items rows
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bill_items_gst ON bill_items (
+            bill_number, cgst_rate, sgst_rate, taxable_paise, cgst_paise, sgst_paise, cess_paise)
+    ''')
+    # Returns of closed months, as computed once
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS gst_return_periods (
+            month TEXT PRIMARY KEY,
+            computed_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS gst_return_lines (
+            month TEXT NOT NULL,
+            supply TEXT NOT NULL,
+            gstin TEXT NOT NULL,
+            gst_rate REAL NOT NULL,
+            invoices INTEGER NOT NULL,
+            taxable_paise INTEGER NOT NULL,
+            cgst_paise INTEGER NOT NULL,
+            sgst_paise INTEGER NOT NULL,
+            cess_paise INTEGER NOT NULL,
+            lines INTEGER NOT NULL,
+            PRIMARY KEY (month, supply, gstin, gst_rate)
+        ) WITHOUT ROWID
+    ''')
+
+
+def add_rollup_cess(cursor):
+    # Rollup tax includes the cess bills now charge, and the monthly GST
+    # rollup has it on its own; rebuilt from the bills
+    cursor.execute('ALTER TABLE sales_monthly_gst ADD COLUMN cess_paise INTEGER NOT NULL DEFAULT 0')
+    for sql in REBUILD_STATEMENTS:
+        cursor.execute(sql)
+
+
+# Tables whose keys archived rows keep referring to: (table, key column)
+AUTOINCREMENT_KEYS = [
+    ('billing', 'bill_number'),
+    ('bill_items', 'id'),
+]
+
+
+def autoincrement_bill_keys(cursor):
+    # A plain INTEGER PRIMARY KEY hands out one past the largest key still
+    # in the table, so once a year is archived out of main the next bills
+    # would take numbers the archive (and the ledger's references to it)
+    # already holds. The tables are rebuilt with AUTOINCREMENT, which never
+    # reuses a key, with their indexes and triggers as they were.
+    for table, key in AUTOINCREMENT_KEYS:
+        table_sql, = cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        dependents = [row[0] for row in cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+            (table,))]
+        create, count = re.subn(rf'\b{key} INTEGER PRIMARY KEY\b(?! AUTOINCREMENT)',
+                                f'{key} INTEGER PRIMARY KEY AUTOINCREMENT', table_sql, count=1)
+        if not count:
+            continue
+        create = re.sub(rf'^CREATE TABLE "?{table}"?', f'CREATE TABLE {table}_new', create)
+        columns = ", ".join(row[1] for row in cursor.execute(f"PRAGMA table_info({table})"))
+        cursor.execute(create)
+        cursor.execute(f"INSERT INTO {table}_new ({columns}) SELECT {columns} FROM {table}")
+        cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+        for sql in dependents:
+            cursor.execute(sql)
+    # Bills already archived out of main count too. Bill line ids are only
+    # referred to from their own year's file, so main's are enough for them.
+    last_bill, = cursor.execute('''
+        SELECT MAX(COALESCE((SELECT MAX(bill_number) FROM billing), 0),
+                   COALESCE((SELECT MAX(last_bill) FROM archives), 0))
+    ''').fetchone()
+    cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'billing'")
+    cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('billing', ?)", (last_bill,))
+
+
+def add_missing_sort_indexes(cursor):
+    # The tax rate and purchase quantity and price columns; without an
+    # index every page of those sorts read and sorted the whole table
+    add_sort_indexes(cursor)
+
+
+# (version, migration) pairs, applied in order
+MIGRATIONS = [
+    (1, create_base_schema),
+    (2, add_lookup_indexes),
+    (3, add_bill_items),
+    (4, add_search_index),
+    (5, add_paise_amounts),
+    (6, add_stock_lots),
+    (7, add_rollups),
+    (8, add_archives),
+    (9, add_sort_indexes),
+    (10, add_stock_ledger),
+    (11, add_gst_returns),
+    (12, add_rollup_cess),
+    (13, autoincrement_bill_keys),
+    (14, add_missing_sort_indexes),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(db):
+    return db.fetchone("PRAGMA user_version")[0]
+
+
+def migrate(db=None):
+    # Bring the database up to SCHEMA_VERSION. Returns the versions applied.
+    db = db or get_db()
+    applied = []
+    current = schema_version(db)
+    for version, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        with db.transaction():
+            cursor = db.conn.cursor()
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {version}")
+            cursor.close()
+        applied.append(version)
+    return applied
@@ -0,0 +1,268 @@
+import tkinter as tk
+from tkinter import ttk
+
+PAGE_SIZE = 200
+
+# Fetch the next page once the visible part of the tree reaches this far down
+PREFETCH_AT = 0.9
+
+# Live searches wait this long after the last keystroke, in ms
+SEARCH_DELAY_MS = 250
+
+# Appended to the heading of the column a grid is sorted by
+SORT_ARROWS = {False: " \u25b2", True: " \u25bc"}
+
+
+class PagedTreeview:
+    # Keeps a Treeview filled from a PagedQuery one page at a time. Only the
+    # pages the user has scrolled through are ever inserted into Tk. Rows use
+    # their key as the Treeview item id.
+    #
+    # sort_by() orders the grid by a column. The database does the sorting,
+    # a page at a time like everything else, so a click on a heading costs
+    # the same on ten rows as on a million.
+    #
+    # With a DBWorker the queries run off the Tk thread and only the Treeview
+    # updates happen on it; without one everything runs inline.
+    def __init__(self, tree, source, scrollbar=None, status_label=None, page_size=PAGE_SIZE, noun="rows",
+                 worker=None):
+        self.tree = tree
+        self.base_source = source
+        self.sort = None   # (column index, descending) or None for key order
+        self.source = source
+        self.scrollbar = scrollbar
+        self.status_label = status_label
+        self.page_size = page_size
+        self.noun = noun
+        self.worker = worker
+
+        self.last_key = None
+        self.exhausted = False
+        self.total = 0
+        self._fetch_pending = False
+        # Bumped on every reload so results of older queries are ignored
+        self._generation = 0
+
+        self.tree.configure(yscrollcommand=self._on_scroll)
+        if self.scrollbar is not None:
+            self.scrollbar.configure(command=self.tree.yview)
+
+    def _run(self, query, on_done, key=None):
+        # Run query on the worker (or inline) and hand the result to on_done
+        # unless the grid has been reloaded or destroyed in the meantime
+        generation = self._generation
+
+        def deliver(result):
+            if generation == self._generation and self.tree.winfo_exists():
+                on_done(result)
+
+        if self.worker is None:
+            deliver(query())
+        else:
+            self.worker.submit(query, on_done=deliver, key=key)
+
+    def set_source(self, source):
+        self.base_source = source
+        self.source = source.sorted_by(*self.sort) if self.sort else source
+        self.reload()
+
+    def sort_by(self, column):
+        # Sort by the column at index column; again on the same column
+        # reverses the order
+        descending = self.sort is not None and self.sort[0] == column and not self.sort[1]
+        self.sort = (column, descending)
+        for index, name in enumerate(self.tree["columns"]):
+            arrow = SORT_ARROWS[descending] if index == column else ""
+            self.tree.heading(name, text=name + arrow)
+        self.set_source(self.base_source)
+
+    def reload(self, on_loaded=None):
+        # Drop everything and show the first page again, then call on_loaded.
+        # The rows go in first; counting a big table takes longer than
+        # reading a page of it, so the total follows in a query of its own.
+        self._generation += 1
+        self._fetch_pending = True
+        source, page_size = self.source, self.page_size
+        if self.status_label is not None:
+            self.status_label.config(text=f"Loading {self.noun}...")
+
+        def show(rows):
+            self._show_first_page(rows)
+            if not self.exhausted:
+                self._run(source.count, self._show_total, key=(self, "count"))
+            if on_loaded is not None:
+                on_loaded()
+
+        self._run(lambda: source.page(None, page_size), show, key=self)
+
+    def _show_first_page(self, rows):
+        children = self.tree.get_children()
+        if children:
+            self.tree.delete(*children)
+        self.last_key = None
+        self.exhausted = False
+        # Unknown until counted, unless this one page is everything
+        self.total = None if len(rows) == self.page_size else len(rows)
+        self._append_page(rows)
+
+    def _show_total(self, total):
+        self.total = total
+        self._update_status()
+
+    def _add_to_total(self, delta):
+        if self.total is not None:
+            self.total += delta
+
+    def fetch_more(self):
+        if self.exhausted:
+            self._fetch_pending = False
+            return
+        self._fetch_pending = True
+        source, last_key, page_size = self.source, self.last_key, self.page_size
+        self._run(lambda: source.page(last_key, page_size), self._append_page)
+
+    def _append_page(self, rows):
+        self._fetch_pending = False
+        for row in rows:
+            if not self.tree.exists(str(row[0])):
+                self.tree.insert("", "end", iid=str(row[0]), values=row[1:])
+        if rows:
+            self.last_key = self.source.cursor(rows[-1])
+        if len(rows) < self.page_size:
+            self.exhausted = True
+        self._update_status()
+
+    def follow(self, changes, table):
+        # Patch the grid from every committed change to table until the tree
+        # is destroyed. Changes may be published from the worker thread, so
+        # they are handed to the Tk thread first.
+        def on_change(change):
+            if self.worker is None:
+                self.apply_change(change)
+            else:
+                self.worker.call_soon(self.apply_change, change)
+
+        unsubscribe = changes.subscribe(table, on_change)
+        self.tree.bind("<Destroy>", lambda event: unsubscribe(), add="+")
+
+    def apply_change(self, change):
+        # Patch only the rows named in a database Change instead of reloading.
+        # Inserted rows beyond the loaded pages show up when scrolled to.
+        if not self.tree.winfo_exists():
+            return
+        if change.reset or len(change.inserted) + len(change.updated) + len(change.deleted) > self.page_size:
+            # Bulk changes (e.g. an import) are cheaper as one fresh first page
+            self.reload()
+            return
+
+        for key in change.deleted:
+            if self.tree.exists(str(key)):
+                self.tree.delete(str(key))
+                self._add_to_total(-1)
+
+        loaded = [key for key in change.updated if self.tree.exists(str(key))]
+        keys = loaded + change.inserted
+        if keys:
+            source = self.source
+            self._run(lambda: source.rows_for_keys(keys), lambda rows: self._patch_rows(change, rows))
+        else:
+            self._update_status()
+
+    def _patch_rows(self, change, rows):
+        rows = {row[0]: row for row in rows}
+
+        for key in change.updated:
+            if not self.tree.exists(str(key)):
+                continue
+            row = rows.get(key)
+            if row is None:
+                # No longer matches the current filter
+                self.tree.delete(str(key))
+                self._add_to_total(-1)
+            else:
+                self.tree.item(str(key), values=row[1:])
+
+        inserted = [key for key in change.inserted if key in rows and not self.tree.exists(str(key))]
+        if inserted and self.sort is not None:
+            # Where a new row belongs in a sorted grid is the database's call
+            self.reload()
+            return
+        for key in inserted:
+            row = rows[key]
+            self._add_to_total(1)
+            if self.exhausted or (self.last_key is not None and key <= self.last_key):
+                self.tree.insert("", self._position_for(key), iid=str(key), values=row[1:])
+                if self.last_key is None or key > self.last_key:
+                    self.last_key = key
+
+        self._update_status()
+
+    def _position_for(self, key):
+        # Index that keeps the tree ordered by key; new keys are usually the
+        # largest, so look from the end
+        children = self.tree.get_children()
+        index = len(children)
+        while index > 0 and int(children[index - 1]) > key:
+            index -= 1
+        return index
+
+    def loaded_count(self):
+        return len(self.tree.get_children())
+
+    def _update_status(self):
+        if self.status_label is not None:
+            total = "..." if self.total is None else self.total
+            self.status_label.config(text=f"Showing {self.loaded_count()} of {total} {self.noun}")
+
+    def _on_scroll(self, first, last):
+        if self.scrollbar is not None:
+            self.scrollbar.set(first, last)
+        if not self.exhausted and not self._fetch_pending and float(last) >= PREFETCH_AT:
+            self._fetch_pending = True
+            self.tree.after_idle(self.fetch_more)
+
+
+class Debounced:
+    # Calls fn once input has been quiet for delay_ms; each call restarts
+    # the wait. Use as an event callback, e.g. for <KeyRelease>.
+    def __init__(self, widget, fn, delay_ms=SEARCH_DELAY_MS):
+        self.widget = widget
+        self.fn = fn
+        self.delay_ms = delay_ms
+        self._pending = None
+
+    def __call__(self, event=None):
+        self.cancel()
+        self._pending = self.widget.after(self.delay_ms, self.flush)
+
+    def cancel(self):
+        if self._pending is not None:
+            self.widget.after_cancel(self._pending)
+            self._pending = None
+
+    def flush(self, event=None):
+        # Run now instead of waiting, e.g. when Enter is pressed
+        self.cancel()
+        if self.widget.winfo_exists():
+            self.fn()
+
+
+def paged_tree(parent, columns, source, noun="rows", worker=None, **tree_options):
+    # Build a Treeview with a vertical scrollbar and status line inside a frame.
+    # Clicking a column heading sorts by that column.
+    # Returns (frame, tree, pager); the caller packs or grids the frame.
+    frame = ttk.Frame(parent)
+    tree = ttk.Treeview(frame, columns=columns, show='headings', **tree_options)
+    for col in columns:
+        tree.heading(col, text=col)
+    scrollbar = ttk.Scrollbar(frame, orient="vertical")
+    status_label = ttk.Label(frame, anchor="w")
+
+    status_label.pack(side=tk.BOTTOM, fill=tk.X)
+    scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+    pager = PagedTreeview(tree, source, scrollbar=scrollbar, status_label=status_label, noun=noun, worker=worker)
+    for index, col in enumerate(columns):
+        tree.heading(col, command=lambda index=index: pager.sort_by(index))
+    return frame, tree, pager
@@ -0,0 +1,234 @@
+import argparse
+import sys
+import time
+
+from database import configure, get_db
+
+# Reporting aggregates kept up to date by the transactions that post bills
+# and receive stock, so reports read a few thousand rollup rows instead of
+# scanning billing, bill_items and purchases:
+#
+#   sales_daily_product   day x item: quantity, taxable, tax, total, lines
+#   sales_daily_customer  day x customer: bills, taxable, tax, total
+#   sales_monthly_gst     month x GST rate: taxable, CGST, SGST, CESS, total, lines
+#   purchases_daily_item  day x item: quantity, value
+#
+# Amounts are in paise; tax is CGST + SGST + CESS, so taxable + tax = total.
+# Days are 'YYYY-MM-DD', months 'YYYY-MM'. The rebuild command regenerates
+# everything from the raw tables of the main database; the rows of archived
+# years, whose bills and purchases have left it, are kept as they are. Lines
+# whose product is gone are counted under item 0, rows without a date under
+# day ''.
+
+# Rollup table -> its date column
+ROLLUP_TABLES = {
+    'sales_daily_product': 'day',
+    'sales_daily_customer': 'day',
+    'sales_monthly_gst': 'month',
+    'purchases_daily_item': 'day',
+}
+
+# Rows dated outside every archived financial year; 'YYYY-04' bounds work
+# for days and months alike
+NOT_ARCHIVED = '''
+    NOT EXISTS (SELECT 1 FROM archives a WHERE {column} >= a.year || '-04' AND {column} < (a.year + 1) || '-04')
+'''
+
+# Statements that recompute every rollup from the raw rows, in order
+REBUILD_STATEMENTS = [
+    *(f"DELETE FROM {table} WHERE {NOT_ARCHIVED.format(column=column)}" for table, column in ROLLUP_TABLES.items()),
+    '''
+    INSERT INTO sales_daily_product (day, item_id, quantity, taxable_paise, tax_paise, total_paise, lines)
+    SELECT COALESCE(substr(b.bill_date, 1, 10), ''), COALESCE(p.item_id, 0),
+           COALESCE(SUM(i.quantity), 0), COALESCE(SUM(i.taxable_paise), 0),
+           COALESCE(SUM(i.cgst_paise + i.sgst_paise + COALESCE(i.cess_paise, 0)), 0),
+           COALESCE(SUM(i.total_paise), 0), COUNT(*)
+    FROM bill_items i
+    JOIN billing b ON b.bill_number = i.bill_number
+    LEFT JOIN products p ON p.id = i.product_id
+    GROUP BY 1, 2
+    ''',
+    '''
+    INSERT INTO sales_daily_customer (day, customer_name, bills, taxable_paise, tax_paise, total_paise)
+    SELECT COALESCE(substr(b.bill_date, 1, 10), ''), COALESCE(b.customer_name, ''), COUNT(*),
+           COALESCE(SUM(l.taxable_paise), 0), COALESCE(SUM(l.tax_paise), 0), COALESCE(SUM(b.total_paise), 0)
+    FROM billing b
+    LEFT JOIN (
+        SELECT bill_number, SUM(taxable_paise) AS taxable_paise,
+               SUM(cgst_paise + sgst_paise + COALESCE(cess_paise, 0)) AS tax_paise
+        FROM bill_items GROUP BY bill_number
+    ) l ON l.bill_number = b.bill_number
+    GROUP BY 1, 2
+    ''',
+    '''
+    INSERT INTO sales_monthly_gst (month, gst_rate, taxable_paise, cgst_paise, sgst_paise, cess_paise, total_paise,
+                                   lines)
+    SELECT COALESCE(substr(b.bill_date, 1, 7), ''), ROUND(COALESCE(i.cgst_rate, 0) + COALESCE(i.sgst_rate, 0), 4),
+           COALESCE(SUM(i.taxable_paise), 0), COALESCE(SUM(i.cgst_paise), 0), COALESCE(SUM(i.sgst_paise), 0),
+           COALESCE(SUM(i.cess_paise), 0), COALESCE(SUM(i.total_paise), 0), COUNT(*)
+    FROM bill_items i
+    JOIN billing b ON b.bill_number = i.bill_number
+    GROUP BY 1, 2
+    ''',
+    '''
+    INSERT INTO purchases_daily_item (day, item_id, quantity, value_paise)
+    SELECT COALESCE(substr(u.purchase_date, 1, 10), ''), COALESCE(p.item_id, 0),
+           COALESCE(SUM(u.quantity), 0), COALESCE(SUM(u.total_paise), 0)
+    FROM purchases u
+    LEFT JOIN products p ON p.id = u.product_id
+    GROUP BY 1, 2
+    ''',
+]
+
+
+def gst_rate(cgst_rate, sgst_rate):
+    # The combined rate a line is reported under, e.g. 9 + 9 -> 18.0
+    return round((cgst_rate or 0) + (sgst_rate or 0), 4)
+
+
+def record_bill(db, bill_date, customer_name, lines, item_of):
+    # Add one posted bill to the sales rollups. lines are priced BillLines;
+    # item_of maps their product ids to item ids. Call inside the bill's
+    # transaction so the rollups commit or roll back with it.
+    day, month = bill_date[:10], bill_date[:7]
+    per_item = {}
+    per_rate = {}
+    for line in lines:
+        item = per_item.setdefault(item_of.get(line.product_id, 0), [0, 0, 0, 0, 0])
+        item[0] += line.quantity
+        item[1] += line.taxable_paise
+        item[2] += line.cgst_paise + line.sgst_paise + line.cess_paise
+        item[3] += line.total_paise
+        item[4] += 1
+        rate = per_rate.setdefault(gst_rate(line.cgst_rate, line.sgst_rate), [0, 0, 0, 0, 0, 0])
+        rate[0] += line.taxable_paise
+        rate[1] += line.cgst_paise
+        rate[2] += line.sgst_paise
+        rate[3] += line.cess_paise
+        rate[4] += line.total_paise
+        rate[5] += 1
+
+    with db.transaction():
+        db.executemany('''
+            INSERT INTO sales_daily_product (day, item_id, quantity, taxable_paise, tax_paise, total_paise, lines)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (day, item_id) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                taxable_paise = taxable_paise + excluded.taxable_paise,
+                tax_paise = tax_paise + excluded.tax_paise,
+                total_paise = total_paise + excluded.total_paise,
+                lines = lines + excluded.lines
+        ''', [(day, item_id, *sums) for item_id, sums in per_item.items()])
+        db.execute('''
+            INSERT INTO sales_daily_customer (day, customer_name, bills, taxable_paise, tax_paise, total_paise)
+            VALUES (?, ?, 1, ?, ?, ?)
+            ON CONFLICT (day, customer_name) DO UPDATE SET
+                bills = bills + 1,
+                taxable_paise = taxable_paise + excluded.taxable_paise,
+                tax_paise = tax_paise + excluded.tax_paise,
+                total_paise = total_paise + excluded.total_paise
+        ''', (day, customer_name or '', sum(s[1] for s in per_item.values()), sum(s[2] for s in per_item.values()),
+              sum(s[3] for s in per_item.values())))
+        db.executemany('''
+            INSERT INTO sales_monthly_gst (month, gst_rate, taxable_paise, cgst_paise, sgst_paise, cess_paise,
+                                           total_paise, lines)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (month, gst_rate) DO UPDATE SET
+                taxable_paise = taxable_paise + excluded.taxable_paise,
+                cgst_paise = cgst_paise + excluded.cgst_paise,
+                sgst_paise = sgst_paise + excluded.sgst_paise,
+                cess_paise = cess_paise + excluded.cess_paise,
+                total_paise = total_paise + excluded.total_paise,
+                lines = lines + excluded.lines
+        ''', [(month, rate, *sums) for rate, sums in per_rate.items()])
+
+
+def record_purchases(db, purchase_date, rows):
+    # Add received stock to the purchase rollup: rows of (item_id, quantity,
+    # value in paise). Call inside the purchase's transaction.
+    day = purchase_date[:10]
+    per_item = {}
+    for item_id, quantity, value in rows:
+        sums = per_item.setdefault(item_id, [0, 0])
+        sums[0] += quantity
+        sums[1] += value
+    with db.transaction():
+        db.executemany('''
+            INSERT INTO purchases_daily_item (day, item_id, quantity, value_paise)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (day, item_id) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                value_paise = value_paise + excluded.value_paise
+        ''', [(day, item_id, quantity, value) for item_id, (quantity, value) in per_item.items()])
+
+
+def rebuild(db=None):
+    # Recompute every rollup from billing, bill_items and purchases in one
+    # transaction, keeping the archived years' rows. Returns the seconds
+    # taken.
+    db = db or get_db()
+    start = time.perf_counter()
+    with db.transaction():
+        for sql in REBUILD_STATEMENTS:
+            db.execute(sql)
+    return time.perf_counter() - start
+
+
+def daily_sales(db, start_day, end_day):
+    # [(day, bills, taxable, tax, total)] in paise, one row per day
+    return db.fetchall('''
+        SELECT day, SUM(bills), SUM(taxable_paise), SUM(tax_paise), SUM(total_paise)
+        FROM sales_daily_customer WHERE day BETWEEN ? AND ?
+        GROUP BY day ORDER BY day
+    ''', (start_day, end_day))
+
+
+def top_products(db, start_day, end_day, limit=20):
+    # [(product name, brand, quantity, total)] best sellers by value
+    return db.fetchall('''
+        SELECT s.product_name, s.brand, SUM(r.quantity), SUM(r.total_paise) AS total
+        FROM sales_daily_product r LEFT JOIN stock_items s ON s.id = r.item_id
+        WHERE r.day BETWEEN ? AND ?
+        GROUP BY r.item_id ORDER BY total DESC LIMIT ?
+    ''', (start_day, end_day, limit))
+
+
+def monthly_gst(db, month):
+    # [(GST rate, taxable, CGST, SGST, CESS, total, lines)] for 'YYYY-MM'
+    return db.fetchall('''
+        SELECT gst_rate, taxable_paise, cgst_paise, sgst_paise, cess_paise, total_paise, lines
+        FROM sales_monthly_gst WHERE month = ? ORDER BY gst_rate
+    ''', (month,))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain and read the reporting rollups.")
+    parser.add_argument("--db", default=None, help="database file (default: stock_management.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild", help="recompute every rollup from the raw tables")
+    top = commands.add_parser("top-products", help="best sellers between two days")
+    top.add_argument("start_day")
+    top.add_argument("end_day")
+    top.add_argument("--limit", type=int, default=20)
+    gst = commands.add_parser("gst", help="sales per GST rate for a month")
+    gst.add_argument("month", help="YYYY-MM")
+    args = parser.parse_args(argv)
+
+    from migrations import migrate
+    db = configure(args.db) if args.db else get_db()
+    migrate(db)
+
+    if args.command == "rebuild":
+        print(f"Rebuilt rollups in {rebuild(db):.2f}s")
+    elif args.command == "top-products":
+        for name, brand, quantity, total in top_products(db, args.start_day, args.end_day, args.limit):
+            print(f"{name or '?':<30} {brand or '':<15} {quantity:>8} {total / 100:>14.2f}")
+    elif args.command == "gst":
+        for rate, taxable, cgst, sgst, cess, total, lines in monthly_gst(db, args.month):
+            print(f"{rate:>6}% taxable {taxable / 100:>14.2f} CGST {cgst / 100:>12.2f} "
+                  f"SGST {sgst / 100:>12.2f} CESS {cess / 100:>10.2f} total {total / 100:>14.2f} ({lines} lines)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
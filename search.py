@@ -0,0 +1,101 @@
+from database import PagedQuery
+
+# Live searches show only the best matches; nobody scrolls past these
+SEARCH_LIMIT = 100
+
+# The trigram index can only answer searches of at least three characters
+MIN_SEARCH_LENGTH = 3
+
+# Only this many of the newest matches are ranked. A common substring can
+# match most of a large table, and scoring every match is what makes a
+# search slow; newer rows are the likelier target anyway.
+RANK_WINDOW = 2000
+
+
+def match_expression(text):
+    # FTS5 query matching text as a substring, or None if text is too short.
+    # The text is quoted as one phrase so user input is never parsed as
+    # FTS5 syntax (AND, NEAR, column filters, ...).
+    text = " ".join((text or "").split())
+    if len(text) < MIN_SEARCH_LENGTH:
+        return None
+    return '"' + text.replace('"', '""') + '"'
+
+
+def ranked_matches_sql(fts_table):
+    # (match_id, match_rank) of the best matches among the newest
+    # RANK_WINDOW; takes the MATCH expression and a limit as parameters
+    return (
+        f"SELECT match_id, match_rank FROM ("
+        f"SELECT rowid AS match_id, bm25({fts_table}) AS match_rank FROM {fts_table} "
+        f"WHERE {fts_table} MATCH ? ORDER BY rowid DESC LIMIT {RANK_WINDOW}"
+        f") ORDER BY match_rank LIMIT ?"
+    )
+
+
+class RankedSearch:
+    # The top matches of a full-text search over a PagedQuery's rows, best
+    # first (or in the source's sort order, if it has one). Has the same
+    # interface as PagedQuery so a PagedTreeview can show it; all results
+    # come back as a single page.
+    def __init__(self, source: PagedQuery, fts_table, expression, limit=SEARCH_LIMIT):
+        self.source = source
+        self.fts_table = fts_table
+        self.expression = expression
+        self.limit = limit
+        self.key = source.key
+
+        # Rank inside the FTS table first, then join only the winners
+        condition = f"({source.where}) AND " if source.where else ""
+        self.page_sql = (
+            f"SELECT {source.key}, {source.columns} FROM ({ranked_matches_sql(fts_table)}) AS matches "
+            f"JOIN {source.from_clause} "
+            f"WHERE {condition}{source.key} = matches.match_id "
+            f"ORDER BY {source.order_by or 'matches.match_rank'}"
+        )
+        self.count_sql = f"SELECT COUNT(*) FROM (SELECT 1 FROM {fts_table} WHERE {fts_table} MATCH ? LIMIT ?)"
+        self.matches = source.filtered(
+            f"{condition}{source.key} IN (SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH ?)",
+            source.params + (expression,))
+
+    def sorted_by(self, column, descending=False):
+        # The same matches ordered by one of the source's columns
+        return RankedSearch(self.source.sorted_by(column, descending), self.fts_table, self.expression, self.limit)
+
+    def cursor(self, row):
+        return row[0]
+
+    def page(self, after=None, limit=None):
+        if after is not None:
+            return []
+        return self.source.db.fetchall(self.page_sql, (self.expression, self.limit) + self.source.params)
+
+    def count(self):
+        # Capped at the limit: counting every match of a common substring
+        # would cost more than the search itself
+        return self.source.db.fetchone(self.count_sql, (self.expression, self.limit))[0]
+
+    def rows_for_keys(self, keys):
+        return self.matches.rows_for_keys(keys)
+
+
+def search(source, fts_table, text, limit=SEARCH_LIMIT):
+    # Ranked matches for text among source's rows, or source itself when
+    # text is too short to search
+    expression = match_expression(text)
+    if expression is None:
+        return source
+    return RankedSearch(source, fts_table, expression, limit)
+
+
+def ranked_values(db, fts_table, table, column, text, limit=SEARCH_LIMIT):
+    # One column of the best matching rows of table, e.g. customer names
+    # for a combobox. Returns None when text is too short to search.
+    expression = match_expression(text)
+    if expression is None:
+        return None
+    return [row[0] for row in db.fetchall(f'''
+        SELECT t.{column} FROM ({ranked_matches_sql(fts_table)}) AS matches
+        JOIN {table} t ON t.rowid = matches.match_id
+        ORDER BY matches.match_rank
+    ''', (expression, limit))]
@@ -0,0 +1,384 @@
+import argparse
+import asyncio
+import json
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import fields, is_dataclass
+from urllib.parse import parse_qs, urlsplit
+
+from bill_render import BillData, BillLineData
+from billing import BillLine, PostedBill
+from database import DB_PATH, Database, configure
+from invoices import InvoiceAllocator
+from lots import InsufficientStock
+from migrations import migrate
+from services import (BillingService, DuplicateError, InventoryService, NotFound, PurchaseResult, PurchaseService,
+                      StockItem)
+
+# Server mode for several counters sharing one database: this process owns
+# the file and the counters talk JSON over HTTP to it (see client.py).
+#
+#   python server.py --db stock_management.db --port 8765
+#   python active.py --server http://127.0.0.1:8765
+#
+# Writes go through one queue to one writer task, in order, on one
+# connection, so invoice numbers and stock decrements never race. Reads run
+# concurrently on a pool of threads, each with its own read connection.
+#
+#   POST /call/<service>.<method>      {"args": [...], "kwargs": {...}}
+#   POST /source/<service>.<method>    {"args": [...], "sort": [column, descending] | null,
+#                                       "op": "page" | "count" | "rows_for_keys", "op_args": [...]}
+#   GET  /changes?since=<seq>&wait=<seconds>
+#   GET  /health
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Threads (and read connections) serving reads at the same time
+READ_THREADS = 4
+
+# Committed changes kept for clients catching up; one that falls further
+# behind is told to reload
+CHANGE_LOG_SIZE = 10_000
+
+# Longest a /changes request is held open waiting for something to report
+MAX_CHANGES_WAIT = 30
+
+MAX_BODY = 16 * 1024 * 1024
+
+# Tables whose changes are passed on to clients
+CHANGE_TABLES = ('products', 'purchases', 'billing', 'customers', 'companies', 'gst_slabs')
+
+# Service methods clients may call: name -> read or write
+METHODS = {
+    'inventory.company_names': 'read',
+    'inventory.company_id': 'read',
+    'inventory.gst_rates': 'read',
+    'inventory.product_names': 'read',
+    'inventory.stock_and_rates': 'read',
+    'inventory.stock_at': 'read',
+    'inventory.add_company': 'write',
+    'inventory.add_gst_slab': 'write',
+    'inventory.adjust_stock': 'write',
+    'purchases.receive_stock': 'write',
+    'billing.customer_names': 'read',
+    'billing.customer_address': 'read',
+    'billing.quote_line': 'read',
+    'billing.load_bill': 'read',
+    'billing.load_bills': 'read',
+    'billing.bills_between': 'read',
+    'billing.add_customer': 'write',
+    'billing.post_bill': 'write',
+}
+
+# Paged sources clients may read (see PagedQuery)
+SOURCES = ('inventory.products_source', 'inventory.stock_source', 'purchases.purchases_source',
+           'billing.bills_source')
+SOURCE_OPS = ('page', 'count', 'rows_for_keys')
+
+# Types that cross the wire as {"__type__": name, ...fields}
+DATACLASSES = {cls.__name__: cls for cls in (BillLine, PostedBill, PurchaseResult, StockItem, BillData, BillLineData)}
+
+# Errors re-raised as the same class on the client; anything else arrives as
+# RemoteError
+ERRORS = {cls.__name__: cls for cls in (ValueError, LookupError, DuplicateError, NotFound, InsufficientStock)}
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 409: 'Conflict', 500: 'Internal Server Error'}
+
+
+class RemoteError(RuntimeError):
+    pass
+
+
+def encode(value):
+    # JSON-ready copy of a service argument or result
+    if is_dataclass(value) and not isinstance(value, type):
+        encoded = {f.name: encode(getattr(value, f.name)) for f in fields(value)}
+        encoded['__type__'] = type(value).__name__
+        return encoded
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if isinstance(value, dict):
+        return {key: encode(item) for key, item in value.items()}
+    return value
+
+
+def decode(value):
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    if isinstance(value, dict):
+        if '__type__' in value:
+            cls = DATACLASSES[value['__type__']]
+            return cls(**{key: decode(item) for key, item in value.items() if key != '__type__'})
+        return {key: decode(item) for key, item in value.items()}
+    return value
+
+
+def encode_error(error):
+    name = type(error).__name__
+    return {'type': name if name in ERRORS else 'RemoteError', 'message': str(error)}
+
+
+def decode_error(error):
+    return ERRORS.get(error['type'], RemoteError)(error['message'])
+
+
+class Services:
+    # One set of services over one connection
+    def __init__(self, db):
+        self.db = db
+        self.inventory = InventoryService(db)
+        self.purchases = PurchaseService(db, self.inventory)
+        self.billing = BillingService(db, self.inventory, InvoiceAllocator(db))
+
+    def method(self, name):
+        service, method = name.split('.', 1)
+        return getattr(getattr(self, service), method)
+
+
+class StockServer:
+    def __init__(self, db_path=DB_PATH, host=DEFAULT_HOST, port=DEFAULT_PORT, readers=READ_THREADS):
+        self.db_path = db_path
+        self.host = host
+        self.port = port
+        self.db = configure(db_path)
+        migrate(self.db)
+        self.writer = Services(self.db)
+        self.write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer")
+        self.read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="reader",
+                                                initializer=self._open_reader)
+        self._readers = threading.local()
+        # Reader connections never see the writer's ChangeBus, so their
+        # caches are told about each write here
+        self._reader_caches = []
+        self._reader_caches_lock = threading.Lock()
+        self.changes = deque(maxlen=CHANGE_LOG_SIZE)
+        self.seq = 0
+        self.loop = None
+        self.server = None
+
+    def _open_reader(self):
+        self._readers.services = Services(Database(self.db_path))
+        with self._reader_caches_lock:
+            self._reader_caches.append(self._readers.services.inventory.cache)
+
+    def _read(self, name, args, kwargs):
+        return self._readers.services.method(name)(*args, **kwargs)
+
+    def _read_source(self, name, args, sort, op, op_args):
+        source = self._readers.services.method(name)(*args)
+        if sort:
+            source = source.sorted_by(*sort)
+        return getattr(source, op)(*op_args)
+
+    def _on_change(self, change):
+        # Published on the writer thread after each commit, so readers drop
+        # what it changed before the write's response goes out
+        with self._reader_caches_lock:
+            caches = list(self._reader_caches)
+        for cache in caches:
+            cache.on_change(change)
+        self.loop.call_soon_threadsafe(self._log_change, change)
+
+    def _log_change(self, change):
+        self.seq += 1
+        self.changes.append((self.seq, change))
+        # Wake every waiting /changes request; later ones wait on a new event
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def _write(self, name, args, kwargs):
+        future = self.loop.create_future()
+        await self.writes.put((name, args, kwargs, future))
+        return await future
+
+    async def _writer(self):
+        # The only place writes happen, one at a time in arrival order
+        while True:
+            name, args, kwargs, future = await self.writes.get()
+            try:
+                result = await self.loop.run_in_executor(
+                    self.write_executor, lambda: self.writer.method(name)(*args, **kwargs))
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.writes = asyncio.Queue()
+        self.changed = asyncio.Event()
+        for table in CHANGE_TABLES:
+            self.db.changes.subscribe(table, self._on_change)
+        self._writer_task = asyncio.create_task(self._writer())
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        self._writer_task.cancel()
+        self.read_executor.shutdown(wait=False, cancel_futures=True)
+        self.write_executor.shutdown(wait=True)
+
+    async def _serve(self, reader, writer):
+        # One connection, any number of keep-alive requests
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                request_line, *header_lines = head.decode('latin-1').split("\r\n")
+                try:
+                    method, target, version = request_line.split(" ", 2)
+                except ValueError:
+                    return
+                headers = {}
+                for line in header_lines:
+                    if line:
+                        name, _, value = line.partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, 400, {'error': {'type': 'ValueError',
+                                                                'message': "invalid Content-Length"}})
+                    return
+                if length > MAX_BODY:
+                    await self._respond(writer, 400, {'error': {'type': 'ValueError', 'message': "body too large"}})
+                    return
+                body = await reader.readexactly(length) if length else b""
+
+                status, payload = await self._dispatch(method, target, body)
+                await self._respond(writer, status, payload)
+                if headers.get('connection', '').lower() == 'close' or version == 'HTTP/1.0':
+                    return
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload):
+        body = json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def _dispatch(self, method, target, body):
+        url = urlsplit(target)
+        path = url.path.strip("/").split("/")
+        try:
+            if method == 'GET' and path == ['health']:
+                return 200, {'ok': True, 'seq': self.seq}
+            if method == 'GET' and path == ['changes']:
+                query = parse_qs(url.query)
+                since = int(query.get('since', ['0'])[0])
+                wait = min(float(query.get('wait', ['0'])[0]), MAX_CHANGES_WAIT)
+                return 200, await self._changes_since(since, wait)
+            if method == 'POST' and len(path) == 2 and path[0] == 'call' and path[1] in METHODS:
+                request = json.loads(body or b"{}")
+                args, kwargs = decode(request.get('args', [])), decode(request.get('kwargs', {}))
+                if METHODS[path[1]] == 'write':
+                    result = await self._write(path[1], args, kwargs)
+                else:
+                    result = await self.loop.run_in_executor(self.read_executor, self._read, path[1], args, kwargs)
+                return 200, {'result': encode(result)}
+            if method == 'POST' and len(path) == 2 and path[0] == 'source' and path[1] in SOURCES:
+                request = json.loads(body or b"{}")
+                op = request.get('op')
+                if op not in SOURCE_OPS:
+                    return 400, {'error': {'type': 'ValueError', 'message': f"unknown source operation {op!r}"}}
+                result = await self.loop.run_in_executor(self.read_executor, self._read_source, path[1],
+                                                         decode(request.get('args', [])), request.get('sort'), op,
+                                                         decode(request.get('op_args', [])))
+                return 200, {'result': encode(result)}
+            return 404, {'error': {'type': 'LookupError', 'message': f"no such endpoint {method} {url.path}"}}
+        except InsufficientStock as e:
+            return 409, {'error': encode_error(e)}
+        except (ValueError, LookupError, TypeError) as e:
+            return 400, {'error': encode_error(e)}
+        except Exception as e:
+            return 500, {'error': encode_error(e)}
+
+    async def _changes_since(self, since, wait):
+        # Changes after sequence number since, waiting up to wait seconds
+        # for the first one. reset: the client missed some and must reload.
+        if since == self.seq and wait:
+            try:
+                await asyncio.wait_for(self.changed.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+        missed = since > self.seq or (self.changes and self.changes[0][0] > since + 1)
+        if missed:
+            return {'seq': self.seq, 'reset': True, 'changes': []}
+        return {'seq': self.seq, 'reset': False, 'changes': [
+            {'seq': seq, 'table': change.table, 'inserted': change.inserted, 'updated': change.updated,
+             'deleted': change.deleted}
+            for seq, change in self.changes if seq > since]}
+
+
+class ServerThread:
+    # A StockServer running on its own event loop thread, e.g. for scripts
+    # and benchmarks on localhost. port=0 picks a free port.
+    def __init__(self, db_path=DB_PATH, host=DEFAULT_HOST, port=0, readers=READ_THREADS):
+        self.server = StockServer(db_path, host, port, readers)
+        self.loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="stock-server", daemon=True)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.server.start())
+        self._started.set()
+        self.loop.run_forever()
+
+    def start(self):
+        self.thread.start()
+        self._started.wait()
+        return self
+
+    @property
+    def url(self):
+        return f"http://{self.server.host}:{self.server.port}"
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the stock database to several counters.")
+    parser.add_argument("--db", default=DB_PATH, help=f"database file (default: {DB_PATH})")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"address to listen on (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--readers", type=int, default=READ_THREADS, help="concurrent read connections")
+    args = parser.parse_args(argv)
+
+    async def run():
+        server = await StockServer(args.db, args.host, args.port, args.readers).start()
+        print(f"Serving {args.db} on http://{server.host}:{server.port}")
+        try:
+            await server.serve_forever()
+        finally:
+            server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+import sqlite3
+from dataclasses import dataclass
+from typing import List, Optional
+
+from archive import bills_between
+from bill_render import BILL_DIR, BILL_FORMATS, find_bill, find_bills, render, write_bill
+from billing import BillLine, InsufficientStock, PostedBill, post_bill, price_bill_lines
+from cache import ReferenceCache
+from database import PagedQuery, get_db
+from invoices import InvoiceAllocator
+from ledger import stock_at
+from lots import adjust_stock, parse_expiry
+from search import ranked_values, search
+from stock_import import PurchaseLine, apply_purchase_lines
+from tax import from_paise, price_line
+
+# GUI-free core of the app. Everything the Tk windows do with stock, bills
+# and purchases goes through these classes, so the same code runs from
+# scripts, benchmarks and tests without a tk.Tk() root.
+
+
+class DuplicateError(ValueError):
+    pass
+
+
+class NotFound(LookupError):
+    pass
+
+
+@dataclass
+class StockItem:
+    brand: str
+    product_name: str
+    quantity: int
+    unit_price: float
+    cgst: float = 0.0
+    sgst: float = 0.0
+    cess: float = 0.0
+    expiry_date: Optional[str] = None
+
+
+@dataclass
+class PurchaseResult:
+    transaction_id: str
+    lines: int
+    inserted_products: List[int]
+    updated_products: List[int]
+
+
+def split_gst(gst_rate):
+    # A GST slab is charged half as CGST and half as SGST
+    return gst_rate / 2, gst_rate / 2
+
+
+def line_total(quantity, unit_price, cgst, sgst, cess=0.0):
+    # Price of quantity units including CGST, SGST and CESS percentages,
+    # rounded to the paisa by the tax engine
+    return from_paise(price_line(quantity, unit_price, cgst, sgst, cess)[4])
+
+
+class InventoryService:
+    def __init__(self, db=None, cache=None):
+        self.db = db or get_db()
+        self.changes = self.db.changes
+        # Shared with the other services built on this one
+        self.cache = cache or ReferenceCache(self.db)
+
+    def products_source(self, search_text=None):
+        # Full product grid: company, brand, name, stock, price, taxes, date.
+        # Company sorts by company_id, which products index, so products of a
+        # company stay together without sorting the whole join by name.
+        source = PagedQuery(self.db, '''
+            c.name, p.brand, p.product_name, p.quantity, p.unit_price, p.cgst, p.sgst, p.cess, p.purchase_date
+        ''', "products p JOIN companies c ON p.company_id = c.id", "p.id", sort_keys={0: "p.company_id"})
+        return search(source, "products_fts", search_text)
+
+    def stock_source(self, search_text=None):
+        # Compact product list used when picking items for a bill; with
+        # search_text, the best matches on brand or product name
+        source = PagedQuery(self.db, "brand, product_name, quantity, unit_price", "products", "id")
+        return search(source, "products_fts", search_text)
+
+    def add_company(self, name, gst_number='', contact=''):
+        try:
+            cursor = self.db.execute('''
+                INSERT INTO companies (name, gst_number, contact) VALUES (?, ?, ?)
+            ''', (name, gst_number, contact))
+        except sqlite3.IntegrityError:
+            raise DuplicateError(f"A company named '{name}' already exists.")
+        self.db.notify("companies", inserted=[cursor.lastrowid])
+        return cursor.lastrowid
+
+    def _company_ids(self):
+        # name -> id for every company
+        return self.cache.get("companies", "companies", lambda: {
+            name: company_id for company_id, name in self.db.fetchall("SELECT id, name FROM companies")})
+
+    def company_names(self) -> List[str]:
+        return list(self._company_ids())
+
+    def company_id(self, name) -> Optional[int]:
+        return self._company_ids().get(name)
+
+    def add_gst_slab(self, gst_rate):
+        cursor = self.db.execute("INSERT INTO gst_slabs (gst_rate) VALUES (?)", (gst_rate,))
+        self.db.notify("gst_slabs", inserted=[cursor.lastrowid])
+        return cursor.lastrowid
+
+    def gst_rates(self) -> List[float]:
+        return list(self.cache.get("gst_rates", "gst_slabs", lambda: [
+            row[0] for row in self.db.fetchall("SELECT gst_rate FROM gst_slabs")]))
+
+    def product_names(self) -> List[str]:
+        return list(self.cache.get("product_names", "products", lambda: [
+            row[0] for row in self.db.fetchall("SELECT product_name FROM products")]))
+
+    def adjust_stock(self, product_id, quantity, reason):
+        # Correct a product's stock after a count, breakage and the like;
+        # recorded in the movement ledger with reason
+        try:
+            return adjust_stock(self.db, product_id, quantity, reason)
+        except LookupError as e:
+            raise NotFound(str(e))
+
+    def stock_at(self, at=None):
+        # [(item_id, quantity, value in paise)] on hand at the end of a day
+        # or at a timestamp
+        return stock_at(self.db, at)
+
+    def stock_and_rates(self, product_id):
+        # (quantity on hand, cgst %, sgst %, cess %) for one product. The
+        # quantity is the item's total over all its price lots, not just
+        # this row's.
+        row = self.db.fetchone('''
+            SELECT COALESCE(s.quantity, p.quantity), p.cgst, p.sgst, COALESCE(p.cess, 0)
+            FROM products p LEFT JOIN stock_items s ON s.id = p.item_id
+            WHERE p.id = ?
+        ''', (product_id,))
+        if row is None:
+            raise NotFound("Product not found.")
+        return row
+
+
+class PurchaseService:
+    def __init__(self, db=None, inventory=None):
+        self.db = db or get_db()
+        self.inventory = inventory or InventoryService(self.db)
+        self.changes = self.db.changes
+
+    def purchases_source(self):
+        return PagedQuery(self.db, '''
+            transaction_id, product_name, quantity, unit_price, total_price, purchase_date
+        ''', "purchases", "id")
+
+    def receive_stock(self, company_name, transaction_id, items: List[StockItem]) -> PurchaseResult:
+        # Record a supplier delivery: raise stock and log each item as a purchase
+        if not transaction_id:
+            raise ValueError("Transaction ID cannot be empty.")
+        if not items:
+            raise ValueError("No products to finalize.")
+        company_id = self.inventory.company_id(company_name)
+        if company_id is None:
+            raise NotFound("Please select a company.")
+
+        lines = [PurchaseLine(company_id, item.brand, item.product_name, item.quantity, item.unit_price,
+                              item.cgst, item.sgst, item.cess, transaction_id, parse_expiry(item.expiry_date))
+                 for item in items]
+        inserted, updated = apply_purchase_lines(self.db, lines)
+        return PurchaseResult(transaction_id, len(lines), inserted, updated)
+
+
+class BillingService:
+    def __init__(self, db=None, inventory=None, allocator=None):
+        self.db = db or get_db()
+        self.inventory = inventory or InventoryService(self.db)
+        self.allocator = allocator or InvoiceAllocator(self.db)
+        self.changes = self.db.changes
+        self.cache = self.inventory.cache
+
+    def bills_source(self, search_text=None):
+        # All bills, or the best matches on customer name or invoice number
+        source = PagedQuery(self.db, '''
+            COALESCE(invoice_number, bill_number), customer_name, total_amount, bill_date
+        ''', "billing", "bill_number")
+        return search(source, "billing_fts", search_text)
+
+    def add_customer(self, name, contact, address, gst_number=''):
+        if not name or not contact or not address:
+            raise ValueError("Please fill in all required fields.")
+        try:
+            cursor = self.db.execute('''
+                INSERT INTO customers (name, contact, address, gst_number) VALUES (?, ?, ?, ?)
+            ''', (name, contact, address, gst_number))
+        except sqlite3.IntegrityError:
+            raise DuplicateError(f"A customer named '{name}' already exists.")
+        self.db.notify("customers", inserted=[cursor.lastrowid])
+        return cursor.lastrowid
+
+    def customer_names(self, search_text=None) -> List[str]:
+        # All customers, or the best matches on name, contact or address
+        names = ranked_values(self.db, "customers_fts", "customers", "name", search_text)
+        if names is None:
+            names = list(self.cache.get("customer_names", "customers", lambda: [
+                row[0] for row in self.db.fetchall("SELECT name FROM customers")]))
+        return names
+
+    def customer_address(self, name) -> str:
+        return self.cache.detail("customer_address", "customers", name, self._load_customer_address)
+
+    def _load_customer_address(self, name):
+        row = self.db.fetchone("SELECT address FROM customers WHERE name = ?", (name,))
+        return row[0] if row else ""
+
+    def quote_line(self, product_id, product_name, quantity, selling_price) -> BillLine:
+        # Price one bill line, checking it against the stock on hand
+        if quantity <= 0:
+            raise ValueError("Quantity must be positive.")
+        available_stock, cgst_rate, sgst_rate, cess_rate = self.inventory.stock_and_rates(product_id)
+        if quantity > available_stock:
+            raise InsufficientStock(f"Requested quantity exceeds available stock. Available: {available_stock}")
+
+        line = BillLine(product_id, product_name, quantity, selling_price, 0.0, 0.0, 0.0,
+                        cgst_rate=cgst_rate, sgst_rate=sgst_rate, cess_rate=cess_rate)
+        return price_bill_lines([line])[0][0]
+
+    def post_bill(self, customer_name, lines: List[BillLine]) -> PostedBill:
+        if not customer_name:
+            raise ValueError("Please select a customer.")
+        if not lines:
+            raise ValueError("Please add at least one item to the bill.")
+        return post_bill(self.db, customer_name, lines, allocator=self.allocator)
+
+    def save_bill(self, bill_number, formats=BILL_FORMATS, root=BILL_DIR):
+        # Render a posted bill from the database and write its files.
+        # Returns (text rendering, written paths).
+        bill = self.load_bill(bill_number)
+        return render(bill, 'text'), write_bill(bill, formats, root)
+
+    def load_bill(self, bill_number):
+        # A posted bill from the main database or, once its year has been
+        # archived, from that year's archive
+        return find_bill(self.db, bill_number)
+
+    def bills_between(self, start_day=None, end_day=None):
+        # (bill number, invoice number, customer, total, date) for a date
+        # range, reading the archived years it reaches
+        return bills_between(self.db, start_day, end_day)
+
+    def reprint_bills(self, bill_numbers, formats=BILL_FORMATS, root=BILL_DIR) -> List[str]:
+        # Write the files of several posted bills again; returns the paths.
+        # bill_render.reprint() does the same across processes for big batches.
+        return [path for bill in self.load_bills(bill_numbers) for path in write_bill(bill, formats, root)]
+
+    def load_bills(self, bill_numbers):
+        # Posted bills in the order given, archived years included
+        return find_bills(self.db, bill_numbers)
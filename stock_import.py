@@ -0,0 +1,294 @@
+import argparse
+import csv
+import itertools
+import os
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from database import configure, get_db
+from lots import item_ids, parse_expiry, receive_lots
+from migrations import migrate
+from rollups import record_purchases
+from tax import price_lines
+
+BATCH_SIZE = 5000
+
+# Rejected rows printed before the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+
+@dataclass
+class PurchaseLine:
+    company_id: int
+    brand: str
+    product_name: str
+    quantity: int
+    unit_price: float
+    cgst: float = 0.0
+    sgst: float = 0.0
+    cess: float = 0.0
+    transaction_id: str = ''
+    expiry_date: Optional[str] = None
+
+    @property
+    def key(self):
+        # Product identity, matching idx_products_identity
+        return (self.product_name, self.brand, self.company_id, self.unit_price)
+
+    @property
+    def item_key(self):
+        # The item whatever its price, matching idx_stock_items_identity
+        return (self.product_name, self.brand, self.company_id)
+
+
+class ProductIndex:
+    # In-memory map of product identity -> products.id, for bulk loads where
+    # one SELECT per row would dominate
+    def __init__(self, db):
+        self.ids = {}
+        self.items = {}   # (name, brand, company_id) -> stock_items.id
+        for product_id, name, brand, company_id, unit_price, item_id in db.fetchall(
+                "SELECT id, product_name, brand, company_id, unit_price, item_id FROM products"):
+            self.ids[(name, brand, company_id, unit_price)] = product_id
+            self.items[(name, brand, company_id)] = item_id
+
+    def get(self, key):
+        return self.ids.get(key)
+
+    def add(self, key, product_id):
+        self.ids[key] = product_id
+
+
+def lookup_product_id(db, key):
+    row = db.fetchone('''
+        SELECT id FROM products
+        WHERE product_name = ? AND brand = ? AND company_id = ? AND unit_price = ?
+    ''', key)
+    return row[0] if row else None
+
+
+def apply_purchase_lines(db, lines, index=None, purchase_date=None):
+    # Add stock for every line: known products get their quantity raised, new
+    # ones (or known ones at a new price) are inserted, and each line is
+    # recorded in purchases. Runs in one transaction (or joins the caller's).
+    # Returns (inserted product ids, updated product ids).
+    purchase_date = purchase_date or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    # Several lines for the same product become one write, and one lot per
+    # expiry date and transaction
+    totals = {}
+    first_line = {}
+    lot_totals = {}
+    for line in lines:
+        totals[line.key] = totals.get(line.key, 0) + line.quantity
+        first_line.setdefault(line.key, line)
+        lot = (line.key, line.expiry_date, line.transaction_id)
+        lot_totals[lot] = lot_totals.get(lot, 0) + line.quantity
+
+    with db.transaction():
+        item_keys = list(dict.fromkeys(line.item_key for line in first_line.values()))
+        if index is None:
+            items = item_ids(db, item_keys)
+        else:
+            missing = [key for key in item_keys if key not in index.items]
+            index.items.update(item_ids(db, missing))
+            items = index.items
+
+        updates = []
+        new_keys = []
+        product_ids = {}
+        for key, quantity in totals.items():
+            product_id = index.get(key) if index is not None else lookup_product_id(db, key)
+            if product_id is None:
+                new_keys.append(key)
+            else:
+                updates.append((quantity, product_id))
+                product_ids[key] = product_id
+
+        if updates:
+            db.executemany("UPDATE products SET quantity = quantity + ? WHERE id = ?", updates)
+
+        inserted = []
+        if new_keys:
+            # We hold the write lock, so every id above the current maximum is ours
+            last_id = db.fetchone("SELECT COALESCE(MAX(id), 0) FROM products")[0]
+            db.executemany('''
+                INSERT INTO products (company_id, brand, product_name, quantity, unit_price, cgst, sgst, cess,
+                                      purchase_date, item_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(line.company_id, line.brand, line.product_name, totals[key], line.unit_price,
+                   line.cgst, line.sgst, line.cess, purchase_date, items[line.item_key])
+                  for key, line in ((key, first_line[key]) for key in new_keys)])
+            for product_id, name, brand, company_id, unit_price in db.fetchall(
+                    "SELECT id, product_name, brand, company_id, unit_price FROM products WHERE id > ?", (last_id,)):
+                inserted.append(product_id)
+                product_ids[(name, brand, company_id, unit_price)] = product_id
+                if index is not None:
+                    index.add((name, brand, company_id, unit_price), product_id)
+
+        receive_lots(db, [(items[first_line[key].item_key], product_ids[key], quantity, expiry_date, transaction_id)
+                          for (key, expiry_date, transaction_id), quantity in lot_totals.items()], purchase_date)
+
+        # Purchases record the value before tax
+        taxed = price_lines([line.quantity for line in lines], [line.unit_price for line in lines],
+                            [line.cgst for line in lines], [line.sgst for line in lines],
+                            [line.cess for line in lines])
+        taxable = [amounts[0] for amounts in taxed.rows()]
+        last_purchase = db.fetchone("SELECT COALESCE(MAX(id), 0) FROM purchases")[0]
+        db.executemany('''
+            INSERT INTO purchases (transaction_id, product_name, quantity, unit_price, total_price, total_paise,
+                                   purchase_date, product_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(line.transaction_id, line.product_name, line.quantity, line.unit_price,
+               paise / 100, paise, purchase_date, product_ids[line.key]) for line, paise in zip(lines, taxable)])
+        record_purchases(db, purchase_date, [(items[line.item_key], line.quantity, paise)
+                                             for line, paise in zip(lines, taxable)])
+
+        updated = [product_id for _, product_id in updates]
+        db.notify("products", inserted=inserted, updated=updated)
+        purchase_ids = [row[0] for row in db.fetchall("SELECT id FROM purchases WHERE id > ?", (last_purchase,))]
+        db.notify("purchases", inserted=purchase_ids)
+
+    return inserted, updated
+
+
+class CompanyResolver:
+    # Company name -> id, optionally creating companies that do not exist yet
+    def __init__(self, db, create_missing=False):
+        self.db = db
+        self.create_missing = create_missing
+        self.ids = {name: company_id for company_id, name in db.fetchall("SELECT id, name FROM companies")}
+
+    def resolve(self, name):
+        company_id = self.ids.get(name)
+        if company_id is None and self.create_missing and name:
+            cursor = self.db.execute("INSERT INTO companies (name, gst_number, contact) VALUES (?, '', '')", (name,))
+            company_id = self.ids[name] = cursor.lastrowid
+            self.db.notify("companies", inserted=[company_id])
+        return company_id
+
+
+def parse_row(row, companies, default_company, default_transaction_id):
+    # Validate one CSV row and turn it into a PurchaseLine; raises ValueError
+    def text(column):
+        return (row.get(column) or '').strip()
+
+    def number(column, convert, default=None):
+        value = text(column)
+        if not value:
+            if default is None:
+                raise ValueError(f"missing {column}")
+            return default
+        try:
+            return convert(value)
+        except ValueError:
+            raise ValueError(f"invalid {column} {value!r}")
+
+    product_name = text('product_name')
+    brand = text('brand')
+    if not product_name or not brand:
+        raise ValueError("missing product_name or brand")
+
+    company_name = text('company') or default_company
+    company_id = companies.resolve(company_name)
+    if company_id is None:
+        raise ValueError(f"unknown company {company_name!r}")
+
+    quantity = number('quantity', int)
+    unit_price = number('unit_price', float)
+    if quantity <= 0 or unit_price < 0:
+        raise ValueError("quantity must be positive and unit_price not negative")
+
+    return PurchaseLine(
+        company_id=company_id,
+        brand=brand,
+        product_name=product_name,
+        quantity=quantity,
+        unit_price=unit_price,
+        cgst=number('cgst', float, 0.0),
+        sgst=number('sgst', float, 0.0),
+        cess=number('cess', float, 0.0),
+        transaction_id=text('transaction_id') or default_transaction_id,
+        expiry_date=parse_expiry(text('expiry_date')),
+    )
+
+
+def import_csv(path, db=None, company=None, transaction_id=None, batch_size=BATCH_SIZE,
+               create_companies=False, out=sys.stderr):
+    # Stream a supplier CSV into stock, batch_size rows per transaction.
+    # Returns (rows imported, rows rejected, seconds taken).
+    db = db or get_db()
+    transaction_id = transaction_id or os.path.splitext(os.path.basename(path))[0]
+    companies = CompanyResolver(db, create_missing=create_companies)
+    index = ProductIndex(db)
+
+    imported = rejected = 0
+    row_number = 1  # the header is row 1
+    start = time.perf_counter()
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+        missing = {'product_name', 'brand', 'quantity', 'unit_price'} - set(reader.fieldnames)
+        if missing:
+            raise ValueError(f"{path}: missing columns: {', '.join(sorted(missing))}")
+        if 'company' not in reader.fieldnames and not company:
+            raise ValueError(f"{path}: no company column, pass --company")
+
+        while True:
+            chunk = list(itertools.islice(reader, batch_size))
+            if not chunk:
+                break
+
+            lines = []
+            for row in chunk:
+                row_number += 1
+                try:
+                    lines.append(parse_row(row, companies, company, transaction_id))
+                except ValueError as e:
+                    rejected += 1
+                    if rejected <= MAX_REPORTED_ERRORS:
+                        print(f"row {row_number}: {e}", file=out)
+            if lines:
+                apply_purchase_lines(db, lines, index=index)
+                imported += len(lines)
+
+            elapsed = time.perf_counter() - start
+            print(f"{imported} rows imported, {imported / elapsed:,.0f} rows/sec", file=out)
+
+    elapsed = time.perf_counter() - start
+    if rejected > MAX_REPORTED_ERRORS:
+        print(f"... {rejected - MAX_REPORTED_ERRORS} more rejected rows not shown", file=out)
+    return imported, rejected, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import a supplier CSV into stock.")
+    parser.add_argument("csv_file")
+    parser.add_argument("--db", default=None, help="database file (default: stock_management.db)")
+    parser.add_argument("--company", help="company for rows without a company column")
+    parser.add_argument("--transaction-id", help="purchase transaction id (default: file name)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--create-companies", action="store_true",
+                        help="add companies that are not in the database yet")
+    args = parser.parse_args(argv)
+
+    db = configure(args.db) if args.db else get_db()
+    migrate(db)
+    try:
+        imported, rejected, elapsed = import_csv(
+            args.csv_file, db, company=args.company, transaction_id=args.transaction_id,
+            batch_size=args.batch_size, create_companies=args.create_companies)
+    except (OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    rate = imported / elapsed if elapsed else 0
+    print(f"Imported {imported} rows ({rejected} rejected) in {elapsed:.2f}s, {rate:,.0f} rows/sec")
+    return 0 if imported or not rejected else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
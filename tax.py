@@ -0,0 +1,129 @@
+import math
+from dataclasses import dataclass
+from typing import Sequence
+
+try:
+    import numpy as np
+except ImportError:  # the pure-Python path gives the same results, just slower
+    np = None
+
+# GST arithmetic on exact integers. Money is counted in paise and tax rates
+# in RATE_SCALE units of a percent, so 18% is 180000 and 0.125% is 1250.
+#
+# Rounding rules:
+# - prices and rates given as floats are rounded half up (away from zero) to
+#   the nearest paisa / rate unit when they enter the engine
+# - a line's taxable value is quantity x unit price, exact
+# - CGST, SGST and CESS are each computed on the line's taxable value and
+#   rounded half up to the paisa, per line (not per unit, not per bill)
+# - the line total is taxable value + the three taxes, and batch totals are
+#   exact sums of the line amounts
+RATE_SCALE = 10_000
+
+# Absorbs binary float error when turning 12.345 into paise, so amounts
+# typed with a trailing 5 round up as written
+ROUNDING_EPSILON = 1e-6
+
+# Batches smaller than this are cheaper in plain Python than in NumPy
+VECTORIZE_FROM = 64
+
+
+def to_paise(amount) -> int:
+    # Rupees (float, int or str) -> paise, rounded half up
+    amount = float(amount)
+    paise = math.floor(abs(amount) * 100 + 0.5 + ROUNDING_EPSILON)
+    return -paise if amount < 0 else paise
+
+
+def from_paise(paise) -> float:
+    return paise / 100
+
+
+def rate_units(rate) -> int:
+    # Percentage (e.g. 9 or 0.125) -> RATE_SCALE units
+    return math.floor(abs(float(rate)) * RATE_SCALE + 0.5 + ROUNDING_EPSILON)
+
+
+def half_up(numerator, denominator):
+    # numerator / denominator rounded half away from zero, on ints or on
+    # integer arrays; denominator must be positive
+    if np is not None and isinstance(numerator, np.ndarray):
+        return np.sign(numerator) * ((2 * np.abs(numerator) + denominator) // (2 * denominator))
+    magnitude = (2 * abs(numerator) + denominator) // (2 * denominator)
+    return -magnitude if numerator < 0 else magnitude
+
+
+@dataclass
+class TaxedLines:
+    # Per-line amounts in paise, as lists or NumPy int64 arrays
+    taxable: Sequence[int]
+    cgst: Sequence[int]
+    sgst: Sequence[int]
+    cess: Sequence[int]
+    total: Sequence[int]
+
+    def __len__(self):
+        return len(self.taxable)
+
+    def rows(self):
+        # (taxable, cgst, sgst, cess, total) per line as Python ints
+        columns = [c.tolist() if np is not None and isinstance(c, np.ndarray) else c
+                   for c in (self.taxable, self.cgst, self.sgst, self.cess, self.total)]
+        return list(zip(*columns))
+
+    def sums(self):
+        # (taxable, cgst, sgst, cess, total) for the whole batch
+        return tuple(int(c.sum()) if np is not None and isinstance(c, np.ndarray) else sum(c)
+                     for c in (self.taxable, self.cgst, self.sgst, self.cess, self.total))
+
+
+def compute(quantities, unit_paise, cgst_units, sgst_units, cess_units=None) -> TaxedLines:
+    # Tax a batch of lines given exact inputs: quantities, unit prices in
+    # paise and rates in RATE_SCALE units. One call for any number of lines.
+    count = len(quantities)
+    if cess_units is None:
+        cess_units = [0] * count
+    if not (len(unit_paise) == len(cgst_units) == len(sgst_units) == len(cess_units) == count):
+        raise ValueError("all columns must have one value per line")
+
+    divisor = 100 * RATE_SCALE
+    if np is not None and count >= VECTORIZE_FROM:
+        taxable = np.asarray(quantities, dtype=np.int64) * np.asarray(unit_paise, dtype=np.int64)
+        cgst = half_up(taxable * np.asarray(cgst_units, dtype=np.int64), divisor)
+        sgst = half_up(taxable * np.asarray(sgst_units, dtype=np.int64), divisor)
+        cess = half_up(taxable * np.asarray(cess_units, dtype=np.int64), divisor)
+        return TaxedLines(taxable, cgst, sgst, cess, taxable + cgst + sgst + cess)
+
+    taxable = [q * p for q, p in zip(quantities, unit_paise)]
+    cgst = [half_up(t * r, divisor) for t, r in zip(taxable, cgst_units)]
+    sgst = [half_up(t * r, divisor) for t, r in zip(taxable, sgst_units)]
+    cess = [half_up(t * r, divisor) for t, r in zip(taxable, cess_units)]
+    total = [t + c + s + x for t, c, s, x in zip(taxable, cgst, sgst, cess)]
+    return TaxedLines(taxable, cgst, sgst, cess, total)
+
+
+def price_lines(quantities, unit_prices, cgst_rates, sgst_rates, cess_rates=None) -> TaxedLines:
+    # Same as compute() for the app's own values: prices in rupees and rates
+    # in percent, as stored in products and typed into the windows
+    if np is not None and len(quantities) >= VECTORIZE_FROM:
+        def paise(values):
+            values = np.asarray(values, dtype=np.float64)
+            return (np.sign(values) * np.floor(np.abs(values) * 100 + 0.5 + ROUNDING_EPSILON)).astype(np.int64)
+
+        def units(values):
+            values = np.abs(np.asarray(values, dtype=np.float64))
+            return np.floor(values * RATE_SCALE + 0.5 + ROUNDING_EPSILON).astype(np.int64)
+    else:
+        def paise(values):
+            return [to_paise(v) for v in values]
+
+        def units(values):
+            return [rate_units(v) for v in values]
+
+    return compute(quantities, paise(unit_prices), units(cgst_rates), units(sgst_rates),
+                   units(cess_rates) if cess_rates is not None else None)
+
+
+def price_line(quantity, unit_price, cgst_rate, sgst_rate, cess_rate=0.0):
+    # One line: (taxable, cgst, sgst, cess, total) in paise
+    return price_lines([quantity], [unit_price], [cgst_rate], [sgst_rate], [cess_rate]).rows()[0]